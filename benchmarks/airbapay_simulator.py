@@ -0,0 +1,295 @@
+"""
+Локальный заменитель AirbaPay для нагрузочных тестов и работы без сети
+
+Реализует те запросы, которые делает services.payment.AirbaPayClient:
+вход, создание платежа, статус, списание (charge) и возврат. Платёж
+создаётся в статусе "new" и через случайное время из --transition
+переходит в итоговый статус (success с вероятностью --success-rate, иначе
+error); при переходе вызывается success_callback или failure_callback из
+запроса создания, как это делает настоящий AirbaPay. Задержка ответа и
+доля ответов 503 настраиваются.
+
+Запуск из корня проекта:
+    python benchmarks/airbapay_simulator.py [--port 8090] [--latency-ms 50] [--error-rate 0.05]
+
+и в .env бота: AIRBA_PAY_BASE_URL=http://127.0.0.1:8090, AIRBA_PAY_USER,
+AIRBA_PAY_PASSWORD и AIRBA_PAY_TERMINAL_ID — любые непустые.
+
+Дополнительно для тестов:
+    POST /sim/payments/{id}/complete?status=success — завершить платёж сразу
+    GET  /sim/stats — счётчики запросов и callback-ов
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, Optional, Set, Tuple
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger("airbapay_simulator")
+
+# Статус после успешной оплаты при auto_charge=0 (ждёт списания)
+AUTHORIZED = "auth"
+
+
+class AirbaPaySimulator:
+    """Имитация AirbaPay на aiohttp (состояние платежей — в памяти)"""
+
+    def __init__(self, latency_ms: float = 0, latency_jitter_ms: float = 0, error_rate: float = 0,
+                 transition: Tuple[float, float] = (1, 5), success_rate: float = 1.0,
+                 token_ttl: int = 3600, callbacks: bool = True, callback_retries: int = 3, seed: int = None):
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.transition = transition
+        self.success_rate = success_rate
+        self.token_ttl = token_ttl
+        self.callbacks = callbacks
+        self.callback_retries = callback_retries
+        self.random = random.Random(seed)
+        self.payments: Dict[str, Dict[str, Any]] = {}
+        self.tokens: Dict[str, float] = {}
+        self.stats: Counter = Counter()
+        self._tasks: Set[asyncio.Task] = set()
+        self._runner: Optional[web.AppRunner] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    # Приложение
+
+    def build_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._faults])
+        app.router.add_post("/api/v1/auth/sign-in", self.sign_in)
+        app.router.add_post("/api/v2/payments/", self.create_payment)
+        app.router.add_get("/api/v1/payments/{payment_id}", self.get_payment)
+        app.router.add_put("/api/v1/payments/charge", self.charge_payment)
+        app.router.add_delete("/api/v1/payments/return", self.refund_payment)
+        app.router.add_get("/pay/{payment_id}", self.payment_page)
+        app.router.add_post("/sim/payments/{payment_id}/complete", self.complete_payment)
+        app.router.add_get("/sim/stats", self.get_stats)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8090):
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Симулятор AirbaPay слушает http://{host}:{port}")
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    @web.middleware
+    async def _faults(self, request: web.Request, handler):
+        """Задержка ответа и случайные 503 для запросов API"""
+        if not request.path.startswith("/api/"):
+            return await handler(request)
+        resource = request.match_info.route.resource
+        self.stats[f"{request.method} {resource.canonical if resource else request.path}"] += 1
+        if self.latency_ms or self.latency_jitter_ms:
+            delay = self.latency_ms + self.random.uniform(-self.latency_jitter_ms, self.latency_jitter_ms)
+            await asyncio.sleep(max(0.0, delay) / 1000)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.stats["injected_errors"] += 1
+            return web.json_response({"message": "Service temporarily unavailable"}, status=503)
+        return await handler(request)
+
+    def _authorized(self, request: web.Request) -> bool:
+        token = request.headers.get("Authorization", "")[len("Bearer "):]
+        expires_at = self.tokens.get(token)
+        return expires_at is not None and time.time() < expires_at
+
+    async def _json(self, request: web.Request) -> Dict[str, Any]:
+        try:
+            data = await request.json()
+        except (ValueError, json.JSONDecodeError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    # API
+
+    async def sign_in(self, request: web.Request) -> web.Response:
+        data = await self._json(request)
+        if not data.get("user") or not data.get("password") or not data.get("terminal_id"):
+            return web.json_response({"message": "invalid credentials"}, status=401)
+        token = uuid.uuid4().hex
+        self.tokens[token] = time.time() + self.token_ttl
+        return web.json_response({"access_token": token, "expires_in": self.token_ttl})
+
+    async def create_payment(self, request: web.Request) -> web.Response:
+        if not self._authorized(request):
+            return web.json_response({"message": "unauthorized"}, status=401)
+        data = await self._json(request)
+        if not data.get("invoice_id") or not data.get("amount"):
+            return web.json_response({"message": "invoice_id and amount are required"}, status=400)
+
+        payment_id = str(uuid.uuid4())
+        succeeded = self.random.random() < self.success_rate
+        payment = {
+            "id": payment_id,
+            "invoice_id": data["invoice_id"],
+            "amount": data["amount"],
+            "currency": data.get("currency", "KZT"),
+            "status": "new",
+            "final_status": ("success" if data.get("auto_charge", 1) else AUTHORIZED) if succeeded else "error",
+            "success_callback": data.get("success_callback") or "",
+            "failure_callback": data.get("failure_callback") or "",
+            "transaction_id": "",
+        }
+        self.payments[payment_id] = payment
+        delay = self.random.uniform(*self.transition)
+        self._spawn(self._transition_later(payment_id, delay))
+        return web.json_response({
+            "id": payment_id,
+            "invoice_id": payment["invoice_id"],
+            "status": payment["status"],
+            "redirect_url": f"{request.scheme}://{request.host}/pay/{payment_id}",
+        })
+
+    async def get_payment(self, request: web.Request) -> web.Response:
+        if not self._authorized(request):
+            return web.json_response({"message": "unauthorized"}, status=401)
+        payment = self.payments.get(request.match_info["payment_id"])
+        if not payment:
+            return web.json_response({"message": "payment not found"}, status=404)
+        return web.json_response(self._public(payment))
+
+    async def charge_payment(self, request: web.Request) -> web.Response:
+        if not self._authorized(request):
+            return web.json_response({"message": "unauthorized"}, status=401)
+        data = await self._json(request)
+        payment = self.payments.get(data.get("id") or data.get("payment_id") or "")
+        if not payment:
+            return web.json_response({"message": "payment not found"}, status=404)
+        if payment["status"] != AUTHORIZED:
+            return web.json_response({"message": f"cannot charge payment in status {payment['status']}"}, status=409)
+        payment["status"] = "success"
+        return web.json_response(self._public(payment))
+
+    async def refund_payment(self, request: web.Request) -> web.Response:
+        if not self._authorized(request):
+            return web.json_response({"message": "unauthorized"}, status=401)
+        data = await self._json(request)
+        payment = self.payments.get(data.get("id") or data.get("payment_id") or "")
+        if payment is not None:
+            if payment["status"] != "success":
+                return web.json_response({"message": f"cannot refund payment in status {payment['status']}"}, status=409)
+            payment["status"] = "refunded"
+        return web.json_response({"id": str(uuid.uuid4()), "ext_id": data.get("ext_id"), "status": "success"})
+
+    # Служебные страницы
+
+    async def payment_page(self, request: web.Request) -> web.Response:
+        payment = self.payments.get(request.match_info["payment_id"])
+        if not payment:
+            raise web.HTTPNotFound()
+        return web.Response(
+            text=f"<h1>AirbaPay simulator</h1><p>Платёж {payment['invoice_id']}: {payment['status']}</p>",
+            content_type="text/html",
+        )
+
+    async def complete_payment(self, request: web.Request) -> web.Response:
+        payment = self.payments.get(request.match_info["payment_id"])
+        if not payment:
+            return web.json_response({"message": "payment not found"}, status=404)
+        payment["final_status"] = request.query.get("status", "success")
+        await self._finish(payment)
+        return web.json_response(self._public(payment))
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        statuses = Counter(payment["status"] for payment in self.payments.values())
+        return web.json_response({"requests": dict(self.stats), "payments": dict(statuses)})
+
+    # Переходы статусов и callback-и
+
+    def _public(self, payment: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: payment[key] for key in ("id", "invoice_id", "amount", "currency", "status", "transaction_id")}
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _transition_later(self, payment_id: str, delay: float):
+        await asyncio.sleep(delay)
+        payment = self.payments.get(payment_id)
+        if payment and payment["status"] == "new":
+            await self._finish(payment)
+
+    async def _finish(self, payment: Dict[str, Any]):
+        if payment["status"] == payment["final_status"]:
+            return
+        payment["status"] = payment["final_status"]
+        if payment["status"] in ("success", AUTHORIZED):
+            payment["transaction_id"] = uuid.uuid4().hex[:12]
+            url = payment["success_callback"]
+        else:
+            url = payment["failure_callback"]
+        if self.callbacks and url:
+            self._spawn(self._send_callback(url, self._public(payment)))
+
+    async def _send_callback(self, url: str, body: Dict[str, Any]):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        for attempt in range(1, self.callback_retries + 1):
+            try:
+                async with self._session.post(url, json=body) as response:
+                    if response.status < 500:
+                        self.stats["callbacks_sent"] += 1
+                        self.stats[f"callbacks_{response.status}"] += 1
+                        return
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Callback {url} не доставлен: {e!r}")
+            await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+        self.stats["callbacks_failed"] += 1
+
+
+def _parse_range(value: str) -> Tuple[float, float]:
+    low, _, high = value.partition("-")
+    return float(low), float(high or low)
+
+
+async def _serve(args):
+    simulator = AirbaPaySimulator(
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate,
+        transition=_parse_range(args.transition),
+        success_rate=args.success_rate,
+        callbacks=not args.no_callbacks,
+        seed=args.seed,
+    )
+    await simulator.start(args.host, args.port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await simulator.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=0, help="средняя задержка ответа API")
+    parser.add_argument("--latency-jitter-ms", type=float, default=0, help="разброс задержки ±")
+    parser.add_argument("--error-rate", type=float, default=0, help="доля ответов 503 (0-1)")
+    parser.add_argument("--transition", default="1-5", help="через сколько секунд платёж завершается, мин-макс")
+    parser.add_argument("--success-rate", type=float, default=1.0, help="доля успешных оплат (0-1)")
+    parser.add_argument("--no-callbacks", action="store_true", help="не вызывать success/failure callback")
+    parser.add_argument("--seed", type=int, default=None)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,175 @@
+"""
+Нагрузочный тест платежей против локального симулятора AirbaPay
+
+Поднимает симулятор (benchmarks/airbapay_simulator.py), временную базу,
+приёмник callback-ов и PaymentChecker, создаёт N платежей с заданной
+параллельностью и ждёт, пока все они завершатся. Печатает пропускную
+способность создания платежей, время от создания до активации (p50/p99)
+и метрики (webhook.* — активации по callback, payment_checker.* — по опросу).
+
+Запуск из корня проекта:
+    python benchmarks/payment_load.py [--payments 500] [--concurrency 20] [--latency-ms 50]
+    python benchmarks/payment_load.py --no-callbacks --transition 1-3   # только PaymentChecker
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from airbapay_simulator import AirbaPaySimulator, _parse_range  # noqa: E402
+from database import Database  # noqa: E402
+from services.payment import AirbaPayClient, PaymentService  # noqa: E402
+from services.payment_activation import PaymentActivator  # noqa: E402
+from services.payment_webhook import PaymentWebhookServer  # noqa: E402
+from utils.http_pool import http_pool  # noqa: E402
+from utils.metrics import metrics  # noqa: E402
+from utils.payment_checker import PaymentChecker  # noqa: E402
+
+SIMULATOR_PORT = 18090
+WEBHOOK_PORT = 18091
+
+
+class _SentPhoto:
+    photo = None
+
+
+class _NullBot:
+    """Бот без Telegram: QR-код рендерится, но никуда не отправляется"""
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return None
+
+    async def send_photo(self, chat_id, photo=None, **kwargs):
+        return _SentPhoto()
+
+
+class _TimedActivator(PaymentActivator):
+    """Запоминает, когда активирован каждый платёж"""
+
+    def __init__(self, payment_service):
+        super().__init__(payment_service)
+        self.activated_at = {}
+
+    async def _apply_locked(self, payment, status, transaction_id="", error_message=None):
+        result = await super()._apply_locked(payment, status, transaction_id, error_message)
+        if result["activated"]:
+            self.activated_at[payment["payment_id"]] = time.perf_counter()
+        return result
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def main(args):
+    logging.basicConfig(level=logging.CRITICAL)  # ошибки API видны в метриках
+    simulator = AirbaPaySimulator(
+        latency_ms=args.latency_ms,
+        error_rate=args.error_rate,
+        transition=_parse_range(args.transition),
+        success_rate=args.success_rate,
+        callbacks=not args.no_callbacks,
+        seed=1,
+    )
+    await simulator.start("127.0.0.1", SIMULATOR_PORT)
+
+    workdir = tempfile.mkdtemp(prefix="payment_load_")
+    db = Database(os.path.join(workdir, "load.db"))
+    await db.init_db()
+    async with db.pool.write() as conn:
+        await conn.execute("INSERT INTO users (user_id, full_name, role) VALUES (1, 'Load', 'user')")
+        await conn.execute(
+            "INSERT INTO subscription_templates (template_id, name, tariff, lessons_total, price) "
+            "VALUES (1, 'Load', '8', 8, 1000)"
+        )
+        await conn.commit()
+
+    client = AirbaPayClient(f"http://127.0.0.1:{SIMULATOR_PORT}", "load", "load", "load")
+    service = PaymentService(client, db, f"http://127.0.0.1:{WEBHOOK_PORT}", webhook_secret="load")
+    activator = _TimedActivator(service)
+    bot = _NullBot()
+    webhook = PaymentWebhookServer(bot, activator, "127.0.0.1", WEBHOOK_PORT, secret="load")
+    await webhook.start()
+    checker = PaymentChecker(db, activator, check_interval=args.check_interval, bot=bot)
+    checker_started = False
+
+    created_at = {}
+    failures = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def purchase():
+        nonlocal failures
+        async with semaphore:
+            subscription_id = await db.create_subscription(1, 1, str(uuid.uuid4()))
+            result = await service.create_payment(1, subscription_id, 1000)
+        if result.get("success"):
+            created_at[result["payment_id"]] = time.perf_counter()
+        else:
+            failures += 1
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(purchase() for _ in range(args.payments)))
+        create_elapsed = time.perf_counter() - started
+
+        # Первая проверка — сразу, без PAYMENT_CHECK_FIRST_DELAY
+        async with db.pool.write() as conn:
+            await conn.execute("UPDATE payments SET next_check_at = created_ts")
+            await conn.commit()
+        await checker.start()
+        checker_started = True
+
+        deadline = time.perf_counter() + args.timeout
+        pending = len(created_at)
+        while time.perf_counter() < deadline:
+            async with db.pool.read() as conn:
+                async with conn.execute("SELECT COUNT(*) FROM payments WHERE status = 'pending'") as cursor:
+                    pending = (await cursor.fetchone())[0]
+            if not pending:
+                break
+            await asyncio.sleep(0.2)
+        total_elapsed = time.perf_counter() - started
+
+        latencies = [
+            activator.activated_at[payment_id] - created
+            for payment_id, created in created_at.items()
+            if payment_id in activator.activated_at
+        ]
+        print(f"Платежей: {args.payments}, параллельность {args.concurrency}, "
+              f"задержка API {args.latency_ms} мс, ошибок API {args.error_rate:.0%}")
+        print(f"Создание: {len(created_at)} за {create_elapsed:.2f} с "
+              f"({len(created_at) / create_elapsed:.0f}/с), не создано {failures}")
+        print(f"Активировано: {len(latencies)}, не завершено {pending}, всего {total_elapsed:.2f} с")
+        print(f"До активации: p50={_percentile(latencies, 0.5):.2f} с, p99={_percentile(latencies, 0.99):.2f} с")
+        print(f"Симулятор: {dict(simulator.stats)}")
+        print(metrics.format_report())
+    finally:
+        if checker_started:
+            await checker.stop()
+        await webhook.stop()
+        await simulator.stop()
+        await http_pool.close()
+        await db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payments", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--transition", default="0.5-3", help="через сколько секунд платёж завершается, мин-макс")
+    parser.add_argument("--success-rate", type=float, default=0.9)
+    parser.add_argument("--no-callbacks", action="store_true", help="активация только через PaymentChecker")
+    parser.add_argument("--check-interval", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=120, help="сколько ждать завершения всех платежей, с")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,62 @@
+"""
+Микробенчмарк движков рендеринга QR-кодов
+
+Для каждого движка из utils.qr_render печатает число рендеров в секунду и
+средний размер результата в байтах.
+
+Запуск из корня проекта:
+    python benchmarks/qr_render_backends.py [--count 300] [--box-size 10] [--error-correction L]
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.qr_render import RENDERERS, build_matrix, get_renderer  # noqa: E402
+
+
+def _measure(render, texts):
+    started = time.perf_counter()
+    total_bytes = 0
+    for text in texts:
+        total_bytes += len(render(text))
+    elapsed = time.perf_counter() - started
+    return len(texts) / elapsed, total_bytes / len(texts)
+
+
+def main(count: int, box_size: int, border: int, error_correction: str):
+    texts = [f"SUBSCRIPTION:{uuid.uuid4()}:{100000 + i}:{i}" for i in range(count)]
+    options = dict(box_size=box_size, border=border, error_correction=error_correction)
+
+    rows = []
+    # Общая часть всех движков — построение матрицы библиотекой qrcode
+    rate, _ = _measure(lambda t: build_matrix(t, error_correction, border), texts)
+    rows.append(("matrix", rate, None))
+    for name in RENDERERS:
+        renderer = get_renderer(name, **options)
+        renderer.render(texts[0])  # прогрев
+        rate, size = _measure(renderer.render, texts)
+        rows.append((name, rate, size))
+    # Фиксированная маска вместо подбора лучшей из восьми
+    renderer = get_renderer("png", mask_pattern=0, **options)
+    rate, size = _measure(renderer.render, texts)
+    rows.append(("png/mask0", rate, size))
+
+    print(f"{count} QR-кодов, box_size={box_size}, border={border}, коррекция {error_correction}")
+    print(f"{'движок':<10}{'рендер/с':>12}{'байт/шт':>12}")
+    for name, rate, size in rows:
+        size_text = f"{size:>12.0f}" if size is not None else f"{'—':>12}"
+        print(f"{name:<10}{rate:>12.0f}{size_text}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=300)
+    parser.add_argument("--box-size", type=int, default=10)
+    parser.add_argument("--border", type=int, default=4)
+    parser.add_argument("--error-correction", default="L", choices=["L", "M", "Q", "H"])
+    args = parser.parse_args()
+    main(args.count, args.box_size, args.border, args.error_correction)
@@ -0,0 +1,92 @@
+"""
+Микробенчмарк: рендер QR-кодов в цикле событий против рендера в пуле
+
+Имитирует всплеск покупок: N одновременных «покупок» рендерят свой QR-код,
+а параллельно работает тикер, который раз в 1 мс просыпается и меряет, на
+сколько опоздал. Задержка тикера — то, сколько ждали бы остальные
+пользователи, пока бот занят рендером.
+
+Запуск из корня проекта:
+    python benchmarks/qr_render_pool.py [--purchases 200] [--workers 4]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.qr_generator import render_qr_png  # noqa: E402
+from utils.render_pool import RenderPool  # noqa: E402
+
+
+def _texts(count: int):
+    return [f"SUBSCRIPTION:{uuid.uuid4()}:{100000 + i}:{i}" for i in range(count)]
+
+
+async def _ticker(stop: asyncio.Event, lags: list):
+    interval = 0.001
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - started - interval) * 1000)
+
+
+async def _burst(texts, render):
+    stop = asyncio.Event()
+    lags = []
+    ticker = asyncio.create_task(_ticker(stop, lags))
+    await asyncio.sleep(0.01)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(render(text) for text in texts))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await ticker
+    lags.sort()
+    return {
+        "elapsed": elapsed,
+        "renders_per_sec": len(texts) / elapsed,
+        "lag_p50": lags[len(lags) // 2] if lags else 0.0,
+        "lag_p99": lags[min(len(lags) - 1, int(len(lags) * 0.99))] if lags else 0.0,
+        "lag_max": lags[-1] if lags else 0.0,
+    }
+
+
+async def main(purchases: int, workers: int, max_pending: int):
+    texts = _texts(purchases)
+    render_qr_png(texts[0])  # прогрев импорта qrcode/PIL
+
+    async def inline(text):
+        await asyncio.sleep(0)
+        return render_qr_png(text)
+
+    results = [("inline", await _burst(texts, inline))]
+    for mode in ("thread", "process"):
+        pool = RenderPool(workers, mode, max_pending)
+        await pool.run(render_qr_png, texts[0])  # запуск исполнителей
+        try:
+            results.append((f"{mode}x{workers}", await _burst(texts, lambda t: pool.run(render_qr_png, t))))
+        finally:
+            pool.shutdown()
+
+    print(f"{purchases} одновременных покупок, очередь пула {max_pending}")
+    print(f"{'режим':<12}{'время, с':>10}{'рендер/с':>10}{'лаг p50':>10}{'лаг p99':>10}{'лаг max':>10}")
+    for name, r in results:
+        print(
+            f"{name:<12}{r['elapsed']:>10.2f}{r['renders_per_sec']:>10.0f}"
+            f"{r['lag_p50']:>10.1f}{r['lag_p99']:>10.1f}{r['lag_max']:>10.1f}"
+        )
+    print("Лаг — опоздание тикера цикла событий в мс.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--purchases", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--max-pending", type=int, default=64)
+    args = parser.parse_args()
+    asyncio.run(main(args.purchases, args.workers, args.max_pending))
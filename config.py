@@ -4,7 +4,65 @@ from dotenv import load_dotenv
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# Смещение местного времени пользователей от UTC (часов): границы суток
+# в статистике админа и партнёра
+LOCAL_UTC_OFFSET = float(os.getenv("LOCAL_UTC_OFFSET", "5"))
 DATABASE_PATH = os.getenv("DATABASE_PATH", "database.db")
+# Пул соединений: количество соединений на чтение и таймаут ожидания (сек)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Профиль PRAGMA, применяемый к каждому соединению SQLite (порядок важен:
+# busy_timeout задаётся первым, чтобы смена journal_mode ждала блокировку).
+# foreign_keys по умолчанию выключен: в старых данных есть платежи,
+# ссылающиеся на удалённые при отмене абонементы.
+DB_PRAGMAS = {
+    "busy_timeout": int(os.getenv("DB_BUSY_TIMEOUT", "5000")),
+    "journal_mode": os.getenv("DB_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("DB_SYNCHRONOUS", "NORMAL"),
+    "cache_size": int(os.getenv("DB_CACHE_SIZE", "-20000")),
+    "mmap_size": int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024))),
+    "temp_store": os.getenv("DB_TEMP_STORE", "MEMORY"),
+    "foreign_keys": os.getenv("DB_FOREIGN_KEYS", "OFF"),
+    "wal_autocheckpoint": int(os.getenv("DB_WAL_AUTOCHECKPOINT", "1000")),
+}
+# Максимум активных QR-кодов в индексе в памяти
+QR_INDEX_CAPACITY = int(os.getenv("QR_INDEX_CAPACITY", "200000"))
+# Фильтр Блума активных QR-кодов: расчётное число кодов и доля ложных срабатываний
+QR_BLOOM_CAPACITY = int(os.getenv("QR_BLOOM_CAPACITY", "1000000"))
+QR_BLOOM_ERROR_RATE = float(os.getenv("QR_BLOOM_ERROR_RATE", "0.01"))
+# Кэш изображений QR-кодов: объём PNG в памяти, число запомненных file_id
+# Telegram и каталог для вытесненных изображений (пусто — не сохранять на диск)
+QR_CACHE_MAX_BYTES = int(os.getenv("QR_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+QR_CACHE_FILE_IDS = int(os.getenv("QR_CACHE_FILE_IDS", "100000"))
+QR_CACHE_DIR = os.getenv("QR_CACHE_DIR", "")
+QR_CACHE_DISK_FILES = int(os.getenv("QR_CACHE_DISK_FILES", "100000"))
+# Рендеринг QR-кодов: движок для фото (png — прямая запись 1-битного PNG,
+# pil — через Pillow), размер модуля в пикселях, ширина рамки в модулях и
+# уровень коррекции ошибок (L/M/Q/H), маска 0-7 (пусто — подбирать лучшую,
+# это в несколько раз медленнее)
+QR_RENDER_BACKEND = os.getenv("QR_RENDER_BACKEND", "png")
+QR_BOX_SIZE = int(os.getenv("QR_BOX_SIZE", "10"))
+QR_BORDER = int(os.getenv("QR_BORDER", "4"))
+QR_ERROR_CORRECTION = os.getenv("QR_ERROR_CORRECTION", "L").upper()
+QR_MASK_PATTERN = int(os.getenv("QR_MASK_PATTERN")) if os.getenv("QR_MASK_PATTERN") else None
+# Ключи подписи токенов QR-кодов: "версия:секрет" через запятую (версии
+# 0-255; старые версии оставляют, пока живут выданные ими коды) и версия
+# для новых кодов (по умолчанию старшая). Без ключей ключ выводится из BOT_TOKEN.
+QR_SIGNING_KEYS = os.getenv("QR_SIGNING_KEYS", "")
+QR_SIGNING_KEY_VERSION = int(os.getenv("QR_SIGNING_KEY_VERSION")) if os.getenv("QR_SIGNING_KEY_VERSION") else None
+# Распознавание QR-кодов на фото: берётся наименьший вариант фото с меньшей
+# стороной не меньше QR_PHOTO_MIN_SIDE, перед распознаванием оно уменьшается
+# до QR_PHOTO_DECODE_SIDE по большей стороне
+QR_PHOTO_MIN_SIDE = int(os.getenv("QR_PHOTO_MIN_SIDE", "480"))
+QR_PHOTO_DECODE_SIDE = int(os.getenv("QR_PHOTO_DECODE_SIDE", "800"))
+# Пул для рендеринга QR-кодов вне цикла событий: режим (thread/process),
+# число исполнителей и максимум задач в пуле одновременно
+RENDER_POOL_MODE = os.getenv("RENDER_POOL_MODE", "thread")
+RENDER_POOL_WORKERS = int(os.getenv("RENDER_POOL_WORKERS", "2"))
+RENDER_POOL_MAX_PENDING = int(os.getenv("RENDER_POOL_MAX_PENDING", "64"))
+# Периодический checkpoint WAL-журнала (сек, 0 — отключить) и его режим
+DB_WAL_CHECKPOINT_INTERVAL = int(os.getenv("DB_WAL_CHECKPOINT_INTERVAL", "300"))
+DB_WAL_CHECKPOINT_MODE = os.getenv("DB_WAL_CHECKPOINT_MODE", "TRUNCATE")
 ADMIN_IDS = [int(admin_id.strip()) for admin_id in os.getenv("ADMIN_IDS", "").split(",") if admin_id.strip()]
 
 # Настройки AirbaPay
@@ -14,6 +72,60 @@ AIRBA_PAY_PASSWORD = os.getenv("AIRBA_PAY_PASSWORD", "")
 AIRBA_PAY_TERMINAL_ID = os.getenv("AIRBA_PAY_TERMINAL_ID", "")
 AIRBA_PAY_COMPANY_ID = os.getenv("AIRBA_PAY_COMPANY_ID", "230140022645")
 AIRBA_PAY_WEBHOOK_URL = os.getenv("AIRBA_PAY_WEBHOOK_URL", "")
+# Срок жизни токена AirbaPay, если API его не сообщил (сек), и за сколько
+# секунд до истечения обновлять токен заранее
+AIRBA_PAY_TOKEN_TTL = float(os.getenv("AIRBA_PAY_TOKEN_TTL", "3600"))
+AIRBA_PAY_TOKEN_REFRESH_MARGIN = float(os.getenv("AIRBA_PAY_TOKEN_REFRESH_MARGIN", "60"))
+# Таймауты запросов AirbaPay по видам (сек): вход, статус платежа, создание,
+# списание и возврат платежа; остальные запросы — HTTP_TIMEOUT
+AIRBA_PAY_TIMEOUTS = {
+    "auth": float(os.getenv("AIRBA_PAY_AUTH_TIMEOUT", "10")),
+    "status": float(os.getenv("AIRBA_PAY_STATUS_TIMEOUT", "5")),
+    "payment": float(os.getenv("AIRBA_PAY_PAYMENT_TIMEOUT", "20")),
+}
+# Повторы идемпотентных запросов: число попыток, начальная пауза (сек) и
+# доля повторов от числа запросов за последние 10 секунд
+AIRBA_PAY_RETRY_ATTEMPTS = int(os.getenv("AIRBA_PAY_RETRY_ATTEMPTS", "3"))
+AIRBA_PAY_RETRY_DELAY = float(os.getenv("AIRBA_PAY_RETRY_DELAY", "0.5"))
+AIRBA_PAY_RETRY_BUDGET = float(os.getenv("AIRBA_PAY_RETRY_BUDGET", "0.2"))
+# Автомат отключения: после скольких сбоев подряд перестать обращаться к
+# AirbaPay и через сколько секунд попробовать снова
+AIRBA_PAY_BREAKER_THRESHOLD = int(os.getenv("AIRBA_PAY_BREAKER_THRESHOLD", "5"))
+AIRBA_PAY_BREAKER_RECOVERY = float(os.getenv("AIRBA_PAY_BREAKER_RECOVERY", "30"))
+# Встроенный приёмник callback-ов AirbaPay: адрес и порт (0 — не запускать),
+# секрет в параметре token адреса callback-а и перепроверка статуса через API
+# перед активацией абонемента
+AIRBA_PAY_WEBHOOK_HOST = os.getenv("AIRBA_PAY_WEBHOOK_HOST", "0.0.0.0")
+AIRBA_PAY_WEBHOOK_PORT = int(os.getenv("AIRBA_PAY_WEBHOOK_PORT", "8080"))
+AIRBA_PAY_WEBHOOK_SECRET = os.getenv("AIRBA_PAY_WEBHOOK_SECRET", "")
+AIRBA_PAY_WEBHOOK_CONFIRM = os.getenv("AIRBA_PAY_WEBHOOK_CONFIRM", "true").lower() in ("1", "true", "yes")
+# Проверка pending-платежей (PaymentChecker): период прохода (сек), платежей
+# за выборку и одновременных запросов к AirbaPay, первая проверка через
+# PAYMENT_CHECK_FIRST_DELAY сек после создания, дальше интервал удваивается
+# от PAYMENT_CHECK_BACKOFF_BASE до PAYMENT_CHECK_BACKOFF_MAX; платежи старше
+# PAYMENT_PENDING_TTL сек переводятся в expired
+PAYMENT_CHECK_INTERVAL = float(os.getenv("PAYMENT_CHECK_INTERVAL", "15"))
+PAYMENT_CHECK_BATCH = int(os.getenv("PAYMENT_CHECK_BATCH", "50"))
+PAYMENT_CHECK_CONCURRENCY = int(os.getenv("PAYMENT_CHECK_CONCURRENCY", "5"))
+PAYMENT_CHECK_FIRST_DELAY = int(os.getenv("PAYMENT_CHECK_FIRST_DELAY", "60"))
+PAYMENT_CHECK_BACKOFF_BASE = int(os.getenv("PAYMENT_CHECK_BACKOFF_BASE", "30"))
+PAYMENT_CHECK_BACKOFF_MAX = int(os.getenv("PAYMENT_CHECK_BACKOFF_MAX", "1800"))
+PAYMENT_PENDING_TTL = int(os.getenv("PAYMENT_PENDING_TTL", str(24 * 60 * 60)))
+# Сколько секунд ответ «платёж ещё не завершён» отдаётся повторным нажатиям
+# «Проверить платеж» без запроса к AirbaPay
+PAYMENT_STATUS_CACHE_TTL = float(os.getenv("PAYMENT_STATUS_CACHE_TTL", "5"))
+# Сверка платежей (/reconcile): платежей в выборке и транзакции исправлений,
+# одновременных запросов статуса к AirbaPay, окно по умолчанию в днях
+RECONCILE_BATCH = int(os.getenv("RECONCILE_BATCH", "500"))
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "10"))
+RECONCILE_DAYS = int(os.getenv("RECONCILE_DAYS", "31"))
+
+# Общий пул HTTP-соединений для внешних API: максимум соединений, сколько
+# держать простаивающее соединение (сек), таймауты запроса и подключения (сек)
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "20"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
 
 # Роли пользователей
 ROLE_USER = "user"
@@ -27,6 +139,38 @@ STATUS_PENDING = "pending"
 STATUS_APPROVED = "approved"
 STATUS_REJECTED = "rejected"
 
+# Окно защиты от повторного сканирования в одном центре (сек)
+VISIT_DUPLICATE_WINDOW = 5 * 60
+
+# Результаты записи посещения (Database.record_visit)
+VISIT_OK = "ok"
+VISIT_DUPLICATE = "duplicate"
+VISIT_EXHAUSTED = "exhausted"
+VISIT_INACTIVE = "inactive"
+VISIT_NOT_FOUND = "not_found"
+# Дополнительные результаты сканирования QR-кода партнёром (Database.scan_visit)
+SCAN_NOT_REGISTERED = "not_registered"
+SCAN_NOT_PARTNER = "not_partner"
+SCAN_NO_CENTER = "no_center"
+SCAN_CENTER_NOT_APPROVED = "center_not_approved"
+SCAN_RATE_LIMITED = "rate_limited"
+# Строка с кодом не разобрана (групповая отметка, журнал офлайн-сканирований)
+SCAN_INVALID = "invalid"
+# Ограничение частоты сканирований одного партнёра: в среднем в минуту и подряд
+SCAN_RATE_PER_MINUTE = int(os.getenv("SCAN_RATE_PER_MINUTE", "30"))
+SCAN_RATE_BURST = int(os.getenv("SCAN_RATE_BURST", "10"))
+# Целевая задержка обработки одного сканирования на сервере (мс)
+SCAN_LATENCY_BUDGET_MS = float(os.getenv("SCAN_LATENCY_BUDGET_MS", "5"))
+# Максимум QR-кодов в одном сообщении (групповая отметка)
+SCAN_BATCH_MAX = int(os.getenv("SCAN_BATCH_MAX", "50"))
+# Журнал офлайн-сканирований: максимум записей и размер файла, допустимый
+# возраст записей (дней) и смещение местного времени стойки от UTC (часов)
+# для времени без часового пояса
+SCAN_JOURNAL_MAX = int(os.getenv("SCAN_JOURNAL_MAX", "1000"))
+SCAN_JOURNAL_MAX_BYTES = int(os.getenv("SCAN_JOURNAL_MAX_BYTES", str(1024 * 1024)))
+SCAN_JOURNAL_MAX_AGE_DAYS = int(os.getenv("SCAN_JOURNAL_MAX_AGE_DAYS", "7"))
+SCAN_JOURNAL_UTC_OFFSET = float(os.getenv("SCAN_JOURNAL_UTC_OFFSET", str(LOCAL_UTC_OFFSET)))
+
 # Категории курсов
 CATEGORIES = [
     "Языки",
@@ -1,261 +1,137 @@
-import aiosqlite
 import json
 import logging
 from datetime import datetime
-from config import DATABASE_PATH, ROLE_USER, STATUS_PENDING
+from typing import Dict, List, Optional, Tuple
+from config import (
+    DATABASE_PATH, DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_PRAGMAS, PAYMENT_CHECK_FIRST_DELAY, ROLE_PARTNER, ROLE_USER,
+    QR_BLOOM_CAPACITY, QR_BLOOM_ERROR_RATE, QR_INDEX_CAPACITY,
+    STATUS_APPROVED, STATUS_PENDING,
+    SCAN_CENTER_NOT_APPROVED, SCAN_NO_CENTER, SCAN_NOT_PARTNER, SCAN_NOT_REGISTERED,
+    VISIT_DUPLICATE, VISIT_DUPLICATE_WINDOW, VISIT_EXHAUSTED, VISIT_INACTIVE, VISIT_NOT_FOUND, VISIT_OK
+)
+from migrations import run_migrations
+from utils.db_pool import ConnectionPool
+from utils.bloom import BloomFilter
+from utils.metrics import metrics
+from utils.pagination import keyset_condition, keyset_order_by, keyset_select
+from utils.qr_index import ActiveQrIndex, QrRecord
+from utils.timeutils import day_bucket, month_bounds, utc_timestamp
 
 logger = logging.getLogger(__name__)
 
 
 class Database:
-    def __init__(self, db_path: str = DATABASE_PATH):
+    def __init__(self, db_path: str = DATABASE_PATH, pool_size: int = DB_POOL_SIZE,
+                 acquire_timeout: float = DB_POOL_TIMEOUT, pragmas: dict = None,
+                 qr_index_capacity: int = QR_INDEX_CAPACITY, qr_bloom_capacity: int = QR_BLOOM_CAPACITY):
         self.db_path = db_path
+        self.pool = ConnectionPool(
+            db_path,
+            readers=pool_size,
+            acquire_timeout=acquire_timeout,
+            pragmas=DB_PRAGMAS if pragmas is None else pragmas
+        )
+        # Активные QR-коды в памяти; обновляется методами, меняющими абонементы
+        self.qr_index = ActiveQrIndex(qr_index_capacity)
+        # Фильтр Блума по всем активным QR-кодам (без ограничения ёмкости индекса)
+        self.qr_bloom_capacity = qr_bloom_capacity
+        self.qr_bloom = BloomFilter(qr_bloom_capacity, QR_BLOOM_ERROR_RATE)
+
+    async def close(self):
+        """Закрыть соединения с базой данных"""
+        await self.pool.close()
+
+    async def wal_checkpoint(self, mode: str = "PASSIVE"):
+        """
+        Перенести WAL-журнал в основной файл базы.
+        Returns: (busy, log_frames, checkpointed_frames)
+        """
+        mode = mode.upper()
+        if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"Неизвестный режим checkpoint: {mode}")
+        async with self.pool.write() as db:
+            async with db.execute(f"PRAGMA wal_checkpoint({mode})") as cursor:
+                row = await cursor.fetchone()
+        return tuple(row) if row else (0, 0, 0)
 
     async def init_db(self):
-        """Инициализация базы данных"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Пользователи
-            await db.execute(f"""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    full_name TEXT,
-                    role TEXT DEFAULT '{ROLE_USER}',
-                    phone TEXT,
-                    city TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Дети
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS children (
-                    child_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    parent_id INTEGER,
-                    name TEXT NOT NULL,
-                    age INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (parent_id) REFERENCES users(user_id)
-                )
-            """)
-
-            # Образовательные центры
-            await db.execute(f"""
-                CREATE TABLE IF NOT EXISTS centers (
-                    center_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    partner_id INTEGER,
-                    name TEXT NOT NULL,
-                    city TEXT,
-                    address TEXT,
-                    phone TEXT,
-                    category TEXT,
-                    description TEXT,
-                    logo TEXT,
-                    status TEXT DEFAULT '{STATUS_PENDING}',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (partner_id) REFERENCES users(user_id)
-                )
-            """)
-
-            # Преподаватели
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS teachers (
-                    teacher_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    center_id INTEGER,
-                    name TEXT NOT NULL,
-                    description TEXT,
-                    FOREIGN KEY (center_id) REFERENCES centers(center_id)
-                )
-            """)
-
-            # Курсы
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS courses (
-                    course_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    center_id INTEGER,
-                    name TEXT NOT NULL,
-                    description TEXT,
-                    category TEXT,
-                    age_min INTEGER,
-                    age_max INTEGER,
-                    requirements TEXT,
-                    schedule TEXT,
-                    rating REAL DEFAULT 0,
-                    price_4 INTEGER,
-                    price_8 INTEGER,
-                    price_unlimited INTEGER,
-                    photo TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (center_id) REFERENCES centers(center_id)
-                )
-            """)
-
-            # Универсальные абонементы (управляются админом)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS subscription_templates (
-                    template_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    description TEXT,
-                    tariff TEXT NOT NULL,
-                    lessons_total INTEGER,
-                    price REAL NOT NULL,
-                    is_active BOOLEAN DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    created_by INTEGER,
-                    FOREIGN KEY (created_by) REFERENCES users(user_id)
-                )
-            """)
-            
-            # Абонементы пользователей (универсальные, без привязки к центру/курсу)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS subscriptions (
-                    subscription_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    child_id INTEGER,
-                    template_id INTEGER,
-                    tariff TEXT,
-                    lessons_total INTEGER,
-                    lessons_remaining INTEGER,
-                    qr_code TEXT UNIQUE,
-                    status TEXT DEFAULT 'active',
-                    purchased_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    expires_at TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id),
-                    FOREIGN KEY (child_id) REFERENCES children(child_id),
-                    FOREIGN KEY (template_id) REFERENCES subscription_templates(template_id)
-                )
-            """)
-
-            # Занятия (загружаются партнерами)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS lessons (
-                    lesson_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    center_id INTEGER,
-                    course_id INTEGER,
-                    name TEXT NOT NULL,
-                    description TEXT,
-                    date DATE NOT NULL,
-                    time TIME NOT NULL,
-                    duration INTEGER,
-                    teacher_id INTEGER,
-                    max_students INTEGER,
-                    current_students INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (center_id) REFERENCES centers(center_id),
-                    FOREIGN KEY (course_id) REFERENCES courses(course_id),
-                    FOREIGN KEY (teacher_id) REFERENCES teachers(teacher_id)
-                )
-            """)
-            
-            # Посещения (универсальные, без привязки к курсу)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS visits (
-                    visit_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    subscription_id INTEGER,
-                    user_id INTEGER,
-                    child_id INTEGER,
-                    center_id INTEGER,
-                    lesson_id INTEGER,
-                    visited_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (subscription_id) REFERENCES subscriptions(subscription_id),
-                    FOREIGN KEY (user_id) REFERENCES users(user_id),
-                    FOREIGN KEY (child_id) REFERENCES children(child_id),
-                    FOREIGN KEY (center_id) REFERENCES centers(center_id),
-                    FOREIGN KEY (lesson_id) REFERENCES lessons(lesson_id)
-                )
-            """)
-
-            # Платежи
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS payments (
-                    payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    subscription_id INTEGER,
-                    user_id INTEGER,
-                    amount REAL,
-                    currency TEXT DEFAULT 'KZT',
-                    method TEXT,
-                    status TEXT DEFAULT 'pending',
-                    transaction_id TEXT,
-                    invoice_id TEXT,
-                    airba_payment_id TEXT,
-                    redirect_url TEXT,
-                    error_message TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    processed_at TIMESTAMP,
-                    FOREIGN KEY (subscription_id) REFERENCES subscriptions(subscription_id),
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                )
-            """)
-            
-            # Возвраты платежей
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS payment_refunds (
-                    refund_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    payment_id INTEGER,
-                    airba_refund_id TEXT,
-                    ext_id TEXT,
-                    amount REAL,
-                    reason TEXT,
-                    status TEXT,
-                    processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (payment_id) REFERENCES payments(payment_id)
-                )
-            """)
-
-            # Отзывы
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS reviews (
-                    review_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    course_id INTEGER,
-                    user_id INTEGER,
-                    rating INTEGER,
-                    comment TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (course_id) REFERENCES courses(course_id),
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                )
-            """)
-
-            await db.commit()
-            
-            # Миграция: добавляем template_id в subscriptions, если его нет
-            await self._migrate_subscriptions_table(db)
-
-    async def _migrate_subscriptions_table(self, db):
-        """Миграция таблицы subscriptions для добавления template_id"""
-        try:
-            # Проверяем, существует ли колонка template_id
-            async with db.execute("PRAGMA table_info(subscriptions)") as cursor:
-                columns = await cursor.fetchall()
-                column_names = [col[1] for col in columns]
-            
-            # Если template_id отсутствует, добавляем его
-            if 'template_id' not in column_names:
-                logger.info("Добавляем колонку template_id в таблицу subscriptions...")
-                await db.execute("""
-                    ALTER TABLE subscriptions 
-                    ADD COLUMN template_id INTEGER
-                """)
-                await db.commit()
-                logger.info("Колонка template_id успешно добавлена")
-            
-            # Если есть старые колонки course_id и center_id, их можно оставить для обратной совместимости
-            # или удалить, если они больше не нужны
-            
-        except Exception as e:
-            logger.error(f"Ошибка при миграции таблицы subscriptions: {e}", exc_info=True)
-            # Не прерываем выполнение, если миграция не удалась
+        """Инициализация базы данных: применяет недостающие миграции схемы"""
+        async with self.pool.write() as db:
+            async with db.execute("PRAGMA journal_mode") as cursor:
+                journal_mode = (await cursor.fetchone())[0]
+            logger.info(f"SQLite journal_mode={journal_mode}")
+
+            version = await run_migrations(db)
+            logger.info(f"Версия схемы базы данных: {version}")
+        
+        await self.warm_qr_index()
+
+    # Выборка компактной записи активного абонемента для индекса QR-кодов
+    _QR_RECORD_QUERY = """
+        SELECT s.qr_code, s.subscription_id, s.user_id, s.child_id,
+               u.full_name AS owner_name, ch.name AS child_name,
+               st.name AS template_name, s.tariff, s.lessons_remaining
+        FROM subscriptions s
+        LEFT JOIN subscription_templates st ON s.template_id = st.template_id
+        LEFT JOIN users u ON s.user_id = u.user_id
+        LEFT JOIN children ch ON s.child_id = ch.child_id
+        WHERE s.status = 'active' AND s.qr_code IS NOT NULL
+    """
+
+    async def warm_qr_index(self):
+        """Заполнить индекс активных QR-кодов при старте"""
+        self.qr_index.clear()
+        loaded = 0
+        async with self.pool.read() as db:
+            async with db.execute(
+                self._QR_RECORD_QUERY + " ORDER BY s.subscription_id LIMIT ?",
+                (self.qr_index.capacity + 1,)
+            ) as cursor:
+                async for row in cursor:
+                    self.qr_index.put(QrRecord(*row))
+                    loaded += 1
+        # Индекс полный, только если в него поместились все активные абонементы
+        self.qr_index.complete = loaded <= self.qr_index.capacity
+        logger.info(f"Индекс QR-кодов: {len(self.qr_index)} активных абонементов (полный: {self.qr_index.complete})")
+        
+        await self.rebuild_qr_bloom()
+
+    async def rebuild_qr_bloom(self):
+        """Перестроить фильтр Блума по всем активным QR-кодам"""
+        async with self.pool.read() as db:
+            async with db.execute(
+                "SELECT COUNT(*) FROM subscriptions WHERE status = 'active' AND qr_code IS NOT NULL"
+            ) as cursor:
+                active_count = (await cursor.fetchone())[0]
+            # Запас в два раза, чтобы новые абонементы не ухудшали точность до следующей перестройки
+            bloom = BloomFilter(max(self.qr_bloom_capacity, active_count * 2), QR_BLOOM_ERROR_RATE)
+            async with db.execute(
+                "SELECT qr_code FROM subscriptions WHERE status = 'active' AND qr_code IS NOT NULL"
+            ) as cursor:
+                async for row in cursor:
+                    bloom.add(row[0])
+        self.qr_bloom = bloom
+        logger.info(f"Фильтр Блума QR-кодов: {bloom.count} кодов, {bloom.memory_bytes // 1024} КБ")
+
+    async def _refresh_qr_record(self, db, subscription_id: int):
+        """Перечитать абонемент в индекс QR-кодов после изменения"""
+        async with db.execute(self._QR_RECORD_QUERY + " AND s.subscription_id = ?", (subscription_id,)) as cursor:
+            row = await cursor.fetchone()
+        if row:
+            self.qr_index.put(QrRecord(*row))
+            self.qr_bloom.add(row["qr_code"])
+        else:
+            self.qr_index.discard_subscription(subscription_id)
 
     # Методы для работы с пользователями
     async def get_user(self, user_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             async with db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)) as cursor:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
 
     async def create_user(self, user_id: int, username: str = None, full_name: str = None, role: str = ROLE_USER):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             await db.execute("""
                 INSERT OR IGNORE INTO users (user_id, username, full_name, role)
                 VALUES (?, ?, ?, ?)
@@ -263,18 +139,18 @@ class Database:
             await db.commit()
 
     async def update_user_role(self, user_id: int, role: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             await db.execute("UPDATE users SET role = ? WHERE user_id = ?", (role, user_id))
             await db.commit()
 
     async def update_user_city(self, user_id: int, city: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             await db.execute("UPDATE users SET city = ? WHERE user_id = ?", (city, user_id))
             await db.commit()
 
     # Методы для работы с детьми
     async def add_child(self, parent_id: int, name: str, age: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             cursor = await db.execute("""
                 INSERT INTO children (parent_id, name, age)
                 VALUES (?, ?, ?)
@@ -283,22 +159,20 @@ class Database:
             return cursor.lastrowid
 
     async def get_children(self, parent_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             async with db.execute("SELECT * FROM children WHERE parent_id = ?", (parent_id,)) as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
 
     async def get_child(self, child_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             async with db.execute("SELECT * FROM children WHERE child_id = ?", (child_id,)) as cursor:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
 
     # Методы для работы с центрами
     async def create_center(self, partner_id: int, data: dict):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             cursor = await db.execute("""
                 INSERT INTO centers (partner_id, name, city, address, phone, category, description, logo, status)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
@@ -317,8 +191,7 @@ class Database:
             return cursor.lastrowid
 
     async def get_centers(self, city: str = None, category: str = None, status: str = None):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             query = "SELECT * FROM centers WHERE 1=1"
             params = []
             
@@ -337,20 +210,19 @@ class Database:
                 return [dict(row) for row in rows]
 
     async def get_center(self, center_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             async with db.execute("SELECT * FROM centers WHERE center_id = ?", (center_id,)) as cursor:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
 
     async def update_center_status(self, center_id: int, status: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             await db.execute("UPDATE centers SET status = ? WHERE center_id = ?", (status, center_id))
             await db.commit()
 
     # Методы для работы с курсами
     async def create_course(self, center_id: int, data: dict):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             cursor = await db.execute("""
                 INSERT INTO courses (center_id, name, description, category, age_min, age_max, requirements, 
                                    schedule, price_4, price_8, price_unlimited, photo)
@@ -372,37 +244,100 @@ class Database:
             await db.commit()
             return cursor.lastrowid
 
-    async def get_courses(self, city: str = None, category: str = None, age: int = None):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            query = """
-                SELECT c.*, ce.name as center_name, ce.address, ce.city, ce.phone
-                FROM courses c
-                JOIN centers ce ON c.center_id = ce.center_id
-                WHERE ce.status = 'approved' AND 1=1
-            """
-            params = []
-            
-            if city:
-                query += " AND ce.city = ?"
-                params.append(city)
-            if category:
-                query += " AND c.category = ?"
-                params.append(category)
-            
+    # Допустимые варианты сортировки каталога: ключ -> столбцы (выражение, по убыванию).
+    # Последний столбец уникален, поэтому порядок подходит для keyset-пагинации;
+    # rating и price_8 допускают NULL, поэтому сортировка по COALESCE
+    # (те же выражения в индексах миграции 9)
+    COURSE_ORDERS = {
+        "default": [("c.course_id", False)],
+        "rating": [("COALESCE(c.rating, 0)", True), ("c.course_id", False)],
+        "price": [("COALESCE(c.price_8, 0)", False), ("c.course_id", False)],
+        "price_desc": [("COALESCE(c.price_8, 0)", True), ("c.course_id", False)],
+        "newest": [("c.course_id", True)],
+    }
+
+    @staticmethod
+    def _courses_filter(city: str = None, category: str = None, age: int = None,
+                        price_min: int = None, price_max: int = None, min_rating: float = None):
+        """Условие WHERE и параметры для поиска курсов в каталоге"""
+        conditions = ["ce.status = 'approved'"]
+        params = []
+        
+        if city:
+            conditions.append("ce.city = ?")
+            params.append(city)
+        if category:
+            conditions.append("c.category = ?")
+            params.append(category)
+        if age:
+            # Пустой или нулевой возраст означает отсутствие ограничения
+            conditions.append("(c.age_min IS NULL OR c.age_min = 0 OR c.age_min <= ?)")
+            conditions.append("(c.age_max IS NULL OR c.age_max = 0 OR c.age_max >= ?)")
+            params.extend([age, age])
+        if price_min is not None:
+            conditions.append("c.price_8 >= ?")
+            params.append(price_min)
+        if price_max is not None:
+            conditions.append("c.price_8 <= ?")
+            params.append(price_max)
+        if min_rating is not None:
+            conditions.append("c.rating >= ?")
+            params.append(min_rating)
+        
+        return " AND ".join(conditions), params
+
+    async def get_courses(self, city: str = None, category: str = None, age: int = None,
+                          price_min: int = None, price_max: int = None, min_rating: float = None,
+                          order_by: str = "default", limit: int = None, offset: int = 0,
+                          after: tuple = None, backward: bool = False):
+        """
+        Поиск курсов в каталоге одним SQL-запросом.
+        order_by — ключ из COURSE_ORDERS; limit/offset — страница результата;
+        after — ключ сортировки, после которого начинается страница
+        (при backward — перед которым она заканчивается, строки в обратном порядке)
+        """
+        if order_by not in self.COURSE_ORDERS:
+            raise ValueError(f"Неизвестная сортировка курсов: {order_by}")
+        columns = self.COURSE_ORDERS[order_by]
+        
+        where, params = self._courses_filter(city, category, age, price_min, price_max, min_rating)
+        if after is not None:
+            keyset_where, keyset_params = keyset_condition(columns, after, backward)
+            where += f" AND {keyset_where}"
+            params.extend(keyset_params)
+        
+        query = f"""
+            SELECT c.*, ce.name as center_name, ce.address, ce.city, ce.phone{keyset_select(columns)}
+            FROM courses c
+            JOIN centers ce ON c.center_id = ce.center_id
+            WHERE {where}
+            ORDER BY {keyset_order_by(columns, backward)}
+        """
+        if limit is not None:
+            query += " LIMIT ? OFFSET ?"
+            params.extend([limit, offset])
+        
+        async with self.pool.read() as db:
             async with db.execute(query, params) as cursor:
                 rows = await cursor.fetchall()
-                courses = [dict(row) for row in rows]
-                # Фильтрация по возрасту на уровне Python
-                if age:
-                    courses = [c for c in courses if 
-                              (not c.get("age_min") or c["age_min"] <= age) and
-                              (not c.get("age_max") or c["age_max"] >= age)]
-                return courses
+                return [dict(row) for row in rows]
+
+    async def count_courses(self, city: str = None, category: str = None, age: int = None,
+                            price_min: int = None, price_max: int = None, min_rating: float = None):
+        """Количество курсов в каталоге по тем же фильтрам, что и get_courses"""
+        where, params = self._courses_filter(city, category, age, price_min, price_max, min_rating)
+        async with self.pool.read() as db:
+            async with db.execute(f"""
+                SELECT COUNT(*) as count
+                FROM courses c
+                JOIN centers ce ON c.center_id = ce.center_id
+                WHERE {where}
+            """, params) as cursor:
+                row = await cursor.fetchone()
+                return row["count"] if row else 0
 
     async def get_course(self, course_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             async with db.execute("""
                 SELECT c.*, ce.name as center_name, ce.address, ce.city, ce.phone
                 FROM courses c
@@ -416,7 +351,7 @@ class Database:
     async def create_subscription_template(self, name: str, description: str, tariff: str, 
                                           lessons_total: int, price: float, created_by: int):
         """Создать шаблон универсального абонемента"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             cursor = await db.execute("""
                 INSERT INTO subscription_templates (name, description, tariff, lessons_total, price, created_by)
                 VALUES (?, ?, ?, ?, ?, ?)
@@ -426,8 +361,7 @@ class Database:
 
     async def get_subscription_templates(self, active_only: bool = True):
         """Получить все шаблоны абонементов"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             query = "SELECT * FROM subscription_templates"
             if active_only:
                 query += " WHERE is_active = 1"
@@ -438,8 +372,7 @@ class Database:
 
     async def get_subscription_template(self, template_id: int):
         """Получить шаблон абонемента по ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             async with db.execute("SELECT * FROM subscription_templates WHERE template_id = ?", (template_id,)) as cursor:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
@@ -448,7 +381,7 @@ class Database:
                                           description: str = None, price: float = None, 
                                           is_active: bool = None):
         """Обновить шаблон абонемента"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             updates = []
             params = []
             if name is not None:
@@ -475,7 +408,7 @@ class Database:
 
     async def delete_subscription_template(self, template_id: int):
         """Удалить шаблон абонемента"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             await db.execute("UPDATE subscription_templates SET is_active = 0 WHERE template_id = ?", (template_id,))
             await db.commit()
             return True
@@ -483,12 +416,12 @@ class Database:
     # Методы для работы с абонементами пользователей
     async def create_subscription(self, user_id: int, template_id: int, qr_code: str, child_id: int = None):
         """Создать универсальный абонемент из шаблона"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Получаем данные шаблона
-            template = await self.get_subscription_template(template_id)
-            if not template:
-                return None
-            
+        # Получаем данные шаблона
+        template = await self.get_subscription_template(template_id)
+        if not template:
+            return None
+        
+        async with self.pool.write() as db:
             cursor = await db.execute("""
                 INSERT INTO subscriptions (user_id, child_id, template_id, tariff, 
                                          lessons_total, lessons_remaining, qr_code, status)
@@ -503,12 +436,29 @@ class Database:
                 qr_code
             ))
             await db.commit()
+            await self._refresh_qr_record(db, cursor.lastrowid)
             return cursor.lastrowid
 
+    async def update_subscription_qr(self, subscription_id: int, qr_code: str):
+        """Обновить QR-код абонемента"""
+        async with self.pool.write() as db:
+            await db.execute(
+                "UPDATE subscriptions SET qr_code = ? WHERE subscription_id = ?",
+                (qr_code, subscription_id)
+            )
+            await db.commit()
+            await self._refresh_qr_record(db, subscription_id)
+
+    async def delete_subscription(self, subscription_id: int):
+        """Удалить абонемент"""
+        async with self.pool.write() as db:
+            await db.execute("DELETE FROM subscriptions WHERE subscription_id = ?", (subscription_id,))
+            await db.commit()
+        self.qr_index.discard_subscription(subscription_id)
+
     async def get_user_subscriptions(self, user_id: int, child_id: int = None):
         """Получить универсальные абонементы пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             if child_id:
                 query = """
                     SELECT s.*, st.name as template_name, st.description as template_description
@@ -530,92 +480,356 @@ class Database:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
 
-    async def get_subscription_by_qr(self, qr_code: str):
-        """Получить универсальный абонемент по QR-коду"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT s.*, st.name as template_name, st.description as template_description,
-                       u.user_id as owner_id, u.full_name as owner_name,
-                       ch.name as child_name, ch.age as child_age
-                FROM subscriptions s
-                LEFT JOIN subscription_templates st ON s.template_id = st.template_id
-                LEFT JOIN users u ON s.user_id = u.user_id
-                LEFT JOIN children ch ON s.child_id = ch.child_id
-                WHERE s.qr_code = ? AND s.status = 'active'
-            """, (qr_code,)) as cursor:
+    async def get_subscription(self, subscription_id: int):
+        """Получить абонемент по id"""
+        async with self.pool.read() as db:
+            async with db.execute(
+                "SELECT * FROM subscriptions WHERE subscription_id = ?", (subscription_id,)
+            ) as cursor:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
 
-    async def record_visit(self, subscription_id: int, center_id: int, lesson_id: int = None):
-        """Запись посещения с защитой от дублирования (универсальный абонемент работает во всех центрах)"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Получаем данные абонемента
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM subscriptions WHERE subscription_id = ?", (subscription_id,)) as cursor:
-                sub = await cursor.fetchone()
-                if not sub:
-                    return False
-            
-            sub = dict(sub)
-            
-            # Проверяем, что абонемент активен
-            if sub.get("status") != "active":
-                return False
-            
-            # Проверяем, что занятия не закончились (для не безлимитных)
-            if sub["tariff"] != "unlimited" and sub.get("lessons_remaining", 0) <= 0:
-                return False
-            
-            # Проверяем на дублирование (посещение в последние 5 минут в этом центре)
-            from datetime import datetime, timedelta
-            five_min_ago = datetime.now() - timedelta(minutes=5)
-            five_min_ago_str = five_min_ago.strftime('%Y-%m-%d %H:%M:%S')
-            
-            async with db.execute("""
-                SELECT COUNT(*) as count FROM visits
-                WHERE subscription_id = ? 
-                AND center_id = ?
-                AND datetime(visited_at) > datetime(?)
-            """, (subscription_id, center_id, five_min_ago_str)) as cursor:
-                recent_visit = await cursor.fetchone()
-                if recent_visit and recent_visit["count"] > 0:
-                    return False  # Уже было посещение в последние 5 минут в этом центре
-            
-            # Записываем посещение (универсальный абонемент работает во всех центрах)
+    async def get_subscription_by_qr(self, qr_code: str):
+        """
+        Получить активный абонемент по QR-коду.
+        Сначала ищет в индексе QR-кодов; если индекс полный, промах означает,
+        что абонемента нет, и база не запрашивается.
+        Returns: словарь полей QrRecord или None
+        """
+        record = self.qr_index.get(qr_code)
+        if record is None and not self.qr_index.complete:
+            async with self.pool.read() as db:
+                async with db.execute(self._QR_RECORD_QUERY + " AND s.qr_code = ?", (qr_code,)) as cursor:
+                    row = await cursor.fetchone()
+            if row:
+                record = QrRecord(*row)
+                self.qr_index.put(record)
+        return record._asdict() if record else None
+
+    @staticmethod
+    async def _apply_visit(db, subscription_id: int, center_id: int, lesson_id: int, now_ts: int):
+        """
+        Списать занятие и записать посещение внутри уже открытой транзакции.
+        Занятие списывается, только если абонемент активен, занятия есть и в этом
+        центре не было посещения за последние 5 минут; на последнем занятии
+        абонемент переводится в expired.
+        Returns: строка (user_id, child_id, lessons_remaining, status, tariff) или None
+        """
+        async with db.execute("""
+            UPDATE subscriptions
+            SET lessons_remaining = CASE WHEN tariff = 'unlimited'
+                    THEN lessons_remaining ELSE lessons_remaining - 1 END,
+                status = CASE WHEN tariff != 'unlimited' AND lessons_remaining - 1 <= 0
+                    THEN 'expired' ELSE status END
+            WHERE subscription_id = ?
+            AND status = 'active'
+            AND (tariff = 'unlimited' OR lessons_remaining > 0)
+            AND NOT EXISTS (
+                SELECT 1 FROM visits
+                WHERE subscription_id = ? AND center_id = ? AND visited_ts > ?
+            )
+            RETURNING user_id, child_id, lessons_remaining, status, tariff
+        """, (subscription_id, subscription_id, center_id,
+              now_ts - VISIT_DUPLICATE_WINDOW)) as cursor:
+            updated = await cursor.fetchone()
+        
+        if updated:
             await db.execute("""
-                INSERT INTO visits (subscription_id, user_id, child_id, center_id, lesson_id, visited_at)
-                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            """, (subscription_id, sub.get("user_id"), sub.get("child_id"), center_id, lesson_id))
-            
-            # Уменьшаем количество оставшихся занятий (если не безлимит)
-            if sub["tariff"] != "unlimited":
-                # Сначала уменьшаем количество занятий
-                await db.execute("""
-                    UPDATE subscriptions 
-                    SET lessons_remaining = lessons_remaining - 1
-                    WHERE subscription_id = ? AND lessons_remaining > 0
-                """, (subscription_id,))
+                INSERT INTO visits (subscription_id, user_id, child_id, center_id, lesson_id,
+                                    visited_at, visited_ts, visit_day)
+                VALUES (?, ?, ?, ?, ?, datetime(?, 'unixepoch'), ?, ?)
+            """, (subscription_id, updated["user_id"], updated["child_id"], center_id,
+                  lesson_id, now_ts, now_ts, day_bucket(now_ts)))
+        return updated
+
+    @staticmethod
+    def _visit_failure(sub) -> str:
+        """Причина, по которой посещение не записано, по текущему состоянию абонемента"""
+        if not sub:
+            return VISIT_NOT_FOUND
+        if sub["tariff"] != "unlimited" and (sub["lessons_remaining"] or 0) <= 0:
+            return VISIT_EXHAUSTED
+        if sub["status"] != "active":
+            return VISIT_INACTIVE
+        return VISIT_DUPLICATE
+
+    async def record_visit(self, subscription_id: int, center_id: int, lesson_id: int = None):
+        """
+        Запись посещения с защитой от дублирования (универсальный абонемент работает во всех центрах).
+
+        Проверка, списание занятия, перевод абонемента в expired и вставка
+        посещения выполняются в одной транзакции BEGIN IMMEDIATE, поэтому два
+        одновременных сканирования не могут оба пройти проверки.
+
+        Returns: словарь {"result": VISIT_*, "lessons_remaining", "status", "tariff"}
+        """
+        now_ts = utc_timestamp()
+        async with self.pool.write() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                updated = await self._apply_visit(db, subscription_id, center_id, lesson_id, now_ts)
+                if updated:
+                    await db.commit()
+                    self.qr_index.update_after_visit(
+                        subscription_id, updated["lessons_remaining"], updated["status"]
+                    )
+                    return {
+                        "result": VISIT_OK,
+                        "lessons_remaining": updated["lessons_remaining"],
+                        "status": updated["status"],
+                        "tariff": updated["tariff"],
+                    }
                 
-                # Проверяем, закончились ли занятия после уменьшения
+                # Посещение не записано — определяем причину по текущему состоянию
                 async with db.execute("""
-                    SELECT lessons_remaining FROM subscriptions WHERE subscription_id = ?
+                    SELECT lessons_remaining, status, tariff FROM subscriptions WHERE subscription_id = ?
                 """, (subscription_id,)) as cursor:
-                    result = await cursor.fetchone()
-                    if result and result["lessons_remaining"] <= 0:
-                        # Если занятия закончились, деактивируем абонемент
-                        await db.execute("""
-                            UPDATE subscriptions 
-                            SET status = 'expired'
-                            WHERE subscription_id = ? AND lessons_remaining <= 0
-                        """, (subscription_id,))
-            
-            await db.commit()
-            return True
+                    sub = await cursor.fetchone()
+                await db.rollback()
+            except BaseException:
+                await db.rollback()
+                raise
+        
+        result = self._visit_failure(sub)
+        if result != VISIT_DUPLICATE:
+            self.qr_index.discard_subscription(subscription_id)
+        return {
+            "result": result,
+            "lessons_remaining": sub["lessons_remaining"] if sub else None,
+            "status": sub["status"] if sub else None,
+            "tariff": sub["tariff"] if sub else None,
+        }
+
+    @staticmethod
+    def _partner_failure(row) -> str:
+        """Почему партнёр не может сканировать (SCAN_*) или None, если может"""
+        if not row:
+            return SCAN_NOT_REGISTERED
+        if row["partner_role"] != ROLE_PARTNER:
+            return SCAN_NOT_PARTNER
+        if row["center_id"] is None:
+            return SCAN_NO_CENTER
+        if row["center_status"] != STATUS_APPROVED:
+            return SCAN_CENTER_NOT_APPROVED
+        return None
+
+    async def scan_visit(self, partner_id: int, qr_code: str = None, lesson_id: int = None,
+                         subscription_id: int = None):
+        """
+        Сканирование QR-кода партнёром за одно обращение к базе.
+
+        Одним запросом проверяет партнёра, его центр и абонемент по QR-коду
+        (или по subscription_id, если он уже известен из индекса QR-кодов или
+        подписанного токена; если переданы оба, абонемент ищется по первичному
+        ключу и его qr_code должен совпасть), затем в той же транзакции
+        записывает посещение (см. _apply_visit).
+
+        Returns: словарь {"result": SCAN_*/VISIT_*, "center_id", "center_status",
+                 "subscription_id", "student_name", "template_name",
+                 "lessons_remaining", "status", "tariff"}
+        """
+        now_ts = utc_timestamp()
+        if subscription_id and qr_code:
+            subscription_match, match_params = "s.subscription_id = ? AND s.qr_code = ?", (subscription_id, qr_code)
+        elif subscription_id:
+            subscription_match, match_params = "s.subscription_id = ?", (subscription_id,)
+        else:
+            subscription_match, match_params = "s.qr_code = ?", (qr_code,)
+        
+        async with self.pool.write() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                async with db.execute(f"""
+                    SELECT p.role AS partner_role,
+                           ce.center_id, ce.status AS center_status,
+                           s.subscription_id, s.status, s.tariff, s.lessons_remaining,
+                           s.user_id, s.child_id,
+                           st.name AS template_name,
+                           COALESCE(ch.name, u.full_name) AS student_name
+                    FROM users p
+                    LEFT JOIN centers ce ON ce.partner_id = p.user_id
+                    LEFT JOIN subscriptions s ON {subscription_match}
+                    LEFT JOIN subscription_templates st ON s.template_id = st.template_id
+                    LEFT JOIN users u ON s.user_id = u.user_id
+                    LEFT JOIN children ch ON s.child_id = ch.child_id
+                    WHERE p.user_id = ?
+                    LIMIT 1
+                """, (*match_params, partner_id)) as cursor:
+                    row = await cursor.fetchone()
+                
+                outcome = dict(row) if row else {}
+                partner_failure = self._partner_failure(row)
+                if partner_failure:
+                    outcome["result"] = partner_failure
+                elif row["subscription_id"] is None:
+                    outcome["result"] = VISIT_NOT_FOUND
+                else:
+                    updated = await self._apply_visit(
+                        db, row["subscription_id"], row["center_id"], lesson_id, now_ts
+                    )
+                    if updated:
+                        await db.commit()
+                        self.qr_index.update_after_visit(
+                            row["subscription_id"], updated["lessons_remaining"], updated["status"]
+                        )
+                        outcome.update(
+                            result=VISIT_OK,
+                            lessons_remaining=updated["lessons_remaining"],
+                            status=updated["status"],
+                        )
+                        return outcome
+                    # Строка абонемента прочитана в этой же транзакции и не менялась
+                    outcome["result"] = self._visit_failure(row)
+                    if outcome["result"] in (VISIT_EXHAUSTED, VISIT_INACTIVE):
+                        self.qr_index.discard_subscription(row["subscription_id"])
+                await db.rollback()
+                return outcome
+            except BaseException:
+                await db.rollback()
+                raise
+
+    async def scan_visits_batch(self, partner_id: int, codes: List[Tuple[Optional[str], Optional[int]]],
+                                lesson_id: int = None, timestamps: List[int] = None):
+        """
+        Записать посещения по нескольким QR-кодам одной транзакцией.
+
+        codes — пары (qr_code, subscription_id), как у scan_visit: абонемент
+        ищется по subscription_id (с проверкой qr_code, если он задан) или по
+        qr_code. timestamps — время каждого сканирования (по умолчанию сейчас).
+        Партнёр и центр проверяются один раз, абонементы и недавние посещения
+        читаются двумя запросами, проверки выполняются по порядку сканирований
+        (повтор того же абонемента в пачке — дубликат), а изменения
+        записываются двумя executemany в той же транзакции BEGIN IMMEDIATE.
+
+        Returns: словарь {"result": SCAN_* или VISIT_OK, "center_id", "center_status",
+                 "items": [по словарю на каждый код: "result", "subscription_id",
+                 "student_name", "template_name", "lessons_remaining", "status",
+                 "tariff", "visited_ts"]}
+        """
+        now_ts = utc_timestamp()
+        if timestamps is None:
+            timestamps = [now_ts] * len(codes)
+        sub_ids = sorted({sid for _, sid in codes if sid})
+        qr_codes = sorted({qr for qr, sid in codes if qr and not sid})
+        
+        async with self.pool.write() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                async with db.execute("""
+                    SELECT p.role AS partner_role, ce.center_id, ce.status AS center_status
+                    FROM users p
+                    LEFT JOIN centers ce ON ce.partner_id = p.user_id
+                    WHERE p.user_id = ?
+                    LIMIT 1
+                """, (partner_id,)) as cursor:
+                    partner = await cursor.fetchone()
+                
+                outcome = dict(partner) if partner else {}
+                partner_failure = self._partner_failure(partner)
+                if partner_failure:
+                    await db.rollback()
+                    outcome["result"] = partner_failure
+                    return outcome
+                center_id = partner["center_id"]
+                
+                conditions = []
+                if sub_ids:
+                    conditions.append(f"s.subscription_id IN ({', '.join('?' * len(sub_ids))})")
+                if qr_codes:
+                    conditions.append(f"s.qr_code IN ({', '.join('?' * len(qr_codes))})")
+                rows = []
+                if conditions:
+                    async with db.execute(f"""
+                        SELECT s.subscription_id, s.qr_code, s.status, s.tariff, s.lessons_remaining,
+                               s.user_id, s.child_id,
+                               st.name AS template_name,
+                               COALESCE(ch.name, u.full_name) AS student_name
+                        FROM subscriptions s
+                        LEFT JOIN subscription_templates st ON s.template_id = st.template_id
+                        LEFT JOIN users u ON s.user_id = u.user_id
+                        LEFT JOIN children ch ON s.child_id = ch.child_id
+                        WHERE {" OR ".join(conditions)}
+                    """, (*sub_ids, *qr_codes)) as cursor:
+                        rows = [dict(row) for row in await cursor.fetchall()]
+                by_id = {row["subscription_id"]: row for row in rows}
+                by_code = {row["qr_code"]: row for row in rows}
+                
+                # Посещения этих абонементов в этом центре, попадающие в окно дубликатов
+                recent: Dict[int, List[int]] = {}
+                if by_id and timestamps:
+                    async with db.execute(f"""
+                        SELECT subscription_id, visited_ts FROM visits
+                        WHERE center_id = ? AND visited_ts > ? AND visited_ts < ?
+                        AND subscription_id IN ({', '.join('?' * len(by_id))})
+                    """, (center_id, min(timestamps) - VISIT_DUPLICATE_WINDOW,
+                          max(timestamps) + VISIT_DUPLICATE_WINDOW, *by_id)) as cursor:
+                        for sid, visited_ts in await cursor.fetchall():
+                            recent.setdefault(sid, []).append(visited_ts)
+                
+                items = []
+                visit_rows = []
+                for (qr_code, sid), ts in zip(codes, timestamps):
+                    sub = by_id.get(sid) if sid else by_code.get(qr_code)
+                    if sub and sid and qr_code and sub["qr_code"] != qr_code:
+                        sub = None
+                    item = {"result": VISIT_NOT_FOUND, "qr_code": qr_code, "visited_ts": ts}
+                    items.append(item)
+                    if not sub:
+                        continue
+                    item.update(
+                        subscription_id=sub["subscription_id"],
+                        student_name=sub["student_name"],
+                        template_name=sub["template_name"],
+                        tariff=sub["tariff"],
+                    )
+                    visits = recent.setdefault(sub["subscription_id"], [])
+                    unlimited = sub["tariff"] == "unlimited"
+                    if sub["status"] != "active" or (not unlimited and (sub["lessons_remaining"] or 0) <= 0):
+                        item["result"] = self._visit_failure(sub)
+                    elif any(abs(ts - visited_ts) < VISIT_DUPLICATE_WINDOW for visited_ts in visits):
+                        item["result"] = VISIT_DUPLICATE
+                    else:
+                        if not unlimited:
+                            sub["lessons_remaining"] -= 1
+                            if sub["lessons_remaining"] <= 0:
+                                sub["status"] = "expired"
+                        sub["changed"] = True
+                        visits.append(ts)
+                        item["result"] = VISIT_OK
+                        visit_rows.append((
+                            sub["subscription_id"], sub["user_id"], sub["child_id"], center_id,
+                            lesson_id, ts, ts, day_bucket(ts)
+                        ))
+                    item.update(lessons_remaining=sub["lessons_remaining"], status=sub["status"])
+                
+                changed = [sub for sub in rows if sub.get("changed")]
+                if visit_rows:
+                    await db.executemany(
+                        "UPDATE subscriptions SET lessons_remaining = ?, status = ? WHERE subscription_id = ?",
+                        [(sub["lessons_remaining"], sub["status"], sub["subscription_id"]) for sub in changed]
+                    )
+                    await db.executemany("""
+                        INSERT INTO visits (subscription_id, user_id, child_id, center_id, lesson_id,
+                                            visited_at, visited_ts, visit_day)
+                        VALUES (?, ?, ?, ?, ?, datetime(?, 'unixepoch'), ?, ?)
+                    """, visit_rows)
+                    await db.commit()
+                else:
+                    await db.rollback()
+            except BaseException:
+                await db.rollback()
+                raise
+        
+        for sub in rows:
+            if sub.get("changed"):
+                self.qr_index.update_after_visit(sub["subscription_id"], sub["lessons_remaining"], sub["status"])
+            elif sub["status"] != "active" or (sub["tariff"] != "unlimited" and (sub["lessons_remaining"] or 0) <= 0):
+                self.qr_index.discard_subscription(sub["subscription_id"])
+        outcome.update(result=VISIT_OK, items=items)
+        return outcome
 
     async def get_visit_stats(self, user_id: int, child_id: int = None):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             
             if child_id:
                 # Статистика для ребёнка
@@ -646,16 +860,14 @@ class Database:
 
     # Методы для партнёров
     async def get_partner_center(self, partner_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             async with db.execute("SELECT * FROM centers WHERE partner_id = ?", (partner_id,)) as cursor:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
 
     async def get_center_students(self, center_id: int):
         """Получить студентов, которые посещали этот центр (универсальные абонементы)"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             async with db.execute("""
                 SELECT DISTINCT 
                     s.user_id, s.child_id, u.full_name, ch.name as child_name,
@@ -674,8 +886,7 @@ class Database:
                 return [dict(row) for row in rows]
 
     async def get_center_analytics(self, center_id: int, month: int = None, year: int = None):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             
             # Посещения
             visits_query = """
@@ -686,8 +897,9 @@ class Database:
             visits_params = (center_id,)
             
             if month and year:
-                visits_query += " AND strftime('%m', visited_at) = ? AND strftime('%Y', visited_at) = ?"
-                visits_params = (center_id, f"{month:02d}", str(year))
+                month_start, month_end = month_bounds(year, month)
+                visits_query += " AND visited_ts >= ? AND visited_ts < ?"
+                visits_params = (center_id, month_start, month_end)
             
             async with db.execute(visits_query, visits_params) as cursor:
                 visits_row = await cursor.fetchone()
@@ -706,15 +918,13 @@ class Database:
 
     # Методы для админа
     async def get_pending_centers(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             async with db.execute("SELECT * FROM centers WHERE status = 'pending'") as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
 
     async def get_all_users(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             async with db.execute("SELECT * FROM users") as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
@@ -725,20 +935,31 @@ class Database:
                            airba_payment_id: str = None, redirect_url: str = None, 
                            status: str = "pending"):
         """Создать платеж"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
+            now_ts = utc_timestamp()
             cursor = await db.execute("""
                 INSERT INTO payments (user_id, subscription_id, amount, currency, 
-                                    invoice_id, airba_payment_id, redirect_url, status)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                                    invoice_id, airba_payment_id, redirect_url, status,
+                                    created_at, created_ts, created_day, next_check_at, check_attempts)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime(?, 'unixepoch'), ?, ?, ?, 0)
             """, (user_id, subscription_id, amount, currency, invoice_id, 
-                  airba_payment_id, redirect_url, status))
+                  airba_payment_id, redirect_url, status, now_ts, now_ts, day_bucket(now_ts),
+                  now_ts + PAYMENT_CHECK_FIRST_DELAY))
             await db.commit()
             return cursor.lastrowid
 
+    async def set_payment_reference(self, payment_id: int, airba_payment_id: str, redirect_url: str):
+        """Записать id платежа AirbaPay и ссылку на оплату после создания платежа в AirbaPay"""
+        async with self.pool.write() as db:
+            await db.execute(
+                "UPDATE payments SET airba_payment_id = ?, redirect_url = ? WHERE payment_id = ?",
+                (airba_payment_id, redirect_url, payment_id)
+            )
+            await db.commit()
+
     async def get_payment(self, payment_id: int, user_id: int = None):
         """Получить платеж"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             if user_id:
                 async with db.execute(
                     "SELECT * FROM payments WHERE payment_id = ? AND user_id = ?",
@@ -757,7 +978,7 @@ class Database:
     async def update_payment_status(self, payment_id: int, status: str, 
                                   transaction_id: str = None, error_message: str = None):
         """Обновить статус платежа"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             if status == "success":
                 await db.execute("""
                     UPDATE payments 
@@ -773,10 +994,202 @@ class Database:
                 """, (status, transaction_id, error_message, payment_id))
             await db.commit()
 
+    async def get_payment_by_reference(self, invoice_id: str = None, airba_payment_id: str = None):
+        """Найти платеж по invoice_id или id платежа AirbaPay (из callback-а)"""
+        async with self.pool.read() as db:
+            for column, value in (("invoice_id", invoice_id), ("airba_payment_id", airba_payment_id)):
+                if not value:
+                    continue
+                async with db.execute(
+                    f"SELECT * FROM payments WHERE {column} = ? ORDER BY payment_id DESC LIMIT 1",
+                    (value,)
+                ) as cursor:
+                    row = await cursor.fetchone()
+                    if row:
+                        return dict(row)
+            return None
+
+    async def transition_payment_status(self, payment_id: int, status: str,
+                                        transaction_id: str = None, error_message: str = None) -> bool:
+        """
+        Сменить статус платежа, если он ещё не успешный и не возвращённый.
+        Returns: True, если статус изменил именно этот вызов (при гонке
+        callback-а и проверки статуса успех обрабатывает только один из них)
+        """
+        async with self.pool.write() as db:
+            cursor = await db.execute("""
+                UPDATE payments
+                SET status = ?, transaction_id = COALESCE(?, transaction_id), error_message = ?,
+                    processed_at = CASE WHEN ? = 'success' THEN CURRENT_TIMESTAMP ELSE processed_at END
+                WHERE payment_id = ? AND status != ? AND status NOT IN ('success', 'refunded')
+            """, (status, transaction_id or None, error_message, status, payment_id, status))
+            await db.commit()
+            return cursor.rowcount == 1
+
+    async def get_due_payments(self, now_ts: int, limit: int):
+        """Pending-платежи, время проверки которых наступило (сначала самые просроченные)"""
+        async with self.pool.read() as db:
+            async with db.execute("""
+                SELECT payment_id, user_id, subscription_id, airba_payment_id,
+                       created_ts, next_check_at, check_attempts
+                FROM payments
+                WHERE status = 'pending' AND next_check_at <= ?
+                ORDER BY next_check_at
+                LIMIT ?
+            """, (now_ts, limit)) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+
+    async def reschedule_payment_checks(self, schedule: List[Tuple[int, int, int]]):
+        """Назначить следующие проверки: schedule — (payment_id, next_check_at, check_attempts)"""
+        if not schedule:
+            return
+        async with self.pool.write() as db:
+            await db.executemany(
+                "UPDATE payments SET next_check_at = ?, check_attempts = ? WHERE payment_id = ? AND status = 'pending'",
+                [(next_check_at, attempts, payment_id) for payment_id, next_check_at, attempts in schedule]
+            )
+            await db.commit()
+
+    async def expire_pending_payments(self, created_before: int) -> int:
+        """Перевести в expired pending-платежи, созданные раньше created_before. Returns: сколько"""
+        async with self.pool.write() as db:
+            cursor = await db.execute("""
+                UPDATE payments SET status = 'expired', error_message = 'Истёк срок ожидания оплаты'
+                WHERE status = 'pending' AND created_ts < ?
+            """, (created_before,))
+            await db.commit()
+            return cursor.rowcount
+
+    async def activate_paid_subscription(self, payment_id: int, subscription_id: int, qr_code: str,
+                                         transaction_id: str = None) -> bool:
+        """
+        Отметить платеж успешным и записать абонементу новый QR-код одной
+        транзакцией. Срабатывает только при первом переходе платежа в success
+        (то же условие, что в transition_payment_status). Если абонемента уже
+        нет (платёж отменили, а пользователь всё же оплатил), платёж
+        сохраняется успешным, но абонемент не активирован — такой платёж
+        разбирается вручную (сверка: «оплачен, но абонемент удалён»).
+        Returns: True, если абонемент активировал именно этот вызов
+        """
+        async with self.pool.write() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = await db.execute("""
+                    UPDATE payments
+                    SET status = 'success', transaction_id = COALESCE(?, transaction_id),
+                        error_message = NULL, processed_at = CURRENT_TIMESTAMP
+                    WHERE payment_id = ? AND status NOT IN ('success', 'refunded')
+                """, (transaction_id or None, payment_id))
+                if cursor.rowcount != 1:
+                    await db.rollback()
+                    return False
+                cursor = await db.execute(
+                    "UPDATE subscriptions SET qr_code = ? WHERE subscription_id = ?",
+                    (qr_code, subscription_id)
+                )
+                activated = cursor.rowcount == 1
+                await db.commit()
+            except BaseException:
+                await db.rollback()
+                raise
+            if not activated:
+                metrics.inc("payment_activation.paid_without_subscription")
+                logger.error(
+                    f"Платеж {payment_id} оплачен, но абонемента {subscription_id} нет: QR-код не выдан, "
+                    f"нужен ручной разбор"
+                )
+                return False
+            await self._refresh_qr_record(db, subscription_id)
+            return True
+
+    async def get_payment_id_range(self, since_ts: int, until_ts: int) -> Optional[Tuple[int, int]]:
+        """Первый и последний payment_id платежей, созданных в [since_ts, until_ts)"""
+        async with self.pool.read() as db:
+            async with db.execute(
+                "SELECT MIN(payment_id), MAX(payment_id) FROM payments WHERE created_ts >= ? AND created_ts < ?",
+                (since_ts, until_ts)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return (row[0], row[1]) if row and row[0] is not None else None
+
+    async def get_reconciliation_chunk(self, after_id: int, last_id: int, since_ts: int, until_ts: int,
+                                       limit: int):
+        """
+        Платежи окна сверки с payment_id в (after_id, last_id] вместе с их
+        абонементом: есть ли он, его qr_code, есть ли посещения и есть
+        ли у абонемента другой успешный или ожидающий платёж
+        """
+        async with self.pool.read() as db:
+            async with db.execute("""
+                SELECT p.payment_id, p.user_id, p.subscription_id, p.airba_payment_id, p.status,
+                       s.subscription_id IS NOT NULL AS has_subscription, s.qr_code, s.child_id,
+                       EXISTS (SELECT 1 FROM visits v WHERE v.subscription_id = p.subscription_id) AS has_visits,
+                       EXISTS (
+                           SELECT 1 FROM payments p2
+                           WHERE p2.subscription_id = p.subscription_id AND p2.payment_id != p.payment_id
+                             AND p2.status IN ('success', 'pending')
+                       ) AS has_live_payment
+                FROM payments p
+                LEFT JOIN subscriptions s ON s.subscription_id = p.subscription_id
+                WHERE p.payment_id > ? AND p.payment_id <= ? AND p.created_ts >= ? AND p.created_ts < ?
+                ORDER BY p.payment_id
+                LIMIT ?
+            """, (after_id, last_id, since_ts, until_ts, limit)) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+
+    async def apply_payment_reconciliation(self, payment_updates: List[Tuple[int, str, Optional[str], Optional[str]]],
+                                           qr_updates: List[Tuple[int, str, str]],
+                                           orphan_subscriptions: List[Tuple[int, str]]) -> Dict[str, int]:
+        """
+        Применить исправления сверки одной транзакцией.
+
+        payment_updates — (payment_id, status, transaction_id, error_message),
+        с тем же условием, что transition_payment_status; qr_updates —
+        (subscription_id, новый qr_code, прежний qr_code); orphan_subscriptions —
+        (subscription_id, прежний qr_code) оставшихся от неоплаченных платежей.
+        Абонемент меняется, только если его qr_code не изменился с момента
+        выборки, а удаляется, только если по нему нет посещений, поэтому
+        параллельная активация или сканирование не затираются.
+        Returns: сколько строк изменено по каждому виду исправлений
+        """
+        async with self.pool.write() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                payments = await db.executemany("""
+                    UPDATE payments
+                    SET status = ?, transaction_id = COALESCE(?, transaction_id), error_message = ?,
+                        processed_at = CASE WHEN ? = 'success' THEN CURRENT_TIMESTAMP ELSE processed_at END
+                    WHERE payment_id = ? AND status != ? AND status NOT IN ('success', 'refunded')
+                """, [
+                    (status, transaction_id or None, error_message, status, payment_id, status)
+                    for payment_id, status, transaction_id, error_message in payment_updates
+                ])
+                subscriptions = await db.executemany(
+                    "UPDATE subscriptions SET qr_code = ? WHERE subscription_id = ? AND qr_code IS ?",
+                    [(qr_code, subscription_id, old_qr_code) for subscription_id, qr_code, old_qr_code in qr_updates]
+                )
+                orphans = await db.executemany("""
+                    DELETE FROM subscriptions
+                    WHERE subscription_id = ? AND qr_code IS ?
+                      AND NOT EXISTS (SELECT 1 FROM visits v WHERE v.subscription_id = subscriptions.subscription_id)
+                """, orphan_subscriptions)
+                await db.commit()
+            except BaseException:
+                await db.rollback()
+                raise
+            for subscription_id in [item[0] for item in qr_updates] + [item[0] for item in orphan_subscriptions]:
+                await self._refresh_qr_record(db, subscription_id)
+            return {
+                "payments": max(payments.rowcount, 0) if payment_updates else 0,
+                "qr_codes": max(subscriptions.rowcount, 0) if qr_updates else 0,
+                "orphans": max(orphans.rowcount, 0) if orphan_subscriptions else 0,
+            }
+
     async def get_user_payments(self, user_id: int):
         """Получить все платежи пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             async with db.execute(
                 "SELECT * FROM payments WHERE user_id = ? ORDER BY created_at DESC",
                 (user_id,)
@@ -787,7 +1200,7 @@ class Database:
     async def create_payment_refund(self, payment_id: int, airba_refund_id: str, 
                                    ext_id: str, amount: float, reason: str, status: str):
         """Создать возврат платежа"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             cursor = await db.execute("""
                 INSERT INTO payment_refunds (payment_id, airba_refund_id, ext_id, amount, reason, status)
                 VALUES (?, ?, ?, ?, ?, ?)
@@ -798,7 +1211,7 @@ class Database:
     # Методы для работы с преподавателями
     async def create_teacher(self, center_id: int, name: str, description: str = None):
         """Создать преподавателя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             cursor = await db.execute("""
                 INSERT INTO teachers (center_id, name, description)
                 VALUES (?, ?, ?)
@@ -808,23 +1221,21 @@ class Database:
 
     async def get_teachers(self, center_id: int):
         """Получить всех преподавателей центра"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             async with db.execute("SELECT * FROM teachers WHERE center_id = ?", (center_id,)) as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
 
     async def get_teacher(self, teacher_id: int):
         """Получить преподавателя по ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             async with db.execute("SELECT * FROM teachers WHERE teacher_id = ?", (teacher_id,)) as cursor:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
 
     async def update_teacher(self, teacher_id: int, name: str = None, description: str = None):
         """Обновить данные преподавателя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             updates = []
             params = []
             if name is not None:
@@ -845,7 +1256,7 @@ class Database:
 
     async def delete_teacher(self, teacher_id: int):
         """Удалить преподавателя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             await db.execute("DELETE FROM teachers WHERE teacher_id = ?", (teacher_id,))
             await db.commit()
             return True
@@ -853,7 +1264,7 @@ class Database:
     # Методы для работы с отзывами
     async def create_review(self, course_id: int, user_id: int, rating: int, comment: str = None):
         """Создать отзыв"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             # Проверяем, не оставлял ли пользователь уже отзыв на этот курс
             async with db.execute("""
                 SELECT review_id FROM reviews 
@@ -867,137 +1278,16 @@ class Database:
                 INSERT INTO reviews (course_id, user_id, rating, comment)
                 VALUES (?, ?, ?, ?)
             """, (course_id, user_id, rating, comment))
-            await db.commit()
             
-            # Обновляем рейтинг курса
-            await self._update_course_rating(course_id)
-            
-            return cursor.lastrowid
-
-    async def get_reviews(self, course_id: int, limit: int = 20):
-        """Получить отзывы о курсе"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT r.*, u.full_name, u.username
-                FROM reviews r
-                LEFT JOIN users u ON r.user_id = u.user_id
-                WHERE r.course_id = ?
-                ORDER BY r.created_at DESC
-                LIMIT ?
-            """, (course_id, limit)) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
-
-    async def get_user_review(self, course_id: int, user_id: int):
-        """Получить отзыв пользователя о курсе"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT * FROM reviews 
-                WHERE course_id = ? AND user_id = ?
-            """, (course_id, user_id)) as cursor:
-                row = await cursor.fetchone()
-                return dict(row) if row else None
-
-    async def _update_course_rating(self, course_id: int):
-        """Обновить средний рейтинг курса"""
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("""
-                SELECT AVG(rating) as avg_rating, COUNT(*) as count
-                FROM reviews WHERE course_id = ?
-            """, (course_id,)) as cursor:
-                result = await cursor.fetchone()
-                if result and result["count"] > 0:
-                    avg_rating = result["avg_rating"]
-                    await db.execute("""
-                        UPDATE courses SET rating = ? WHERE course_id = ?
-                    """, (round(avg_rating, 1), course_id))
-                    await db.commit()
-
-    # Методы для работы с преподавателями
-    async def create_teacher(self, center_id: int, name: str, description: str = None):
-        """Создать преподавателя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("""
-                INSERT INTO teachers (center_id, name, description)
-                VALUES (?, ?, ?)
-            """, (center_id, name, description))
+            # Обновляем рейтинг курса в той же транзакции
+            await self._update_course_rating(db, course_id)
             await db.commit()
-            return cursor.lastrowid
-
-    async def get_teachers(self, center_id: int):
-        """Получить всех преподавателей центра"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM teachers WHERE center_id = ?", (center_id,)) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
-
-    async def get_teacher(self, teacher_id: int):
-        """Получить преподавателя по ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM teachers WHERE teacher_id = ?", (teacher_id,)) as cursor:
-                row = await cursor.fetchone()
-                return dict(row) if row else None
-
-    async def update_teacher(self, teacher_id: int, name: str = None, description: str = None):
-        """Обновить данные преподавателя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            updates = []
-            params = []
-            if name is not None:
-                updates.append("name = ?")
-                params.append(name)
-            if description is not None:
-                updates.append("description = ?")
-                params.append(description)
-            if updates:
-                params.append(teacher_id)
-                await db.execute(
-                    f"UPDATE teachers SET {', '.join(updates)} WHERE teacher_id = ?",
-                    params
-                )
-                await db.commit()
-                return True
-            return False
-
-    async def delete_teacher(self, teacher_id: int):
-        """Удалить преподавателя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("DELETE FROM teachers WHERE teacher_id = ?", (teacher_id,))
-            await db.commit()
-            return True
-
-    # Методы для работы с отзывами
-    async def create_review(self, course_id: int, user_id: int, rating: int, comment: str = None):
-        """Создать отзыв"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Проверяем, не оставлял ли пользователь уже отзыв на этот курс
-            async with db.execute("""
-                SELECT review_id FROM reviews 
-                WHERE course_id = ? AND user_id = ?
-            """, (course_id, user_id)) as cursor:
-                existing = await cursor.fetchone()
-                if existing:
-                    return None  # Отзыв уже существует
-            
-            cursor = await db.execute("""
-                INSERT INTO reviews (course_id, user_id, rating, comment)
-                VALUES (?, ?, ?, ?)
-            """, (course_id, user_id, rating, comment))
-            await db.commit()
-            
-            # Обновляем рейтинг курса
-            await self._update_course_rating(course_id)
             
             return cursor.lastrowid
 
     async def get_reviews(self, course_id: int, limit: int = 20):
         """Получить отзывы о курсе"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             async with db.execute("""
                 SELECT r.*, u.full_name, u.username
                 FROM reviews r
@@ -1011,8 +1301,7 @@ class Database:
 
     async def get_user_review(self, course_id: int, user_id: int):
         """Получить отзыв пользователя о курсе"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             async with db.execute("""
                 SELECT * FROM reviews 
                 WHERE course_id = ? AND user_id = ?
@@ -1020,18 +1309,19 @@ class Database:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
 
-    async def _update_course_rating(self, course_id: int):
-        """Обновить средний рейтинг курса"""
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("""
-                SELECT AVG(rating) as avg_rating, COUNT(*) as count
-                FROM reviews WHERE course_id = ?
-            """, (course_id,)) as cursor:
-                result = await cursor.fetchone()
-                if result and result["count"] > 0:
-                    avg_rating = result["avg_rating"]
-                    await db.execute("""
-                        UPDATE courses SET rating = ? WHERE course_id = ?
-                    """, (round(avg_rating, 1), course_id))
-                    await db.commit()
+    async def _update_course_rating(self, db, course_id: int):
+        """Обновить средний рейтинг курса (на переданном соединении записи)"""
+        async with db.execute("""
+            SELECT AVG(rating) as avg_rating, COUNT(*) as count
+            FROM reviews WHERE course_id = ?
+        """, (course_id,)) as cursor:
+            result = await cursor.fetchone()
+        if result and result["count"] > 0:
+            avg_rating = result["avg_rating"]
+            await db.execute("""
+                UPDATE courses SET rating = ? WHERE course_id = ?
+            """, (round(avg_rating, 1), course_id))
+
 
+# Общий экземпляр базы данных для всех обработчиков
+db = Database()
@@ -1,17 +1,22 @@
 from aiogram import Router, F, Bot
 from aiogram.types import Message, CallbackQuery
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 import logging
 
-from database import Database
+from database import db
+from services.payment_activation import payment_activator
+from services.payment_reconciliation import PaymentReconciler
 from utils.keyboards import get_admin_menu, get_moderation_keyboard
-from config import ROLE_ADMIN, STATUS_APPROVED, STATUS_REJECTED, ADMIN_IDS
+from utils.metrics import metrics
+from utils.timeutils import SECONDS_PER_DAY, day_bucket, local_day_start, utc_timestamp
+from config import ROLE_ADMIN, STATUS_APPROVED, STATUS_REJECTED, ADMIN_IDS, LOCAL_UTC_OFFSET, RECONCILE_DAYS
 
 logger = logging.getLogger(__name__)
 router = Router()
-db = Database()
+
+payment_reconciler = PaymentReconciler(payment_activator)
 
 
 class BroadcastStates(StatesGroup):
@@ -60,6 +65,49 @@ async def cmd_admin(message: Message):
         )
 
 
+@router.message(Command("metrics"))
+async def cmd_metrics(message: Message):
+    """Метрики процесса: задержки и счётчики"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа к этой функции.")
+        return
+    
+    from services.payment import airba_client
+    resilience = airba_client.resilience_snapshot()
+    breaker, budget = resilience["breaker"], resilience["retry_budget"]
+    airba_state = (
+        f"🔌 AirbaPay: автомат {breaker['state']}, сбоев подряд {breaker['failures']}/{breaker['failure_threshold']}"
+        + (f", повтор через {breaker['retry_in']} сек" if breaker['retry_in'] else "")
+        + f"\n   повторы за 10 сек: {budget['retries']}/{budget['allowed']} (запросов {budget['requests']})"
+    )
+    
+    await message.answer(f"📈 Метрики\n\n{metrics.format_report()}\n\n{airba_state}")
+
+
+@router.message(Command("reconcile"))
+async def cmd_reconcile(message: Message, command: CommandObject):
+    """Сверка платежей с AirbaPay: /reconcile [дней] [dry — только отчёт]"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа к этой функции.")
+        return
+
+    args = (command.args or "").split()
+    apply = "dry" not in args
+    days = next((int(arg) for arg in args if arg.isdigit()), RECONCILE_DAYS)
+    if payment_reconciler.running:
+        await message.answer("⏳ Сверка платежей уже выполняется.")
+        return
+
+    await message.answer(f"🔄 Сверка платежей за {days} дн. запущена" + ("" if apply else " (без исправлений)"))
+    try:
+        report = await payment_reconciler.run(utc_timestamp() - days * 86400, apply=apply, bot=message.bot)
+    except Exception as e:
+        logger.error(f"Ошибка сверки платежей: {e}", exc_info=True)
+        await message.answer("❌ Ошибка при сверке платежей, подробности в логах.")
+        return
+    await message.answer(report.format())
+
+
 @router.message((F.text == "✅ Модерация") | (F.text == "Модерация"))
 async def moderation_menu(message: Message):
     """Меню модерации"""
@@ -220,9 +268,7 @@ async def admin_subscriptions(message: Message):
         return
     
     try:
-        import aiosqlite
-        async with aiosqlite.connect(db.db_path) as db_conn:
-            db_conn.row_factory = aiosqlite.Row
+        async with db.pool.read() as db_conn:
             async with db_conn.execute("SELECT COUNT(*) as count FROM subscriptions") as cursor:
                 total = await cursor.fetchone()
                 total_count = total["count"] if total else 0
@@ -257,9 +303,7 @@ async def admin_payments(message: Message):
         return
     
     try:
-        import aiosqlite
-        async with aiosqlite.connect(db.db_path) as db_conn:
-            db_conn.row_factory = aiosqlite.Row
+        async with db.pool.read() as db_conn:
             async with db_conn.execute("SELECT COUNT(*) as count FROM payments") as cursor:
                 total = await cursor.fetchone()
                 total_count = total["count"] if total else 0
@@ -297,32 +341,29 @@ async def admin_visits(message: Message):
         return
     
     try:
-        import aiosqlite
-        from datetime import datetime, timedelta
+        # Местные сутки занимают двое суток UTC: visit_day сужает выборку
+        # по индексу, visited_ts отсекает по местной полуночи
+        today_start = local_day_start(LOCAL_UTC_OFFSET)
+        week_start = today_start - 7 * SECONDS_PER_DAY
         
-        async with aiosqlite.connect(db.db_path) as db_conn:
-            db_conn.row_factory = aiosqlite.Row
+        async with db.pool.read() as db_conn:
             async with db_conn.execute("SELECT COUNT(*) as count FROM visits") as cursor:
                 total = await cursor.fetchone()
                 total_count = total["count"] if total else 0
             
-            # Посещения за сегодня
-            today = datetime.now().date()
-            today_str = today.strftime('%Y-%m-%d')
+            # Посещения за сегодня (местные сутки)
             async with db_conn.execute("""
                 SELECT COUNT(*) as count FROM visits 
-                WHERE date(visited_at) = date(?)
-            """, (today_str,)) as cursor:
+                WHERE visit_day >= ? AND visited_ts >= ?
+            """, (day_bucket(today_start), today_start)) as cursor:
                 today_visits = await cursor.fetchone()
                 today_count = today_visits["count"] if today_visits else 0
             
             # Посещения за последние 7 дней
-            week_ago = (datetime.now() - timedelta(days=7)).date()
-            week_ago_str = week_ago.strftime('%Y-%m-%d')
             async with db_conn.execute("""
                 SELECT COUNT(*) as count FROM visits 
-                WHERE date(visited_at) >= date(?)
-            """, (week_ago_str,)) as cursor:
+                WHERE visit_day >= ? AND visited_ts >= ?
+            """, (day_bucket(week_start), week_start)) as cursor:
                 week_visits = await cursor.fetchone()
                 week_count = week_visits["count"] if week_visits else 0
         
@@ -331,6 +372,14 @@ async def admin_visits(message: Message):
         text += f"📅 За сегодня: {today_count}\n"
         text += f"📆 За последние 7 дней: {week_count}\n"
         
+        scan_latency = metrics.latency("scan")
+        if scan_latency and scan_latency.count:
+            snap = scan_latency.snapshot()
+            text += (
+                f"\n⏱ Сканирование QR: p50 {snap['p50']:.1f} мс, "
+                f"p99 {snap['p99']:.1f} мс ({snap['count']} сканов)\n"
+            )
+        
         await message.answer(text)
     except Exception as e:
         logger.error(f"Ошибка в admin_visits: {e}", exc_info=True)
@@ -349,9 +398,7 @@ async def admin_children_parents(message: Message):
     
     try:
         # Получаем всех родителей
-        import aiosqlite
-        async with aiosqlite.connect(db.db_path) as db_conn:
-            db_conn.row_factory = aiosqlite.Row
+        async with db.pool.read() as db_conn:
             async with db_conn.execute("""
                 SELECT u.*, COUNT(c.child_id) as children_count
                 FROM users u
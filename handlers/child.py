@@ -1,13 +1,12 @@
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, BufferedInputFile
 
-from database import Database
+from database import db
 from utils.keyboards import get_child_menu
 from utils.qr_generator import generate_qr_code
 from config import ROLE_CHILD
 
 router = Router()
-db = Database()
 
 
 @router.message(F.text == "📷 Показать QR")
@@ -4,12 +4,11 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from database import Database
+from database import db
 from utils.keyboards import get_main_menu, get_parent_menu, get_child_menu, get_parent_start_keyboard
 from config import ROLE_USER, ROLE_PARENT, ROLE_CHILD
 
 router = Router()
-db = Database()
 
 
 class StartStates(StatesGroup):
@@ -1,19 +1,20 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, BufferedInputFile, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from database import Database
+from database import db
 from utils.keyboards import (
     get_parent_menu, get_children_keyboard, get_search_params_keyboard,
-    get_cities_keyboard, get_categories_keyboard, get_course_keyboard,
+    get_cities_keyboard, get_categories_keyboard,
     get_tariff_keyboard, get_course_detail_keyboard
 )
-from utils.qr_generator import generate_subscription_qr
+from utils.qr_cache import qr_cache
+from utils.qr_generator import create_subscription_qr
+from handlers.user import _start_catalog
 from config import ROLE_PARENT
 
 router = Router()
-db = Database()
 
 
 class ParentStates(StatesGroup):
@@ -156,9 +157,10 @@ async def parent_category_selected(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     city = data.get("city")
     
-    courses = await db.get_courses(city=city, category=category)
+    filters = dict(city=city, category=category)
+    total = await db.count_courses(**filters)
     
-    if not courses:
+    if not total:
         await callback.message.edit_text(
             "😔 Курсов не найдено. Попробуй другие параметры.",
             reply_markup=get_search_params_keyboard()
@@ -166,26 +168,12 @@ async def parent_category_selected(callback: CallbackQuery, state: FSMContext):
         await callback.answer()
         return
     
-    text = f"Найдено курсов: {len(courses)}\n\n"
-    for course in courses[:5]:
-        center_name = course.get("center_name", "Не указано")
-        price_8 = course.get("price_8", 0)
-        rating = course.get("rating", 0)
-        address = course.get("address", "")
-        city_name = course.get("city", "")
-        
-        text += f"📘 Курс: {course['name']}\n"
-        text += f"🏫 {center_name}\n"
-        text += f"💰 Абонемент: 8 занятий — {price_8:,}₸\n"
-        text += f"⭐️ Рейтинг: {rating}\n"
-        text += f"📍 {city_name}, {address}\n\n"
-        
-        await callback.message.answer(
-            text,
-            reply_markup=get_course_keyboard(course["course_id"])
-        )
-        text = ""
-    
+    # Тот же постраничный каталог, что и у пользователя; состояние покупки
+    # для ребёнка сохраняется
+    text, keyboard = await _start_catalog(
+        state, filters, "rating", f"Найдено курсов: {total}", clear_state=False
+    )
+    await callback.message.edit_text(text, reply_markup=keyboard)
     await callback.answer()
 
 
@@ -297,15 +285,9 @@ async def parent_tariff_selected(callback: CallbackQuery, state: FSMContext):
     price = price_map.get(tariff, 0)
     
     # Создаём абонемент без оплаты (для демонстрации)
-    qr_id, qr_image = generate_subscription_qr(user_id, subscription_id, child_id)
+    qr_id, qr_text = create_subscription_qr(user_id, subscription_id, child_id)
     
-    import aiosqlite
-    async with aiosqlite.connect(db.db_path) as db_conn:
-        await db_conn.execute(
-            "UPDATE subscriptions SET qr_code = ? WHERE subscription_id = ?",
-            (qr_id, subscription_id)
-        )
-        await db_conn.commit()
+    await db.update_subscription_qr(subscription_id, qr_id)
     
     await callback.message.answer(
         f"🎉 Вы купили абонемент для {child['name']}!\n\n"
@@ -313,9 +295,9 @@ async def parent_tariff_selected(callback: CallbackQuery, state: FSMContext):
     )
     
     try:
-        qr_bytes = qr_image.getvalue()
-        await callback.message.answer_photo(
-            photo=BufferedInputFile(qr_bytes, filename="qr_code.png"),
+        await qr_cache.answer_photo(
+            callback.message,
+            qr_text,
             caption=f"QR-код для {child['name']}"
         )
     except Exception:
@@ -391,6 +373,7 @@ async def parent_purchases(message: Message):
             "success": "✅",
             "pending": "⏳",
             "failed": "❌",
+            "expired": "⌛",
             "refunded": "↩️"
         }.get(payment.get("status", "pending"), "❓")
         
@@ -1,19 +1,31 @@
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, BufferedInputFile
-from aiogram.filters import Command
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from database import Database
+from database import db
 from utils.keyboards import get_partner_menu
 from utils.validators import validate_name, validate_phone, validate_price, validate_text_length
-from config import ROLE_PARTNER, STATUS_PENDING, STATUS_APPROVED, CITIES, CATEGORIES
+from utils.timeutils import SECONDS_PER_DAY, local_day_start
+from utils.qr_decoder import QR_DECODE_AVAILABLE, decode_qr_photo
+from utils.qr_token import is_qr_token, normalize_qr_token
+from utils.scan_journal import format_journal_report, parse_scan_journal
+from services.scan import ScanService
+from config import (
+    ROLE_PARTNER, STATUS_PENDING, STATUS_APPROVED, CITIES, CATEGORIES, SCAN_BATCH_MAX, SCAN_INVALID,
+    LOCAL_UTC_OFFSET, SCAN_JOURNAL_MAX, SCAN_JOURNAL_MAX_BYTES,
+    SCAN_CENTER_NOT_APPROVED, SCAN_NO_CENTER, SCAN_NOT_PARTNER, SCAN_NOT_REGISTERED, SCAN_RATE_LIMITED,
+    VISIT_EXHAUSTED, VISIT_INACTIVE, VISIT_DUPLICATE, VISIT_NOT_FOUND, VISIT_OK
+)
 import logging
+from typing import List, Optional
 
 logger = logging.getLogger(__name__)
 
 router = Router()
-db = Database()
+scan_service = ScanService(db)
 
 
 class PartnerRegistrationStates(StatesGroup):
@@ -514,12 +526,16 @@ async def scan_qr(message: Message, state: FSMContext):
     await message.answer(
         "🧾 Режим сканирования QR-кода\n\n"
         "Отправьте QR-код одним из способов:\n\n"
-        "1️⃣ Полный формат:\n"
+        "1️⃣ Код абонемента:\n"
+        "   SUB:XXXXXXXXXXXXXXXXXXXXXXXXXX\n\n"
+        "2️⃣ Полный формат (старые абонементы):\n"
         "   SUBSCRIPTION:uuid:user_id:subscription_id\n\n"
-        "2️⃣ Только UUID (QR ID):\n"
+        "3️⃣ Только UUID (QR ID):\n"
         "   uuid-код\n\n"
         "Пример: 7d011397-3b4f-468f-b8ee-9900ccb8afe0\n\n"
-        "Внимание: В реальном приложении здесь был бы режим камеры Telegram."
+        "📷 Или просто сфотографируйте QR-код и отправьте фото.\n\n"
+        "📒 Сканирования без связи можно загрузить файлом (CSV/TXT): "
+        "по строке «QR-код;время», например SUB:...;2026-10-18 09:30"
     )
 
 
@@ -569,13 +585,19 @@ async def qr_scanned_uuid(message: Message, state: FSMContext):
         # Это кнопка меню, не обрабатываем здесь
         return
     
-    # Проверяем, похоже ли на UUID
+    # Проверяем, похоже ли на UUID (в списке кодов для групповой отметки — первая строка)
+    first_line = text.splitlines()[0].strip() if text else ""
     is_uuid = False
-    if re.match(uuid_pattern_with_dashes, text, re.IGNORECASE):
+    if re.match(uuid_pattern_with_dashes, first_line, re.IGNORECASE):
         is_uuid = True
-    elif re.match(uuid_pattern_without_dashes, text, re.IGNORECASE):
+    elif re.match(uuid_pattern_without_dashes, first_line, re.IGNORECASE):
         is_uuid = True
     
+    if is_qr_token(first_line):
+        # Подписанный токен абонемента
+        await qr_scanned_internal(message)
+        return
+    
     if is_uuid:
         # Это UUID, обрабатываем как QR-код
         logger.info(f"Обнаружен UUID в сообщении партнера: {text[:50]}")
@@ -584,247 +606,366 @@ async def qr_scanned_uuid(message: Message, state: FSMContext):
     # Если не UUID, не обрабатываем (другие обработчики обработают)
 
 
-async def qr_scanned_internal(message: Message):
-    """Обработка отсканированного QR-кода"""
-    import logging
-    logger = logging.getLogger(__name__)
+@router.message(F.photo, StateFilter(None))
+async def qr_scanned_photo(message: Message):
+    """Фото QR-кода от партнёра: распознаём и передаём в тот же конвейер, что и текст"""
+    user = await db.get_user(message.from_user.id)
+    if not user or user.get("role") != ROLE_PARTNER:
+        # Не партнёр — пусть фото обработает общий обработчик
+        raise SkipHandler()
+    
+    if not QR_DECODE_AVAILABLE:
+        await message.answer(
+            "📷 Распознавание QR-кодов с фото недоступно.\n\n"
+            "Отправьте код текстом."
+        )
+        return
     
     try:
-        # Проверяем, что пользователь является партнером
+        qr_texts = await decode_qr_photo(message.bot, message.photo)
+    except Exception as e:
+        logger.error(f"Ошибка при распознавании QR-кода на фото: {e}", exc_info=True)
+        qr_texts = []
+    
+    if not qr_texts:
+        await message.answer(
+            "❌ Не удалось найти QR-код на фото.\n\n"
+            "Сфотографируйте код крупнее и без бликов или отправьте его текстом."
+        )
+        return
+    
+    if len(qr_texts) > 1:
+        # Несколько кодов на одном фото — групповая отметка
+        await qr_scanned_batch(message, qr_texts)
+        return
+    await qr_scanned_internal(message, qr_texts[0])
+
+
+def parse_qr_code(qr_text: str) -> Optional[str]:
+    """QR ID из текста QR-кода (токен, SUBSCRIPTION:... или UUID); None — формат неверный"""
+    qr_text = qr_text.strip()
+    qr_id = None
+    
+    if is_qr_token(qr_text):
+        # Подписанный токен: подпись проверит ScanService
+        qr_id = normalize_qr_token(qr_text)
+    elif qr_text.startswith("SUBSCRIPTION:"):
+        # Полный формат: SUBSCRIPTION:uuid:user_id:subscription_id
+        parts = qr_text.split(":")
+        if len(parts) >= 4:
+            qr_id = parts[1].strip()
+    else:
+        # Возможно, это только UUID (с дефисами или без)
+        import re
+        uuid_pattern = r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$'
+        if re.match(uuid_pattern, qr_text):
+            qr_id = qr_text
+        else:
+            # Убираем все пробелы и дефисы и проверяем длину
+            cleaned = qr_text.replace(" ", "").replace("-", "")
+            if len(cleaned) >= 20:  # Минимальная длина для UUID без дефисов
+                qr_id = cleaned
+    
+    # Валидация UUID/QR ID
+    if not qr_id or len(qr_id) < 10:
+        return None
+    return qr_id
+
+
+async def qr_scanned_internal(message: Message, qr_text: str = None):
+    """Обработка отсканированного QR-кода (qr_text — если код пришёл не текстом сообщения)"""
+    try:
         user_id = message.from_user.id
-        user = await db.get_user(user_id)
-        
-        if not user:
-            await message.answer(
-                "❌ Вы не зарегистрированы в системе.\n\n"
-                "Отправьте /start для регистрации."
-            )
-            return
         
-        # Проверяем роль партнера
-        if user.get("role") != ROLE_PARTNER:
-            await message.answer(
-                "❌ Эта функция доступна только для партнеров.\n\n"
-                "Используйте команду /partner для входа в панель партнера."
-            )
-            return
+        qr_text = (qr_text or message.text).strip()
         
-        # Проверяем наличие центра
-        center = await db.get_partner_center(user_id)
-        if not center:
-            await message.answer(
-                "❌ У вас нет зарегистрированного центра.\n\n"
-                "Используйте команду /partner для регистрации центра."
-            )
-            return
-        
-        # Проверяем статус центра
-        if center.get("status") != STATUS_APPROVED:
-            await message.answer(
-                "❌ Ваш центр не одобрен администратором.\n\n"
-                f"Статус: {'⏳ На модерации' if center.get('status') == STATUS_PENDING else '❌ Отклонен'}\n"
-                "Дождитесь одобрения центра для использования функции сканирования QR-кодов."
-            )
+        # Несколько кодов в одном сообщении (по одному на строку) — групповая отметка
+        lines = [line.strip() for line in qr_text.splitlines() if line.strip()]
+        if len(lines) > 1:
+            await qr_scanned_batch(message, lines)
             return
         
         # Парсим QR-код
-        qr_text = message.text.strip()
-        qr_id = None
-        
-        # Проверяем формат QR-кода
-        if qr_text.startswith("SUBSCRIPTION:"):
-            # Полный формат: SUBSCRIPTION:uuid:user_id:subscription_id
-            parts = qr_text.split(":")
-            if len(parts) < 4:
+        qr_id = parse_qr_code(qr_text)
+        if not qr_id:
+            if qr_text.startswith("SUBSCRIPTION:"):
                 await message.answer(
                     "❌ Неверный формат QR-кода.\n\n"
                     "Ожидается формат: SUBSCRIPTION:uuid:user_id:subscription_id\n\n"
                     "Убедитесь, что вы скопировали QR-код полностью."
                 )
-                return
-            qr_id = parts[1].strip()
-        else:
-            # Возможно, это только UUID
-            # Проверяем, похоже ли на UUID (содержит дефисы и имеет длину ~36 символов)
-            import re
-            uuid_pattern = r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$'
-            if re.match(uuid_pattern, qr_text):
-                # Это UUID, используем его напрямую
-                qr_id = qr_text
-                logger.info(f"Обнаружен UUID формат: {qr_id}")
             else:
-                # Пробуем использовать как QR ID (может быть без дефисов)
-                # Убираем все пробелы и проверяем длину
-                cleaned = qr_text.replace(" ", "").replace("-", "")
-                if len(cleaned) >= 20:  # Минимальная длина для UUID без дефисов
-                    qr_id = cleaned
-                    logger.info(f"Обнаружен QR ID без дефисов: {qr_id}")
-                else:
-                    await message.answer(
-                        "❌ Неверный формат QR-кода.\n\n"
-                        "Поддерживаемые форматы:\n"
-                        "• SUBSCRIPTION:uuid:user_id:subscription_id\n"
-                        "• UUID (например: 7d011397-3b4f-468f-b8ee-9900ccb8afe0)\n\n"
-                        "Проверьте правильность QR-кода и попробуйте еще раз."
-                    )
-                    return
-        
-        # Валидация UUID/QR ID
-        if not qr_id or len(qr_id) < 10:
-            await message.answer(
-                "❌ Неверный формат QR-кода.\n\n"
-                "QR ID слишком короткий или отсутствует.\n"
-                "Минимальная длина: 10 символов."
-            )
+                await message.answer(
+                    "❌ Неверный формат QR-кода.\n\n"
+                    "Поддерживаемые форматы:\n"
+                    "• SUB:код\n"
+                    "• SUBSCRIPTION:uuid:user_id:subscription_id\n"
+                    "• UUID (например: 7d011397-3b4f-468f-b8ee-9900ccb8afe0)\n\n"
+                    "Проверьте правильность QR-кода и попробуйте еще раз."
+                )
             return
         
-        logger.info(f"Попытка сканирования QR-кода: qr_id={qr_id}, partner_id={user_id}, center_id={center['center_id']}")
+        logger.info(f"Попытка сканирования QR-кода: qr_id={qr_id}, partner_id={user_id}")
         
-        # Получаем абонемент по QR-коду
-        subscription = await db.get_subscription_by_qr(qr_id)
+        # Проверка партнёра, центра, абонемента и запись посещения — одним обращением к БД
+        outcome = await scan_service.scan(user_id, qr_id)
+        await message.answer(format_scan_reply(outcome))
         
-        if not subscription:
-            await message.answer(
-                "❌ Абонемент не найден или недействителен.\n\n"
-                "Возможные причины:\n"
-                "• QR-код неверный или устарел\n"
-                "• Абонемент был удален\n"
-                "• Абонемент неактивен\n\n"
-                "Проверьте правильность QR-кода и попробуйте еще раз."
+        if outcome["result"] == VISIT_OK:
+            logger.info(
+                f"Посещение записано: subscription_id={outcome['subscription_id']}, "
+                f"center_id={outcome['center_id']}, student={outcome.get('student_name')}, "
+                f"remaining={outcome['lessons_remaining']}, status_after={outcome['status']}"
             )
-            logger.warning(f"Абонемент не найден по QR-коду: qr_id={qr_id}")
-            return
-        
-        # Проверяем статус абонемента
-        if subscription.get("status") != "active":
-            status_text = {
-                "expired": "истек",
-                "pending": "ожидает активации",
-                "cancelled": "отменен"
-            }.get(subscription.get("status"), "неактивен")
+        else:
+            logger.warning(f"Посещение не записано: qr_id={qr_id}, partner_id={user_id}, result={outcome['result']}")
             
+    except Exception as e:
+        logger.error(f"Ошибка при обработке QR-кода: {e}", exc_info=True)
+        await message.answer(
+            "❌ Произошла ошибка при обработке QR-кода.\n\n"
+            "Попробуйте еще раз или обратитесь в поддержку."
+        )
+
+
+async def qr_scanned_batch(message: Message, qr_texts: List[str]):
+    """Групповая отметка: все коды проверяются и записываются одной транзакцией, ответ — один"""
+    user_id = message.from_user.id
+    
+    if len(qr_texts) > SCAN_BATCH_MAX:
+        await message.answer(
+            f"❌ Слишком много QR-кодов в одном сообщении ({len(qr_texts)}).\n\n"
+            f"Максимум: {SCAN_BATCH_MAX}. Разделите список на несколько сообщений."
+        )
+        return
+    
+    parsed = [parse_qr_code(qr_text) for qr_text in qr_texts]
+    valid_codes = [qr_id for qr_id in parsed if qr_id]
+    try:
+        outcome = await scan_service.scan_batch(user_id, valid_codes)
+    except Exception as e:
+        logger.error(f"Ошибка при групповой отметке: {e}", exc_info=True)
+        await message.answer(
+            "❌ Произошла ошибка при обработке QR-кодов.\n\n"
+            "Попробуйте еще раз или обратитесь в поддержку."
+        )
+        return
+    
+    if "items" not in outcome:
+        # Партнёр не может сканировать (не зарегистрирован, нет центра и т.п.)
+        await message.answer(format_scan_reply(outcome))
+        return
+    
+    # Возвращаем неразобранные строки на их места
+    results = iter(outcome["items"])
+    items = [next(results) if qr_id else {"result": SCAN_INVALID, "qr_code": qr_text}
+             for qr_id, qr_text in zip(parsed, qr_texts)]
+    
+    recorded = sum(1 for item in items if item["result"] == VISIT_OK)
+    logger.info(
+        f"Групповая отметка: partner_id={user_id}, center_id={outcome.get('center_id')}, "
+        f"записано {recorded} из {len(items)}"
+    )
+    await message.answer(format_batch_reply(items))
+
+
+def format_batch_reply(items: List[dict]) -> str:
+    """Сводный ответ по групповой отметке: строка на каждый код"""
+    recorded = sum(1 for item in items if item["result"] == VISIT_OK)
+    lines = [f"📋 Групповая отметка: записано {recorded} из {len(items)}\n"]
+    
+    for number, item in enumerate(items, 1):
+        result = item["result"]
+        student = item.get("student_name") or "Ученик"
+        if result == VISIT_OK:
+            if item.get("tariff") == "unlimited":
+                line = f"✅ {student} — безлимит"
+            else:
+                line = f"✅ {student} — осталось занятий: {item.get('lessons_remaining')}"
+        elif result == VISIT_DUPLICATE:
+            line = f"⚠️ {student} — уже отмечен"
+        elif result == VISIT_EXHAUSTED:
+            line = f"❌ {student} — занятия закончились"
+        elif result == VISIT_INACTIVE:
+            line = f"❌ {student} — абонемент неактивен"
+        elif result == VISIT_NOT_FOUND:
+            line = f"❌ Код …{(item.get('qr_code') or '')[-6:]} — абонемент не найден"
+        else:
+            line = f"❌ «{(item.get('qr_code') or '')[:20]}» — неверный формат"
+        lines.append(f"{number}. {line}")
+    return "\n".join(lines)
+
+
+@router.message(F.document, StateFilter(None))
+async def scan_journal_uploaded(message: Message):
+    """
+    Журнал офлайн-сканирований от партнёра: CSV/текст со строками
+    «QR-код;время сканирования». Все записи применяются одной транзакцией
+    в порядке времени, в ответ — сводка и отчёт по каждой строке.
+    """
+    user = await db.get_user(message.from_user.id)
+    if not user or user.get("role") != ROLE_PARTNER:
+        # Не партнёр — пусть документ обработает общий обработчик
+        raise SkipHandler()
+    
+    document = message.document
+    if document.file_size and document.file_size > SCAN_JOURNAL_MAX_BYTES:
+        await message.answer(
+            f"❌ Файл журнала слишком большой (максимум {SCAN_JOURNAL_MAX_BYTES // 1024} КБ)."
+        )
+        return
+    
+    try:
+        raw = (await message.bot.download(document.file_id)).read()
+        try:
+            text = raw.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            text = raw.decode("cp1251")
+        
+        records, errors = parse_scan_journal(text)
+        if len(records) > SCAN_JOURNAL_MAX:
             await message.answer(
-                f"❌ Абонемент {status_text}.\n\n"
-                "Обратитесь к администратору для уточнения."
+                f"❌ Слишком много записей в журнале ({len(records)}).\n\n"
+                f"Максимум: {SCAN_JOURNAL_MAX}. Разделите журнал на несколько файлов."
             )
             return
-        
-        # Универсальные абонементы работают во всех центрах - проверка принадлежности не нужна
-        
-        # Проверяем, не закончились ли занятия (перед записью)
-        remaining_before = subscription.get("lessons_remaining", 0)
-        tariff = subscription.get("tariff", "")
-        
-        if tariff != "unlimited" and remaining_before <= 0:
+        if not records and not errors:
             await message.answer(
-                "❌ У абонемента закончились занятия.\n\n"
-                f"Осталось занятий: 0\n"
-                "Попросите ученика продлить абонемент."
+                "❌ Журнал пуст.\n\n"
+                "Ожидается по строке на сканирование: QR-код;время (например 2026-10-18 09:30)."
             )
             return
         
-        # Записываем посещение
-        subscription_id = subscription["subscription_id"]
-        logger.info(f"Попытка записи посещения: subscription_id={subscription_id}, center_id={center['center_id']}")
+        report = [
+            {"line": line, "qr_code": raw_line, "result": SCAN_INVALID, "reason": reason}
+            for line, raw_line, reason in errors
+        ]
+        parsed = [(record, parse_qr_code(record.qr_text)) for record in records]
+        for record, qr_id in parsed:
+            if not qr_id:
+                report.append({
+                    "line": record.line, "qr_code": record.qr_text, "scanned_at": record.scanned_at,
+                    "result": SCAN_INVALID, "reason": "неверный формат QR-кода",
+                })
+        valid = [(record, qr_id) for record, qr_id in parsed if qr_id]
         
-        success = await db.record_visit(
-            subscription_id,
-            center["center_id"]
+        outcome = await scan_service.sync_journal(
+            message.from_user.id, [(qr_id, record.scanned_at) for record, qr_id in valid]
         )
-        
-        if not success:
-            # Проверяем причину неудачи
-            # Получаем актуальные данные абонемента для диагностики
-            import aiosqlite
-            async with aiosqlite.connect(db.db_path) as db_conn:
-                db_conn.row_factory = aiosqlite.Row
-                async with db_conn.execute(
-                    "SELECT * FROM subscriptions WHERE subscription_id = ?",
-                    (subscription["subscription_id"],)
-                ) as cursor:
-                    current_sub = await cursor.fetchone()
-                    if current_sub:
-                        current_sub = dict(current_sub)
-                        if current_sub.get("status") != "active":
-                            await message.answer(
-                                "❌ Абонемент неактивен или истек.\n\n"
-                                "Обратитесь к администратору."
-                            )
-                        elif current_sub.get("lessons_remaining", 0) <= 0 and current_sub.get("tariff") != "unlimited":
-                            await message.answer(
-                                "❌ У абонемента закончились занятия.\n\n"
-                                "Попросите ученика продлить абонемент."
-                            )
-                        else:
-                            await message.answer(
-                                "⚠️ Посещение не записано.\n\n"
-                                "Возможно, это дубликат (посещение уже было записано в последние 5 минут).\n"
-                                "Попробуйте еще раз через несколько минут."
-                            )
-                    else:
-                        await message.answer("❌ Ошибка при записи посещения. Попробуйте еще раз.")
-            logger.error(f"Ошибка при записи посещения для subscription_id={subscription['subscription_id']}")
+        if "items" not in outcome:
+            await message.answer(format_scan_reply(outcome))
             return
-        
-        # Получаем обновленные данные абонемента после записи посещения
-        import aiosqlite
-        async with aiosqlite.connect(db.db_path) as db_conn:
-            db_conn.row_factory = aiosqlite.Row
-            async with db_conn.execute(
-                "SELECT lessons_remaining, status, tariff FROM subscriptions WHERE subscription_id = ?",
-                (subscription_id,)
-            ) as cursor:
-                updated_sub = await cursor.fetchone()
-                if updated_sub:
-                    updated_sub = dict(updated_sub)
-                    remaining = updated_sub.get("lessons_remaining", 0)
-                    status_after = updated_sub.get("status", "active")
-                else:
-                    # Если не удалось получить данные, используем расчетное значение
-                    remaining = max(0, remaining_before - 1) if tariff != "unlimited" else remaining_before
-                    status_after = subscription.get("status", "active")
-        
-        student_name = subscription.get("child_name") or subscription.get("owner_name", "Ученик")
-        template_name = subscription.get("template_name", "Универсальный абонемент")
-        
-        # Формируем ответ
-        response_text = f"✅ Посещение подтверждено!\n\n"
-        response_text += f"👤 Ученик: {student_name}\n"
-        response_text += f"🎫 Абонемент: {template_name}\n"
-        
-        if tariff == "unlimited":
-            response_text += f"📊 Тариф: Безлимит\n"
-        else:
-            response_text += f"📊 Осталось занятий: {remaining}\n"
-            if remaining == 0:
-                response_text += f"⚠️ Абонемент истек\n"
-        
-        await message.answer(response_text)
-        
-        logger.info(
-            f"Посещение успешно записано: subscription_id={subscription_id}, "
-            f"center_id={center['center_id']}, student={student_name}, "
-            f"remaining={remaining}, status_after={status_after}"
-        )
-        
-        # Логируем успешное посещение
-        logger.info(
-            f"Посещение записано: subscription_id={subscription['subscription_id']}, "
-            f"center_id={center['center_id']}, student={student_name}"
-        )
-        
-        # Отправляем уведомление родителю (если это ребёнок)
-        if subscription.get("child_id"):
-            parent_id = subscription.get("user_id")
-            # В реальном приложении здесь бы была отправка сообщения родителю
-            # await bot.send_message(parent_id, f"✅ {student_name} посетил занятие!")
-            
+        for (record, _), item in zip(valid, outcome["items"]):
+            report.append(dict(item, line=record.line, scanned_at=record.scanned_at))
     except Exception as e:
-        logger.error(f"Ошибка при обработке QR-кода: {e}", exc_info=True)
+        logger.error(f"Ошибка при загрузке журнала сканирований: {e}", exc_info=True)
         await message.answer(
-            "❌ Произошла ошибка при обработке QR-кода.\n\n"
+            "❌ Произошла ошибка при обработке журнала.\n\n"
             "Попробуйте еще раз или обратитесь в поддержку."
         )
+        return
+    
+    counts = {}
+    for row in report:
+        counts[row["result"]] = counts.get(row["result"], 0) + 1
+    logger.info(
+        f"Журнал сканирований: partner_id={message.from_user.id}, "
+        f"center_id={outcome.get('center_id')}, итоги={counts}"
+    )
+    summary = (
+        f"📒 Журнал обработан: {len(report)} записей\n\n"
+        f"✅ Записано: {counts.get(VISIT_OK, 0)}\n"
+        f"⚠️ Дубликаты: {counts.get(VISIT_DUPLICATE, 0)}\n"
+        f"❌ Не найдено: {counts.get(VISIT_NOT_FOUND, 0)}\n"
+        f"❌ Закончились занятия / неактивен: "
+        f"{counts.get(VISIT_EXHAUSTED, 0) + counts.get(VISIT_INACTIVE, 0)}\n"
+        f"❌ Ошибки в строках: {counts.get(SCAN_INVALID, 0)}\n\n"
+        "Подробный отчёт по каждой строке — в файле."
+    )
+    await message.answer_document(
+        BufferedInputFile(format_journal_report(report), filename="scan_journal_report.csv"),
+        caption=summary
+    )
+
+
+def format_scan_reply(outcome: dict) -> str:
+    """Текст ответа партнёру по результату сканирования"""
+    result = outcome["result"]
+    
+    if result == SCAN_NOT_REGISTERED:
+        return (
+            "❌ Вы не зарегистрированы в системе.\n\n"
+            "Отправьте /start для регистрации."
+        )
+    if result == SCAN_NOT_PARTNER:
+        return (
+            "❌ Эта функция доступна только для партнеров.\n\n"
+            "Используйте команду /partner для входа в панель партнера."
+        )
+    if result == SCAN_NO_CENTER:
+        return (
+            "❌ У вас нет зарегистрированного центра.\n\n"
+            "Используйте команду /partner для регистрации центра."
+        )
+    if result == SCAN_CENTER_NOT_APPROVED:
+        return (
+            "❌ Ваш центр не одобрен администратором.\n\n"
+            f"Статус: {'⏳ На модерации' if outcome.get('center_status') == STATUS_PENDING else '❌ Отклонен'}\n"
+            "Дождитесь одобрения центра для использования функции сканирования QR-кодов."
+        )
+    if result == SCAN_RATE_LIMITED:
+        return (
+            "⏳ Слишком много сканирований подряд.\n\n"
+            "Подождите немного и попробуйте еще раз."
+        )
+    if result == VISIT_NOT_FOUND:
+        return (
+            "❌ Абонемент не найден или недействителен.\n\n"
+            "Возможные причины:\n"
+            "• QR-код неверный или устарел\n"
+            "• Абонемент был удален\n\n"
+            "Проверьте правильность QR-кода и попробуйте еще раз."
+        )
+    if result == VISIT_EXHAUSTED:
+        return (
+            "❌ У абонемента закончились занятия.\n\n"
+            f"Осталось занятий: 0\n"
+            "Попросите ученика продлить абонемент."
+        )
+    if result == VISIT_INACTIVE:
+        status_text = {
+            "expired": "истек",
+            "pending": "ожидает активации",
+            "cancelled": "отменен"
+        }.get(outcome.get("status"), "неактивен")
+        return (
+            f"❌ Абонемент {status_text}.\n\n"
+            "Обратитесь к администратору для уточнения."
+        )
+    if result == VISIT_DUPLICATE:
+        return (
+            "⚠️ Посещение не записано.\n\n"
+            "Возможно, это дубликат (посещение уже было записано в последние 5 минут).\n"
+            "Попробуйте еще раз через несколько минут."
+        )
+    if result != VISIT_OK:
+        return "❌ Ошибка при записи посещения. Попробуйте еще раз."
+    
+    student_name = outcome.get("student_name") or "Ученик"
+    template_name = outcome.get("template_name") or "Универсальный абонемент"
+    remaining = outcome.get("lessons_remaining")
+    
+    response_text = f"✅ Посещение подтверждено!\n\n"
+    response_text += f"👤 Ученик: {student_name}\n"
+    response_text += f"🎫 Абонемент: {template_name}\n"
+    
+    if outcome.get("tariff") == "unlimited":
+        response_text += f"📊 Тариф: Безлимит\n"
+    else:
+        response_text += f"📊 Осталось занятий: {remaining}\n"
+        if remaining == 0:
+            response_text += f"⚠️ Абонемент истек\n"
+    return response_text
 
 
 @router.message(F.text == "🗓 Расписание")
@@ -838,9 +979,7 @@ async def partner_schedule(message: Message):
         return
     
     # Получаем курсы центра
-    import aiosqlite
-    async with aiosqlite.connect(db.db_path) as db_conn:
-        db_conn.row_factory = aiosqlite.Row
+    async with db.pool.read() as db_conn:
         async with db_conn.execute("""
             SELECT * FROM courses WHERE center_id = ?
         """, (center["center_id"],)) as cursor:
@@ -870,9 +1009,7 @@ async def partner_courses(message: Message):
         return
     
     # Получаем курсы центра
-    import aiosqlite
-    async with aiosqlite.connect(db.db_path) as db_conn:
-        db_conn.row_factory = aiosqlite.Row
+    async with db.pool.read() as db_conn:
         async with db_conn.execute("""
             SELECT * FROM courses WHERE center_id = ?
         """, (center["center_id"],)) as cursor:
@@ -983,9 +1120,7 @@ async def partner_analytics(message: Message):
         analytics = await db.get_center_analytics(center["center_id"])
         
         # Получаем количество активных абонементов
-        import aiosqlite
-        async with aiosqlite.connect(db.db_path) as db_conn:
-            db_conn.row_factory = aiosqlite.Row
+        async with db.pool.read() as db_conn:
             async with db_conn.execute("""
                 SELECT COUNT(*) as count FROM subscriptions 
                 WHERE center_id = ? AND status = 'active'
@@ -1012,16 +1147,14 @@ async def partner_analytics(message: Message):
         text += f"   💵 Доход: {analytics.get('total_revenue', 0):,} ₸\n\n"
         
         # Получаем статистику по посещениям за последние 7 дней
-        from datetime import datetime, timedelta
-        seven_days_ago = datetime.now() - timedelta(days=7)
-        seven_days_ago_str = seven_days_ago.strftime('%Y-%m-%d')
+        # От местной полуночи 7 дней назад
+        seven_days_ago = local_day_start(LOCAL_UTC_OFFSET) - 7 * SECONDS_PER_DAY
         
-        async with aiosqlite.connect(db.db_path) as db_conn:
-            db_conn.row_factory = aiosqlite.Row
+        async with db.pool.read() as db_conn:
             async with db_conn.execute("""
                 SELECT COUNT(*) as count FROM visits 
-                WHERE center_id = ? AND date(visited_at) >= date(?)
-            """, (center["center_id"], seven_days_ago_str)) as cursor:
+                WHERE center_id = ? AND visited_ts >= ?
+            """, (center["center_id"], seven_days_ago)) as cursor:
                 recent_visits = await cursor.fetchone()
                 recent_count = recent_visits["count"] if recent_visits else 0
         
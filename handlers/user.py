@@ -1,22 +1,30 @@
 import logging
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, BufferedInputFile, InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from database import Database
+from database import db
 from utils.keyboards import (
     get_main_menu, get_search_params_keyboard, get_cities_keyboard,
-    get_categories_keyboard, get_course_keyboard, get_course_detail_keyboard,
+    get_categories_keyboard, get_course_detail_keyboard,
     get_tariff_keyboard, get_payment_keyboard, get_subscription_keyboard
 )
-from utils.qr_generator import generate_subscription_qr
+from utils.pagination import KeysetPage, create_keyset_keyboard, decode_keyset_callback
+from utils.qr_cache import qr_cache
+from utils.qr_generator import create_subscription_qr, subscription_qr_text
+from services.payment import FINAL_STATUSES
+from services.payment_activation import payment_activator
 from config import ROLE_USER
 
 logger = logging.getLogger(__name__)
 
 router = Router()
-db = Database()
+
+# Сколько курсов показывать на одной странице поиска
+COURSES_PAGE_SIZE = 5
+# Префикс callback_data кнопок «Вперёд/Назад» каталога
+CATALOG_CALLBACK = "crs"
 
 
 class SearchStates(StatesGroup):
@@ -25,6 +33,55 @@ class SearchStates(StatesGroup):
     waiting_for_age = State()
 
 
+async def _render_catalog_page(filters: dict, order_by: str, header: str,
+                               cursor: tuple = None, backward: bool = False):
+    """Текст и клавиатура одной страницы результатов поиска курсов"""
+    rows = await db.get_courses(
+        **filters, order_by=order_by, limit=COURSES_PAGE_SIZE + 1, after=cursor, backward=backward
+    )
+    page = KeysetPage(rows, COURSES_PAGE_SIZE, db.COURSE_ORDERS[order_by], cursor, backward)
+    
+    text = f"{header}\n\n"
+    item_buttons = []
+    for course in page.items:
+        center_name = course.get("center_name", "Не указано")
+        rating = course.get("rating", 0)
+        address = course.get("address", "")
+        city_name = course.get("city", "")
+        
+        text += f"📘 Курс: {course['name']}\n"
+        text += f"🏫 {center_name}\n"
+        text += f"⭐️ Рейтинг: {rating}\n"
+        text += f"📍 {city_name}, {address}\n\n"
+        item_buttons.append([
+            InlineKeyboardButton(text=f"📘 {course['name']}", callback_data=f"course_detail_{course['course_id']}")
+        ])
+    
+    if not page.items:
+        text += "На этой странице курсов нет."
+    
+    keyboard = create_keyset_keyboard(
+        page,
+        CATALOG_CALLBACK,
+        item_buttons=item_buttons,
+        additional_buttons=[[InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_search")]]
+    )
+    return text, keyboard
+
+
+async def _start_catalog(state: FSMContext, filters: dict, order_by: str, header: str,
+                         clear_state: bool = True):
+    """
+    Запомнить параметры поиска для кнопок «Вперёд/Назад» и отрисовать первую страницу.
+    В callback_data помещается только ключ страницы, фильтры хранятся в FSM.
+    clear_state=False — сохранить текущее состояние (покупка абонемента ребёнку)
+    """
+    if clear_state:
+        await state.clear()
+    await state.update_data(catalog={"filters": filters, "order_by": order_by, "header": header})
+    return await _render_catalog_page(filters, order_by, header)
+
+
 @router.message(F.text == "📚 Каталог курсов")
 async def catalog_menu(message: Message):
     """Показывает меню поиска курсов"""
@@ -85,17 +142,11 @@ async def price_range_selected(callback: CallbackQuery, state: FSMContext):
         city = data.get("city")
         category = data.get("category")
         
-        # Получаем курсы
-        courses = await db.get_courses(city=city, category=category)
+        # Курсы в диапазоне цены, от дешёвых к дорогим
+        filters = dict(city=city, category=category, price_min=price_min, price_max=price_max)
+        total = await db.count_courses(**filters)
         
-        # Фильтруем по цене
-        filtered_courses = []
-        for course in courses:
-            price_8 = course.get("price_8", 0)
-            if price_min <= price_8 <= price_max:
-                filtered_courses.append(course)
-        
-        if not filtered_courses:
+        if not total:
             await callback.message.edit_text(
                 "😔 Курсов в этом диапазоне цен не найдено.",
                 reply_markup=get_search_params_keyboard()
@@ -103,28 +154,9 @@ async def price_range_selected(callback: CallbackQuery, state: FSMContext):
             await callback.answer()
             return
         
-        # Показываем курсы
-        text = f"Найдено курсов: {len(filtered_courses)}\n\n"
-        for course in filtered_courses[:5]:
-            center_name = course.get("center_name", "Не указано")
-            price_8 = course.get("price_8", 0)
-            rating = course.get("rating", 0)
-            address = course.get("address", "")
-            city_name = course.get("city", "")
-            
-            text += f"📘 Курс: {course['name']}\n"
-            text += f"🏫 {center_name}\n"
-            text += f"⭐️ Рейтинг: {rating}\n"
-            text += f"📍 {city_name}, {address}\n\n"
-            
-            await callback.message.answer(
-                text,
-                reply_markup=get_course_keyboard(course["course_id"])
-            )
-            text = ""
-        
+        text, keyboard = await _start_catalog(state, filters, "price", f"Найдено курсов: {total}")
+        await callback.message.edit_text(text, reply_markup=keyboard)
         await callback.answer()
-        await state.clear()
     except (ValueError, IndexError):
         await callback.answer("Ошибка: неверный формат", show_alert=True)
 
@@ -153,10 +185,11 @@ async def age_received(message: Message, state: FSMContext):
         city = data.get("city")
         category = data.get("category")
         
-        # Получаем курсы с фильтрацией по возрасту
-        courses = await db.get_courses(city=city, category=category, age=age)
+        # Курсы, подходящие по возрасту
+        filters = dict(city=city, category=category, age=age)
+        total = await db.count_courses(**filters)
         
-        if not courses:
+        if not total:
             await message.answer(
                 "😔 Курсов для этого возраста не найдено. Попробуйте другие параметры.",
                 reply_markup=get_search_params_keyboard()
@@ -164,27 +197,10 @@ async def age_received(message: Message, state: FSMContext):
             await state.clear()
             return
         
-        # Показываем курсы
-        text = f"Найдено курсов для возраста {age} лет: {len(courses)}\n\n"
-        for course in courses[:5]:
-            center_name = course.get("center_name", "Не указано")
-            price_8 = course.get("price_8", 0)
-            rating = course.get("rating", 0)
-            address = course.get("address", "")
-            city_name = course.get("city", "")
-            
-            text += f"📘 Курс: {course['name']}\n"
-            text += f"🏫 {center_name}\n"
-            text += f"⭐️ Рейтинг: {rating}\n"
-            text += f"📍 {city_name}, {address}\n\n"
-            
-            await message.answer(
-                text,
-                reply_markup=get_course_keyboard(course["course_id"])
-            )
-            text = ""
-        
-        await state.clear()
+        text, keyboard = await _start_catalog(
+            state, filters, "rating", f"Найдено курсов для возраста {age} лет: {total}"
+        )
+        await message.answer(text, reply_markup=keyboard)
     except ValueError:
         await message.answer("❌ Возраст должен быть числом.\n\nПопробуйте еще раз:")
 
@@ -217,13 +233,11 @@ async def min_rating_selected(callback: CallbackQuery, state: FSMContext):
         city = data.get("city")
         category = data.get("category")
         
-        # Получаем курсы
-        courses = await db.get_courses(city=city, category=category)
+        # Курсы с рейтингом не ниже выбранного
+        filters = dict(city=city, category=category, min_rating=min_rating)
+        total = await db.count_courses(**filters)
         
-        # Фильтруем по рейтингу
-        filtered_courses = [c for c in courses if c.get("rating", 0) >= min_rating]
-        
-        if not filtered_courses:
+        if not total:
             await callback.message.edit_text(
                 f"😔 Курсов с рейтингом {min_rating}+ не найдено.",
                 reply_markup=get_search_params_keyboard()
@@ -231,28 +245,11 @@ async def min_rating_selected(callback: CallbackQuery, state: FSMContext):
             await callback.answer()
             return
         
-        # Показываем курсы
-        text = f"Найдено курсов с рейтингом {min_rating}+: {len(filtered_courses)}\n\n"
-        for course in filtered_courses[:5]:
-            center_name = course.get("center_name", "Не указано")
-            price_8 = course.get("price_8", 0)
-            rating = course.get("rating", 0)
-            address = course.get("address", "")
-            city_name = course.get("city", "")
-            
-            text += f"📘 Курс: {course['name']}\n"
-            text += f"🏫 {center_name}\n"
-            text += f"⭐️ Рейтинг: {rating}\n"
-            text += f"📍 {city_name}, {address}\n\n"
-            
-            await callback.message.answer(
-                text,
-                reply_markup=get_course_keyboard(course["course_id"])
-            )
-            text = ""
-        
+        text, keyboard = await _start_catalog(
+            state, filters, "rating", f"Найдено курсов с рейтингом {min_rating}+: {total}"
+        )
+        await callback.message.edit_text(text, reply_markup=keyboard)
         await callback.answer()
-        await state.clear()
     except ValueError:
         await callback.answer("Ошибка: неверный формат", show_alert=True)
 
@@ -277,10 +274,10 @@ async def category_selected(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     city = data.get("city")
     
-    # Получаем курсы
-    courses = await db.get_courses(city=city, category=category)
+    filters = dict(city=city, category=category)
+    total = await db.count_courses(**filters)
     
-    if not courses:
+    if not total:
         await callback.message.edit_text(
             "😔 Курсов не найдено. Попробуй другие параметры.",
             reply_markup=get_search_params_keyboard()
@@ -288,28 +285,31 @@ async def category_selected(callback: CallbackQuery, state: FSMContext):
         await callback.answer()
         return
     
-    # Показываем первые 5 курсов
-    text = f"Найдено курсов: {len(courses)}\n\n"
-    for course in courses[:5]:
-        center_name = course.get("center_name", "Не указано")
-        price_8 = course.get("price_8", 0)
-        rating = course.get("rating", 0)
-        address = course.get("address", "")
-        city_name = course.get("city", "")
-        
-        text += f"📘 Курс: {course['name']}\n"
-        text += f"🏫 {center_name}\n"
-        text += f"⭐️ Рейтинг: {rating}\n"
-        text += f"📍 {city_name}, {address}\n\n"
-        
-        await callback.message.answer(
-            text,
-            reply_markup=get_course_keyboard(course["course_id"])
-        )
-        text = ""
+    text, keyboard = await _start_catalog(state, filters, "rating", f"Найдено курсов: {total}")
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith(f"{CATALOG_CALLBACK}:"))
+async def catalog_page(callback: CallbackQuery, state: FSMContext):
+    """Переход на соседнюю страницу результатов поиска"""
+    data = await state.get_data()
+    catalog = data.get("catalog")
+    if not catalog:
+        await callback.answer("Результаты поиска устарели. Начните поиск заново.", show_alert=True)
+        return
+    
+    try:
+        backward, cursor = decode_keyset_callback(callback.data, CATALOG_CALLBACK)
+    except ValueError:
+        await callback.answer("Ошибка: неверный формат", show_alert=True)
+        return
     
+    text, keyboard = await _render_catalog_page(
+        catalog["filters"], catalog["order_by"], catalog["header"], cursor, backward
+    )
+    await callback.message.edit_text(text, reply_markup=keyboard)
     await callback.answer()
-    await state.clear()
 
 
 @router.callback_query(F.data == "back_to_search")
@@ -441,9 +441,7 @@ async def subscription_history(callback: CallbackQuery):
         user_id = callback.from_user.id
         
         # Получаем историю посещений
-        import aiosqlite
-        async with aiosqlite.connect(db.db_path) as db_conn:
-            db_conn.row_factory = aiosqlite.Row
+        async with db.pool.read() as db_conn:
             async with db_conn.execute("""
                 SELECT v.*, c.name as center_name
                 FROM visits v
@@ -563,23 +561,16 @@ async def buy_template(callback: CallbackQuery, state: FSMContext):
         
         # Инициализируем платежный сервис
         try:
-            from services.payment import AirbaPayClient, PaymentService
+            from services.payment import PaymentService, airba_client
             from config import (
-                AIRBA_PAY_BASE_URL, AIRBA_PAY_USER, AIRBA_PAY_PASSWORD,
-                AIRBA_PAY_TERMINAL_ID, AIRBA_PAY_COMPANY_ID, AIRBA_PAY_WEBHOOK_URL
+                AIRBA_PAY_USER, AIRBA_PAY_PASSWORD, AIRBA_PAY_TERMINAL_ID, AIRBA_PAY_WEBHOOK_URL
             )
             
             # Проверяем наличие настроек
             if not AIRBA_PAY_USER or not AIRBA_PAY_PASSWORD or not AIRBA_PAY_TERMINAL_ID:
                 # Если платежная система не настроена, создаём абонемент без оплаты
-                qr_id, qr_image = generate_subscription_qr(user_id, subscription_id)
-                import aiosqlite
-                async with aiosqlite.connect(db.db_path) as db_conn:
-                    await db_conn.execute(
-                        "UPDATE subscriptions SET qr_code = ? WHERE subscription_id = ?",
-                        (qr_id, subscription_id)
-                    )
-                    await db_conn.commit()
+                qr_id, qr_text = create_subscription_qr(user_id, subscription_id)
+                await db.update_subscription_qr(subscription_id, qr_id)
                 
                 await callback.message.answer(
                     "🎉 Абонемент активирован!\n\n"
@@ -587,9 +578,9 @@ async def buy_template(callback: CallbackQuery, state: FSMContext):
                 )
                 
                 try:
-                    qr_bytes = qr_image.getvalue()
-                    await callback.message.answer_photo(
-                        photo=BufferedInputFile(qr_bytes, filename="qr_code.png"),
+                    await qr_cache.answer_photo(
+                        callback.message,
+                        qr_text,
                         caption="Твой QR-код для посещений"
                     )
                 except Exception:
@@ -602,15 +593,7 @@ async def buy_template(callback: CallbackQuery, state: FSMContext):
                 return
             
             # Создаём платеж
-            client = AirbaPayClient(
-                base_url=AIRBA_PAY_BASE_URL,
-                user=AIRBA_PAY_USER,
-                password=AIRBA_PAY_PASSWORD,
-                terminal_id=AIRBA_PAY_TERMINAL_ID,
-                company_id=AIRBA_PAY_COMPANY_ID
-            )
-            
-            payment_service = PaymentService(client, db, AIRBA_PAY_WEBHOOK_URL)
+            payment_service = PaymentService(airba_client, db, AIRBA_PAY_WEBHOOK_URL)
             
             # Получаем данные пользователя
             user = await db.get_user(user_id)
@@ -665,14 +648,8 @@ async def buy_template(callback: CallbackQuery, state: FSMContext):
             
         except ImportError:
             # Если платежный сервис не настроен, создаём абонемент без оплаты
-            qr_id, qr_image = generate_subscription_qr(user_id, subscription_id)
-            import aiosqlite
-            async with aiosqlite.connect(db.db_path) as db_conn:
-                await db_conn.execute(
-                    "UPDATE subscriptions SET qr_code = ? WHERE subscription_id = ?",
-                    (qr_id, subscription_id)
-                )
-                await db_conn.commit()
+            qr_id, qr_text = create_subscription_qr(user_id, subscription_id)
+            await db.update_subscription_qr(subscription_id, qr_id)
             
             await callback.message.answer(
                 "🎉 Абонемент активирован!\n\n"
@@ -680,9 +657,9 @@ async def buy_template(callback: CallbackQuery, state: FSMContext):
             )
             
             try:
-                qr_bytes = qr_image.getvalue()
-                await callback.message.answer_photo(
-                    photo=BufferedInputFile(qr_bytes, filename="qr_code.png"),
+                await qr_cache.answer_photo(
+                    callback.message,
+                    qr_text,
                     caption="Твой QR-код для посещений"
                 )
             except Exception:
@@ -802,23 +779,16 @@ async def tariff_selected(callback: CallbackQuery, state: FSMContext):
     
     # Инициализируем платежный сервис
     try:
-        from services.payment import AirbaPayClient, PaymentService
+        from services.payment import PaymentService, airba_client
         from config import (
-            AIRBA_PAY_BASE_URL, AIRBA_PAY_USER, AIRBA_PAY_PASSWORD,
-            AIRBA_PAY_TERMINAL_ID, AIRBA_PAY_COMPANY_ID, AIRBA_PAY_WEBHOOK_URL
+            AIRBA_PAY_USER, AIRBA_PAY_PASSWORD, AIRBA_PAY_TERMINAL_ID, AIRBA_PAY_WEBHOOK_URL
         )
         
         # Проверяем наличие настроек
         if not AIRBA_PAY_USER or not AIRBA_PAY_PASSWORD or not AIRBA_PAY_TERMINAL_ID:
             # Если платежная система не настроена, создаём абонемент без оплаты
-            qr_id, qr_image = generate_subscription_qr(user_id, subscription_id)
-            import aiosqlite
-            async with aiosqlite.connect(db.db_path) as db_conn:
-                await db_conn.execute(
-                    "UPDATE subscriptions SET qr_code = ? WHERE subscription_id = ?",
-                    (qr_id, subscription_id)
-                )
-                await db_conn.commit()
+            qr_id, qr_text = create_subscription_qr(user_id, subscription_id)
+            await db.update_subscription_qr(subscription_id, qr_id)
             
             await callback.message.answer(
                 "🎉 Абонемент активирован!\n\n"
@@ -826,9 +796,9 @@ async def tariff_selected(callback: CallbackQuery, state: FSMContext):
             )
             
             try:
-                qr_bytes = qr_image.getvalue()
-                await callback.message.answer_photo(
-                    photo=BufferedInputFile(qr_bytes, filename="qr_code.png"),
+                await qr_cache.answer_photo(
+                    callback.message,
+                    qr_text,
                     caption="Твой QR-код для посещений"
                 )
             except Exception:
@@ -841,15 +811,7 @@ async def tariff_selected(callback: CallbackQuery, state: FSMContext):
             return
         
         # Создаём платеж
-        client = AirbaPayClient(
-            base_url=AIRBA_PAY_BASE_URL,
-            user=AIRBA_PAY_USER,
-            password=AIRBA_PAY_PASSWORD,
-            terminal_id=AIRBA_PAY_TERMINAL_ID,
-            company_id=AIRBA_PAY_COMPANY_ID
-        )
-        
-        payment_service = PaymentService(client, db, AIRBA_PAY_WEBHOOK_URL)
+        payment_service = PaymentService(airba_client, db, AIRBA_PAY_WEBHOOK_URL)
         
         # Получаем данные пользователя
         user = await db.get_user(user_id)
@@ -905,14 +867,8 @@ async def tariff_selected(callback: CallbackQuery, state: FSMContext):
         
     except ImportError:
         # Если платежный сервис не настроен, создаём абонемент без оплаты
-        qr_id, qr_image = generate_subscription_qr(user_id, subscription_id)
-        import aiosqlite
-        async with aiosqlite.connect(db.db_path) as db_conn:
-            await db_conn.execute(
-                "UPDATE subscriptions SET qr_code = ? WHERE subscription_id = ?",
-                (qr_id, subscription_id)
-            )
-            await db_conn.commit()
+        qr_id, qr_text = create_subscription_qr(user_id, subscription_id)
+        await db.update_subscription_qr(subscription_id, qr_id)
         
         await callback.message.answer(
             "🎉 Абонемент активирован!\n\n"
@@ -920,9 +876,9 @@ async def tariff_selected(callback: CallbackQuery, state: FSMContext):
         )
         
         try:
-            qr_bytes = qr_image.getvalue()
-            await callback.message.answer_photo(
-                photo=BufferedInputFile(qr_bytes, filename="qr_code.png"),
+            await qr_cache.answer_photo(
+                callback.message,
+                qr_text,
                 caption="Твой QR-код для посещений"
             )
         except Exception:
@@ -993,13 +949,14 @@ async def show_qr(callback: CallbackQuery):
         await callback.answer("Абонемент не найден", show_alert=True)
         return
     
-    # Генерируем QR из сохранённого кода
-    from utils.qr_generator import generate_qr_code
-    qr_image = generate_qr_code(subscription["qr_code"])
+    # Тот же текст, что и в QR-коде при активации: изображение и file_id берутся из кэша
+    qr_text = subscription_qr_text(
+        subscription["qr_code"], subscription["user_id"], subscription_id, subscription.get("child_id")
+    )
     
-    qr_bytes = qr_image.getvalue()
-    await callback.message.answer_photo(
-        photo=BufferedInputFile(qr_bytes, filename="qr_code.png"),
+    await qr_cache.answer_photo(
+        callback.message,
+        qr_text,
         caption="Твой QR-код для посещений"
     )
     await callback.answer()
@@ -1021,7 +978,6 @@ async def schedule(message: Message):
             return
         
         # Получаем все занятия из всех центров (универсальные абонементы)
-        import aiosqlite
         from datetime import datetime, timedelta
         
         text = "🕒 Твоё расписание:\n\n"
@@ -1030,8 +986,7 @@ async def schedule(message: Message):
         today = datetime.now().date()
         week_later = today + timedelta(days=7)
         
-        async with aiosqlite.connect(db.db_path) as db_conn:
-            db_conn.row_factory = aiosqlite.Row
+        async with db.pool.read() as db_conn:
             async with db_conn.execute("""
                 SELECT l.*, c.name as center_name, t.name as teacher_name
                 FROM lessons l
@@ -1136,9 +1091,7 @@ async def cancel_payment(callback: CallbackQuery, state: FSMContext):
         subscription = await db.get_user_subscriptions(user_id)
         if not any(s.get("subscription_id") == subscription_id for s in subscription):
             # Проверяем через прямой запрос
-            import aiosqlite
-            async with aiosqlite.connect(db.db_path) as db_conn:
-                db_conn.row_factory = aiosqlite.Row
+            async with db.pool.read() as db_conn:
                 async with db_conn.execute(
                     "SELECT * FROM subscriptions WHERE subscription_id = ? AND user_id = ?",
                     (subscription_id, user_id)
@@ -1148,22 +1101,33 @@ async def cancel_payment(callback: CallbackQuery, state: FSMContext):
                         await callback.answer("Абонемент не найден или доступ запрещен", show_alert=True)
                         return
         
-        # Удаляем связанные платежи
-        payments = await db.get_user_payments(user_id)
-        for payment in payments:
-            if payment.get("subscription_id") == subscription_id:
-                # Помечаем платеж как отмененный
-                await db.update_payment_status(
-                    payment.get("payment_id"),
-                    "cancelled",
-                    error_message="Отменен пользователем"
-                )
+        # Отменяем связанные платежи; временный абонемент удаляется вместе с
+        # отменой. Оплаченный платёж (callback или PaymentChecker могли
+        # активировать абонемент в фоне) не отменяется
+        payments = [
+            payment for payment in await db.get_user_payments(user_id)
+            if payment.get("subscription_id") == subscription_id
+        ]
+        cancelled = False
+        if not any(payment.get("status") in ("success", "refunded") for payment in payments):
+            for payment in payments:
+                if await payment_activator.cancel(payment, "Отменен пользователем"):
+                    cancelled = True
+        
+        if payments and not cancelled:
+            for payment in payments:
+                current = await db.get_payment(payment["payment_id"])
+                if current and current.get("status") in ("success", "refunded"):
+                    await callback.message.answer("✅ Этот абонемент уже оплачен, отмена невозможна.")
+                    await callback.answer()
+                    await state.clear()
+                    return
+            await callback.answer("Платеж уже отменен")
+            return
         
-        # Удаляем временный абонемент
-        import aiosqlite
-        async with aiosqlite.connect(db.db_path) as db_conn:
-            await db_conn.execute("DELETE FROM subscriptions WHERE subscription_id = ?", (subscription_id,))
-            await db_conn.commit()
+        if not payments:
+            # Платёж не был создан — удаляем временный абонемент
+            await db.delete_subscription(subscription_id)
         
         await callback.message.answer("❌ Платеж отменен. Абонемент не создан.")
         await callback.answer("Платеж отменен")
@@ -1182,22 +1146,8 @@ async def check_payment_status(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     
     try:
-        from services.payment import AirbaPayClient, PaymentService
-        from config import (
-            AIRBA_PAY_BASE_URL, AIRBA_PAY_USER, AIRBA_PAY_PASSWORD,
-            AIRBA_PAY_TERMINAL_ID, AIRBA_PAY_COMPANY_ID, AIRBA_PAY_WEBHOOK_URL
-        )
-        
-        client = AirbaPayClient(
-            base_url=AIRBA_PAY_BASE_URL,
-            user=AIRBA_PAY_USER,
-            password=AIRBA_PAY_PASSWORD,
-            terminal_id=AIRBA_PAY_TERMINAL_ID,
-            company_id=AIRBA_PAY_COMPANY_ID
-        )
-        
-        payment_service = PaymentService(client, db, AIRBA_PAY_WEBHOOK_URL)
-        result = await payment_service.get_payment_status(payment_id, user_id)
+        # Повторные нажатия не активируют абонемент заново и не перевыпускают QR-код
+        result = await payment_activator.check(payment_id, user_id)
         
         if result.get("success"):
             status = result.get("status", "pending")
@@ -1205,20 +1155,8 @@ async def check_payment_status(callback: CallbackQuery, state: FSMContext):
             subscription_id = payment.get("subscription_id")
             
             if status == "success":
-                # Платеж успешен, активируем абонемент
-                if subscription_id:
-                    # Генерируем QR-код
-                    qr_id, qr_image = generate_subscription_qr(user_id, subscription_id)
-                    
-                    # Обновляем QR-код в базе данных
-                    import aiosqlite
-                    async with aiosqlite.connect(db.db_path) as db_conn:
-                        await db_conn.execute(
-                            "UPDATE subscriptions SET qr_code = ? WHERE subscription_id = ?",
-                            (qr_id, subscription_id)
-                        )
-                        await db_conn.commit()
-                    
+                qr_text = result.get("qr_text")
+                if subscription_id and qr_text:
                     await callback.message.answer(
                         "✅ Платеж успешно выполнен!\n\n"
                         "🎉 Абонемент активирован!\n\n"
@@ -1226,21 +1164,21 @@ async def check_payment_status(callback: CallbackQuery, state: FSMContext):
                     )
                     
                     try:
-                        qr_bytes = qr_image.getvalue()
-                        await callback.message.answer_photo(
-                            photo=BufferedInputFile(qr_bytes, filename="qr_code.png"),
+                        await qr_cache.answer_photo(
+                            callback.message,
+                            qr_text,
                             caption="Твой QR-код для посещений"
                         )
                     except Exception:
                         await callback.message.answer(
-                            f"QR-код создан!\nКод: {qr_id}\n\n"
+                            f"QR-код создан!\nКод: {qr_text}\n\n"
                             f"Установите Pillow для отображения QR-кода как изображения."
                         )
                 else:
                     await callback.message.answer("✅ Платеж успешно выполнен!")
                 
                 await state.clear()
-            elif status == "failed":
+            elif status in FINAL_STATUSES:
                 await callback.message.answer(
                     "❌ Платеж не прошел.\n\n"
                     "Попробуйте оплатить снова или обратитесь в поддержку."
@@ -1283,6 +1221,7 @@ async def my_payments(message: Message):
                 "success": "✅",
                 "pending": "⏳",
                 "failed": "❌",
+                "expired": "⌛",
                 "refunded": "↩️"
             }.get(payment.get("status", "pending"), "❓")
             
@@ -1388,23 +1327,16 @@ async def buy_tariff(callback: CallbackQuery, state: FSMContext):
         
         # Инициализируем платежный сервис
         try:
-            from services.payment import AirbaPayClient, PaymentService
+            from services.payment import PaymentService, airba_client
             from config import (
-                AIRBA_PAY_BASE_URL, AIRBA_PAY_USER, AIRBA_PAY_PASSWORD,
-                AIRBA_PAY_TERMINAL_ID, AIRBA_PAY_COMPANY_ID, AIRBA_PAY_WEBHOOK_URL
+                AIRBA_PAY_USER, AIRBA_PAY_PASSWORD, AIRBA_PAY_TERMINAL_ID, AIRBA_PAY_WEBHOOK_URL
             )
             
             # Проверяем наличие настроек
             if not AIRBA_PAY_USER or not AIRBA_PAY_PASSWORD or not AIRBA_PAY_TERMINAL_ID:
                 # Если платежная система не настроена, создаём абонемент без оплаты
-                qr_id, qr_image = generate_subscription_qr(user_id, subscription_id)
-                import aiosqlite
-                async with aiosqlite.connect(db.db_path) as db_conn:
-                    await db_conn.execute(
-                        "UPDATE subscriptions SET qr_code = ? WHERE subscription_id = ?",
-                        (qr_id, subscription_id)
-                    )
-                    await db_conn.commit()
+                qr_id, qr_text = create_subscription_qr(user_id, subscription_id)
+                await db.update_subscription_qr(subscription_id, qr_id)
                 
                 await callback.message.answer(
                     "🎉 Абонемент активирован!\n\n"
@@ -1412,9 +1344,9 @@ async def buy_tariff(callback: CallbackQuery, state: FSMContext):
                 )
                 
                 try:
-                    qr_bytes = qr_image.getvalue()
-                    await callback.message.answer_photo(
-                        photo=BufferedInputFile(qr_bytes, filename="qr_code.png"),
+                    await qr_cache.answer_photo(
+                        callback.message,
+                        qr_text,
                         caption="Твой QR-код для посещений"
                     )
                 except Exception:
@@ -1427,15 +1359,7 @@ async def buy_tariff(callback: CallbackQuery, state: FSMContext):
                 return
             
             # Создаём платеж
-            client = AirbaPayClient(
-                base_url=AIRBA_PAY_BASE_URL,
-                user=AIRBA_PAY_USER,
-                password=AIRBA_PAY_PASSWORD,
-                terminal_id=AIRBA_PAY_TERMINAL_ID,
-                company_id=AIRBA_PAY_COMPANY_ID
-            )
-            
-            payment_service = PaymentService(client, db, AIRBA_PAY_WEBHOOK_URL)
+            payment_service = PaymentService(airba_client, db, AIRBA_PAY_WEBHOOK_URL)
             
             # Получаем данные пользователя
             user = await db.get_user(user_id)
@@ -1490,14 +1414,8 @@ async def buy_tariff(callback: CallbackQuery, state: FSMContext):
             
         except ImportError:
             # Если платежный сервис не настроен, создаём абонемент без оплаты
-            qr_id, qr_image = generate_subscription_qr(user_id, subscription_id)
-            import aiosqlite
-            async with aiosqlite.connect(db.db_path) as db_conn:
-                await db_conn.execute(
-                    "UPDATE subscriptions SET qr_code = ? WHERE subscription_id = ?",
-                    (qr_id, subscription_id)
-                )
-                await db_conn.commit()
+            qr_id, qr_text = create_subscription_qr(user_id, subscription_id)
+            await db.update_subscription_qr(subscription_id, qr_id)
             
             await callback.message.answer(
                 "🎉 Абонемент активирован!\n\n"
@@ -1505,9 +1423,9 @@ async def buy_tariff(callback: CallbackQuery, state: FSMContext):
             )
             
             try:
-                qr_bytes = qr_image.getvalue()
-                await callback.message.answer_photo(
-                    photo=BufferedInputFile(qr_bytes, filename="qr_code.png"),
+                await qr_cache.answer_photo(
+                    callback.message,
+                    qr_text,
                     caption="Твой QR-код для посещений"
                 )
             except Exception:
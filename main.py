@@ -9,7 +9,7 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
 from config import BOT_TOKEN
-from database import Database
+from database import db
 from middleware.error_handler import ErrorHandlerMiddleware
 from middleware.logging import LoggingMiddleware
 from handlers import common, user, parent, child, partner, admin
@@ -71,7 +71,6 @@ except Exception as e:
     sys.exit(1)
 
 dp = Dispatcher()
-db = Database()
 
 # Подключаем middleware
 dp.message.middleware(LoggingMiddleware())
@@ -163,6 +162,11 @@ async def unknown_message_handler(message: Message, state: FSMContext):
     if text and text.startswith("SUBSCRIPTION:"):
         return
     
+    # Подписанный токен абонемента (SUB:...) тоже обрабатывает партнёр
+    from utils.qr_token import is_qr_token
+    if is_qr_token(text):
+        return
+    
     # Если это может быть UUID (проверяем только для партнеров)
     if user and user.get("role") == "partner":
         import re
@@ -295,35 +299,40 @@ async def unhandled_update_handler(update: Update, bot: Bot):
 async def main():
     """Запуск бота"""
     payment_checker = None
+    payment_webhook = None
+    wal_checkpointer = None
     
     try:
         # Инициализация базы данных
         await db.init_db()
         logger.info("База данных инициализирована")
         
+        # Периодический checkpoint WAL-журнала
+        from config import DB_PRAGMAS, DB_WAL_CHECKPOINT_INTERVAL, DB_WAL_CHECKPOINT_MODE
+        if str(DB_PRAGMAS.get("journal_mode", "")).upper() == "WAL":
+            from utils.wal_checkpointer import WalCheckpointer
+            wal_checkpointer = WalCheckpointer(db, DB_WAL_CHECKPOINT_INTERVAL, DB_WAL_CHECKPOINT_MODE)
+            await wal_checkpointer.start()
+        
         # Запуск автоматической проверки платежей (если настроена оплата)
         try:
             from config import AIRBA_PAY_USER, AIRBA_PAY_PASSWORD, AIRBA_PAY_TERMINAL_ID
-            from services.payment import AirbaPayClient, PaymentService
             
             if AIRBA_PAY_USER and AIRBA_PAY_PASSWORD and AIRBA_PAY_TERMINAL_ID:
                 from utils.payment_checker import PaymentChecker
-                from config import (
-                    AIRBA_PAY_BASE_URL, AIRBA_PAY_COMPANY_ID, AIRBA_PAY_WEBHOOK_URL
-                )
+                from services.payment_activation import payment_activator
+                from config import AIRBA_PAY_WEBHOOK_URL
                 
-                client = AirbaPayClient(
-                    base_url=AIRBA_PAY_BASE_URL,
-                    user=AIRBA_PAY_USER,
-                    password=AIRBA_PAY_PASSWORD,
-                    terminal_id=AIRBA_PAY_TERMINAL_ID,
-                    company_id=AIRBA_PAY_COMPANY_ID
-                )
-                
-                payment_service = PaymentService(client, db, AIRBA_PAY_WEBHOOK_URL)
-                payment_checker = PaymentChecker(db, payment_service, check_interval=120)
+                payment_checker = PaymentChecker(db, payment_activator, bot=bot)
                 await payment_checker.start()
                 logger.info("Автоматическая проверка платежей включена")
+                
+                # Callback-и AirbaPay активируют абонемент сразу после оплаты
+                from config import AIRBA_PAY_WEBHOOK_PORT
+                if AIRBA_PAY_WEBHOOK_URL and AIRBA_PAY_WEBHOOK_PORT:
+                    from services.payment_webhook import create_webhook_server
+                    payment_webhook = create_webhook_server(bot, payment_activator)
+                    await payment_webhook.start()
         except Exception as e:
             logger.warning(f"Не удалось запустить проверку платежей: {e}")
         
@@ -349,6 +358,34 @@ async def main():
             except Exception as e:
                 logger.error(f"Ошибка при остановке проверки платежей: {e}")
         
+        # Останавливаем приём callback-ов AirbaPay
+        if payment_webhook:
+            try:
+                await payment_webhook.stop()
+            except Exception as e:
+                logger.error(f"Ошибка при остановке приёма callback-ов: {e}")
+        
+        # Останавливаем checkpoint WAL-журнала
+        if wal_checkpointer:
+            try:
+                await wal_checkpointer.stop()
+            except Exception as e:
+                logger.error(f"Ошибка при остановке WAL checkpoint: {e}")
+        
+        # Закрываем пул HTTP-соединений
+        try:
+            from utils.http_pool import http_pool
+            await http_pool.close()
+        except Exception as e:
+            logger.error(f"Ошибка при закрытии HTTP-пула: {e}")
+        
+        # Останавливаем пул рендеринга QR-кодов
+        try:
+            from utils.render_pool import render_pool
+            render_pool.shutdown(wait=False)
+        except Exception as e:
+            logger.error(f"Ошибка при остановке пула рендеринга: {e}")
+        
         # Очищаем кэш
         try:
             from utils.cache import cache
@@ -356,6 +393,12 @@ async def main():
         except Exception:
             pass
         
+        # Закрываем пул соединений с базой данных
+        try:
+            await db.close()
+        except Exception as e:
+            logger.error(f"Ошибка при закрытии базы данных: {e}")
+        
         try:
             await bot.session.close()
             logger.info("Сессия бота закрыта")
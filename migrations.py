@@ -0,0 +1,449 @@
+"""
+Версионированные миграции схемы базы данных
+
+Каждая миграция получает номер и применяется ровно один раз, в своей
+транзакции. Номера только растут: изменения схемы добавляются новой
+миграцией в конец списка, существующие миграции не редактируются.
+"""
+import logging
+
+from config import ROLE_USER, STATUS_PENDING
+
+logger = logging.getLogger(__name__)
+
+
+async def _m001_initial_schema(db):
+    """Начальная схема: все таблицы бота"""
+    # Пользователи
+    await db.execute(f"""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            full_name TEXT,
+            role TEXT DEFAULT '{ROLE_USER}',
+            phone TEXT,
+            city TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Дети
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS children (
+            child_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            parent_id INTEGER,
+            name TEXT NOT NULL,
+            age INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (parent_id) REFERENCES users(user_id)
+        )
+    """)
+
+    # Образовательные центры
+    await db.execute(f"""
+        CREATE TABLE IF NOT EXISTS centers (
+            center_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            partner_id INTEGER,
+            name TEXT NOT NULL,
+            city TEXT,
+            address TEXT,
+            phone TEXT,
+            category TEXT,
+            description TEXT,
+            logo TEXT,
+            status TEXT DEFAULT '{STATUS_PENDING}',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (partner_id) REFERENCES users(user_id)
+        )
+    """)
+
+    # Преподаватели
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS teachers (
+            teacher_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            center_id INTEGER,
+            name TEXT NOT NULL,
+            description TEXT,
+            FOREIGN KEY (center_id) REFERENCES centers(center_id)
+        )
+    """)
+
+    # Курсы
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS courses (
+            course_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            center_id INTEGER,
+            name TEXT NOT NULL,
+            description TEXT,
+            category TEXT,
+            age_min INTEGER,
+            age_max INTEGER,
+            requirements TEXT,
+            schedule TEXT,
+            rating REAL DEFAULT 0,
+            price_4 INTEGER,
+            price_8 INTEGER,
+            price_unlimited INTEGER,
+            photo TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (center_id) REFERENCES centers(center_id)
+        )
+    """)
+
+    # Универсальные абонементы (управляются админом)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS subscription_templates (
+            template_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            tariff TEXT NOT NULL,
+            lessons_total INTEGER,
+            price REAL NOT NULL,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_by INTEGER,
+            FOREIGN KEY (created_by) REFERENCES users(user_id)
+        )
+    """)
+    
+    # Абонементы пользователей (универсальные, без привязки к центру/курсу)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            subscription_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            child_id INTEGER,
+            template_id INTEGER,
+            tariff TEXT,
+            lessons_total INTEGER,
+            lessons_remaining INTEGER,
+            qr_code TEXT UNIQUE,
+            status TEXT DEFAULT 'active',
+            purchased_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id),
+            FOREIGN KEY (child_id) REFERENCES children(child_id),
+            FOREIGN KEY (template_id) REFERENCES subscription_templates(template_id)
+        )
+    """)
+
+    # Занятия (загружаются партнерами)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS lessons (
+            lesson_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            center_id INTEGER,
+            course_id INTEGER,
+            name TEXT NOT NULL,
+            description TEXT,
+            date DATE NOT NULL,
+            time TIME NOT NULL,
+            duration INTEGER,
+            teacher_id INTEGER,
+            max_students INTEGER,
+            current_students INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (center_id) REFERENCES centers(center_id),
+            FOREIGN KEY (course_id) REFERENCES courses(course_id),
+            FOREIGN KEY (teacher_id) REFERENCES teachers(teacher_id)
+        )
+    """)
+    
+    # Посещения (универсальные, без привязки к курсу)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS visits (
+            visit_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subscription_id INTEGER,
+            user_id INTEGER,
+            child_id INTEGER,
+            center_id INTEGER,
+            lesson_id INTEGER,
+            visited_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (subscription_id) REFERENCES subscriptions(subscription_id),
+            FOREIGN KEY (user_id) REFERENCES users(user_id),
+            FOREIGN KEY (child_id) REFERENCES children(child_id),
+            FOREIGN KEY (center_id) REFERENCES centers(center_id),
+            FOREIGN KEY (lesson_id) REFERENCES lessons(lesson_id)
+        )
+    """)
+
+    # Платежи
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS payments (
+            payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subscription_id INTEGER,
+            user_id INTEGER,
+            amount REAL,
+            currency TEXT DEFAULT 'KZT',
+            method TEXT,
+            status TEXT DEFAULT 'pending',
+            transaction_id TEXT,
+            invoice_id TEXT,
+            airba_payment_id TEXT,
+            redirect_url TEXT,
+            error_message TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP,
+            FOREIGN KEY (subscription_id) REFERENCES subscriptions(subscription_id),
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+    
+    # Возвраты платежей
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS payment_refunds (
+            refund_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            payment_id INTEGER,
+            airba_refund_id TEXT,
+            ext_id TEXT,
+            amount REAL,
+            reason TEXT,
+            status TEXT,
+            processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (payment_id) REFERENCES payments(payment_id)
+        )
+    """)
+
+    # Отзывы
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS reviews (
+            review_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            course_id INTEGER,
+            user_id INTEGER,
+            rating INTEGER,
+            comment TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (course_id) REFERENCES courses(course_id),
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+
+
+async def _m002_subscriptions_template_id(db):
+    """Колонка template_id в subscriptions для баз, созданных до шаблонов"""
+    async with db.execute("PRAGMA table_info(subscriptions)") as cursor:
+        column_names = [col[1] for col in await cursor.fetchall()]
+
+    if "template_id" not in column_names:
+        logger.info("Добавляем колонку template_id в таблицу subscriptions...")
+        await db.execute("ALTER TABLE subscriptions ADD COLUMN template_id INTEGER")
+
+
+async def _m003_query_indexes(db):
+    """Вторичные индексы под запросы методов Database"""
+    indexes = [
+        # get_user_subscriptions (взрослый / ребёнок), get_center_students
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_user_status ON subscriptions(user_id, status)",
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_child_status ON subscriptions(child_id, status)",
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_status ON subscriptions(status)",
+        # record_visit (защита от дублей), get_visit_stats, история посещений
+        "CREATE INDEX IF NOT EXISTS idx_visits_sub_center_time ON visits(subscription_id, center_id, visited_at)",
+        # get_center_analytics, get_center_students, аналитика партнёра
+        "CREATE INDEX IF NOT EXISTS idx_visits_center_time ON visits(center_id, visited_at)",
+        # PaymentChecker, статистика админа
+        "CREATE INDEX IF NOT EXISTS idx_payments_status_created ON payments(status, created_at)",
+        # get_user_payments
+        "CREATE INDEX IF NOT EXISTS idx_payments_user_created ON payments(user_id, created_at)",
+        # get_partner_center
+        "CREATE INDEX IF NOT EXISTS idx_centers_partner ON centers(partner_id)",
+        # get_centers, get_pending_centers, get_courses
+        "CREATE INDEX IF NOT EXISTS idx_centers_status_city_category ON centers(status, city, category)",
+        # JOIN courses -> centers в каталоге, курсы партнёра
+        "CREATE INDEX IF NOT EXISTS idx_courses_center_category ON courses(center_id, category)",
+        # Расписание
+        "CREATE INDEX IF NOT EXISTS idx_lessons_date_time ON lessons(date, time)",
+        # get_reviews, get_user_review, create_review
+        "CREATE INDEX IF NOT EXISTS idx_reviews_course_created ON reviews(course_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_reviews_course_user ON reviews(course_id, user_id)",
+        # get_children
+        "CREATE INDEX IF NOT EXISTS idx_children_parent ON children(parent_id)",
+        # get_teachers
+        "CREATE INDEX IF NOT EXISTS idx_teachers_center ON teachers(center_id)",
+    ]
+    for statement in indexes:
+        await db.execute(statement)
+    await db.execute("ANALYZE")
+
+
+async def _m004_epoch_timestamps(db):
+    """Целочисленное время UTC и номер суток для visits и payments"""
+    async with db.execute("PRAGMA table_info(visits)") as cursor:
+        visit_columns = [col[1] for col in await cursor.fetchall()]
+    if "visited_ts" not in visit_columns:
+        await db.execute("ALTER TABLE visits ADD COLUMN visited_ts INTEGER")
+    if "visit_day" not in visit_columns:
+        await db.execute("ALTER TABLE visits ADD COLUMN visit_day INTEGER")
+
+    async with db.execute("PRAGMA table_info(payments)") as cursor:
+        payment_columns = [col[1] for col in await cursor.fetchall()]
+    if "created_ts" not in payment_columns:
+        await db.execute("ALTER TABLE payments ADD COLUMN created_ts INTEGER")
+    if "created_day" not in payment_columns:
+        await db.execute("ALTER TABLE payments ADD COLUMN created_day INTEGER")
+
+    # CURRENT_TIMESTAMP хранится в UTC, поэтому strftime('%s') даёт точную эпоху
+    await db.execute("""
+        UPDATE visits
+        SET visited_ts = CAST(strftime('%s', COALESCE(visited_at, CURRENT_TIMESTAMP)) AS INTEGER)
+        WHERE visited_ts IS NULL
+    """)
+    await db.execute("UPDATE visits SET visit_day = visited_ts / 86400 WHERE visit_day IS NULL")
+    await db.execute("""
+        UPDATE payments
+        SET created_ts = CAST(strftime('%s', COALESCE(created_at, CURRENT_TIMESTAMP)) AS INTEGER)
+        WHERE created_ts IS NULL
+    """)
+    await db.execute("UPDATE payments SET created_day = created_ts / 86400 WHERE created_day IS NULL")
+
+    # Индексы по текстовым датам больше не используются запросами
+    for index_name in ("idx_visits_sub_center_time", "idx_visits_center_time", "idx_payments_status_created"):
+        await db.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+    indexes = [
+        # record_visit (защита от дублей)
+        "CREATE INDEX IF NOT EXISTS idx_visits_sub_center_ts ON visits(subscription_id, center_id, visited_ts)",
+        # get_center_analytics, аналитика партнёра
+        "CREATE INDEX IF NOT EXISTS idx_visits_center_ts ON visits(center_id, visited_ts)",
+        # Логи посещений админа
+        "CREATE INDEX IF NOT EXISTS idx_visits_day ON visits(visit_day)",
+        # PaymentChecker
+        "CREATE INDEX IF NOT EXISTS idx_payments_status_created_ts ON payments(status, created_ts)",
+    ]
+    for statement in indexes:
+        await db.execute(statement)
+    await db.execute("ANALYZE")
+
+
+async def _m005_catalog_indexes(db):
+    """Индексы каталога: фильтр по категории с сортировкой по рейтингу и цене"""
+    indexes = [
+        "CREATE INDEX IF NOT EXISTS idx_courses_category_rating ON courses(category, rating DESC, course_id)",
+        "CREATE INDEX IF NOT EXISTS idx_courses_category_price ON courses(category, price_8, course_id)",
+    ]
+    for statement in indexes:
+        await db.execute(statement)
+    await db.execute("ANALYZE")
+
+
+async def _m006_payment_reference_indexes(db):
+    """Индексы поиска платежа по invoice_id и id платежа AirbaPay (callback-и)"""
+    indexes = [
+        "CREATE INDEX IF NOT EXISTS idx_payments_invoice ON payments(invoice_id)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_airba_id ON payments(airba_payment_id)",
+    ]
+    for statement in indexes:
+        await db.execute(statement)
+    await db.execute("ANALYZE")
+
+
+async def _m007_payment_check_schedule(db):
+    """Расписание проверок pending-платежей: время следующей проверки и число попыток"""
+    async with db.execute("PRAGMA table_info(payments)") as cursor:
+        payment_columns = [col[1] for col in await cursor.fetchall()]
+    if "next_check_at" not in payment_columns:
+        await db.execute("ALTER TABLE payments ADD COLUMN next_check_at INTEGER")
+    if "check_attempts" not in payment_columns:
+        await db.execute("ALTER TABLE payments ADD COLUMN check_attempts INTEGER DEFAULT 0")
+
+    # Уже ожидающие платежи проверяются при первом проходе
+    await db.execute("""
+        UPDATE payments SET next_check_at = created_ts, check_attempts = 0
+        WHERE status = 'pending' AND next_check_at IS NULL
+    """)
+    # Выборка PaymentChecker: status = 'pending' AND next_check_at <= ?
+    # (idx_payments_status_created_ts остаётся для истечения старых платежей)
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_payments_status_next_check ON payments(status, next_check_at)"
+    )
+    await db.execute("ANALYZE")
+
+
+async def _m008_payment_reconciliation_indexes(db):
+    """Индексы сверки платежей: окно по времени создания и платежи абонемента"""
+    indexes = [
+        "CREATE INDEX IF NOT EXISTS idx_payments_created_ts ON payments(created_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_subscription ON payments(subscription_id, status)",
+    ]
+    for statement in indexes:
+        await db.execute(statement)
+    await db.execute("ANALYZE")
+
+
+async def _m009_catalog_coalesce_indexes(db):
+    """Индексы каталога по COALESCE(rating/price_8, 0) — выражениям сортировки Database.COURSE_ORDERS"""
+    for index_name in ("idx_courses_category_rating", "idx_courses_category_price"):
+        await db.execute(f"DROP INDEX IF EXISTS {index_name}")
+    indexes = [
+        "CREATE INDEX IF NOT EXISTS idx_courses_category_rating_key "
+        "ON courses(category, COALESCE(rating, 0) DESC, course_id)",
+        "CREATE INDEX IF NOT EXISTS idx_courses_category_price_key "
+        "ON courses(category, COALESCE(price_8, 0), course_id)",
+    ]
+    for statement in indexes:
+        await db.execute(statement)
+    await db.execute("ANALYZE")
+
+
+# (версия, описание, функция) — только добавлять в конец
+MIGRATIONS = [
+    (1, "Начальная схема", _m001_initial_schema),
+    (2, "template_id в subscriptions", _m002_subscriptions_template_id),
+    (3, "Индексы для частых запросов", _m003_query_indexes),
+    (4, "Время UTC в секундах для visits и payments", _m004_epoch_timestamps),
+    (5, "Индексы сортировки каталога", _m005_catalog_indexes),
+    (6, "Индексы поиска платежей по invoice_id и id AirbaPay", _m006_payment_reference_indexes),
+    (7, "Расписание проверок pending-платежей", _m007_payment_check_schedule),
+    (8, "Индексы сверки платежей", _m008_payment_reconciliation_indexes),
+    (9, "Индексы каталога по сортировке без NULL", _m009_catalog_coalesce_indexes),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_schema_version(db) -> int:
+    """Текущая версия схемы (0 — миграции ещё не применялись)"""
+    async with db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ) as cursor:
+        if not await cursor.fetchone():
+            return 0
+    async with db.execute("SELECT MAX(version) FROM schema_version") as cursor:
+        row = await cursor.fetchone()
+        return row[0] or 0
+
+
+async def run_migrations(db) -> int:
+    """
+    Применить недостающие миграции на соединении записи.
+    Если схема актуальна, DDL не выполняется.
+    Returns: версия схемы после применения
+    """
+    version = await get_schema_version(db)
+    if version >= LATEST_VERSION:
+        return version
+
+    for number, description, migration in MIGRATIONS:
+        if number <= version:
+            continue
+
+        logger.info(f"Применяем миграцию {number}: {description}")
+        await db.execute("BEGIN")
+        try:
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            await migration(db)
+            await db.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (number, description)
+            )
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Ошибка при применении миграции {number}: {e}", exc_info=True)
+            raise
+        version = number
+
+    return version
@@ -1,48 +1,110 @@
 """
 Платежный сервис AirbaPay для Telegram бота
 """
-import requests
 import uuid
+import json
+import base64
 import logging
 import asyncio
-from typing import Dict, Any, Optional, Callable
-from functools import wraps
+import time
+from typing import Dict, Any, Optional
 from decimal import Decimal
 from datetime import date, datetime
 
+import aiohttp
+
+from config import (
+    AIRBA_PAY_BASE_URL, AIRBA_PAY_COMPANY_ID, AIRBA_PAY_PASSWORD, AIRBA_PAY_TERMINAL_ID,
+    AIRBA_PAY_BREAKER_RECOVERY, AIRBA_PAY_BREAKER_THRESHOLD, AIRBA_PAY_RETRY_ATTEMPTS, AIRBA_PAY_RETRY_BUDGET,
+    AIRBA_PAY_RETRY_DELAY, AIRBA_PAY_TIMEOUTS, AIRBA_PAY_TOKEN_REFRESH_MARGIN, AIRBA_PAY_TOKEN_TTL,
+    AIRBA_PAY_USER, AIRBA_PAY_WEBHOOK_SECRET
+)
+from utils.http_pool import http_pool
+from utils.metrics import metrics
+from utils.resilience import CLOSED, CircuitBreaker, RetryBudget
+from utils.retry import retry_async
+
 logger = logging.getLogger(__name__)
 
 
-def convert_for_json_serialization(data):
-    """
-    Рекурсивно конвертирует Decimal, date и datetime объекты в строки
-    """
-    if isinstance(data, Decimal):
-        return str(data)
-    elif isinstance(data, (date, datetime)):
-        return data.isoformat()
-    elif isinstance(data, dict):
-        return {key: convert_for_json_serialization(value) for key, value in data.items()}
-    elif isinstance(data, list):
-        return [convert_for_json_serialization(item) for item in data]
-    else:
-        return data
+def _json_default(value):
+    """Decimal, date и datetime для json.dumps (без рекурсивного копирования данных)"""
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _jwt_expiry(token: str) -> Optional[float]:
+    """Время истечения (exp) из JWT без проверки подписи или None"""
+    parts = token.split('.')
+    if len(parts) != 3:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(parts[1] + '=' * (-len(parts[1]) % 4)))
+        return float(payload['exp'])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+# Ответы, после которых идемпотентный запрос имеет смысл повторить
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class _RetryableResponse(Exception):
+    """Ответ, после которого запрос повторяется (для retry_async)"""
+
+    def __init__(self, response: Dict[str, Any]):
+        super().__init__(f"HTTP {response['status_code']}")
+        self.response = response
 
 
 class AirbaPayClient:
-    """Клиент для работы с AirbaPay API"""
+    """
+    Асинхронный клиент AirbaPay API.
+
+    Запросы идут через общий пул соединений aiohttp (utils.http_pool):
+    соединения с API переиспользуются, а не открываются заново на каждый
+    вызов, и запросы не занимают потоки исполнителя по умолчанию.
+
+    Токен доступа кэшируется вместе со сроком действия (expires_in из ответа,
+    exp из JWT или token_ttl) и обновляется заранее, за refresh_margin секунд
+    до истечения. Одновременные обновления объединяются в одно, а ответ 401
+    приводит к повторному входу и одному повтору запроса. Клиент рассчитан
+    на один экземпляр на процесс (см. airba_client).
+
+    Все запросы идут через _call: таймаут по виду запроса (timeouts: auth,
+    status, payment), автомат отключения, который при недоступности AirbaPay
+    сразу возвращает ошибку вместо ожидания таймаута, и повторы с
+    экспоненциальной паузой и разбросом — только для идемпотентных запросов
+    (вход, статус, карты) и в пределах общего бюджета повторов.
+    """
     
-    def __init__(self, base_url: str, user: str, password: str, terminal_id: str, company_id: str = "230140022645"):
+    def __init__(self, base_url: str, user: str, password: str, terminal_id: str, company_id: str = "230140022645",
+                 timeout: float = None, token_ttl: float = 3600, refresh_margin: float = 60,
+                 timeouts: Dict[str, float] = None, retry_attempts: int = 3, retry_delay: float = 0.5,
+                 breaker: CircuitBreaker = None, retry_budget: RetryBudget = None):
         self.base_url = base_url
         self.user = user
         self.password = password
         self.terminal_id = terminal_id
         self.company_id = company_id
         self.access_token = None
+        self.token_expires_at = 0.0
+        self.token_ttl = token_ttl
+        self.refresh_margin = refresh_margin
+        self.timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+        self._auth_lock: Optional[asyncio.Lock] = None
+        self.timeouts = timeouts or {}
+        self.retry_attempts = max(1, retry_attempts)
+        self.retry_delay = retry_delay
+        self.breaker = breaker or CircuitBreaker("airba")
+        self.retry_budget = retry_budget or RetryBudget()
         
-    def _make_request(self, method: str, endpoint: str, data: Dict[str, Any] = None, 
-                     headers: Dict[str, str] = None) -> Dict[str, Any]:
-        """Выполняет HTTP запрос к API"""
+    async def _make_request(self, method: str, endpoint: str, data: Dict[str, Any] = None, 
+                            headers: Dict[str, str] = None, timeout: float = None) -> Dict[str, Any]:
+        """Выполняет HTTP запрос к API (timeout — на этот запрос, сек)"""
         url = f"{self.base_url}{endpoint}"
         
         default_headers = {
@@ -55,42 +117,109 @@ class AirbaPayClient:
         if self.access_token:
             default_headers['Authorization'] = f'Bearer {self.access_token}'
         
-        if data:
-            data = convert_for_json_serialization(data)
+        body = json.dumps(data, default=_json_default).encode('utf-8') if data else None
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else self.timeout
         
         try:
-            response = requests.request(
-                method=method,
-                url=url,
-                json=data,
+            async with http_pool.session().request(
+                method,
+                url,
+                data=body,
                 headers=default_headers,
-                timeout=30
-            )
+                timeout=request_timeout
+            ) as response:
+                content = await response.read()
+            
+            logger.info(f"Airba Pay API request: {method} {url} - Status: {response.status}")
             
-            logger.info(f"Airba Pay API request: {method} {url} - Status: {response.status_code}")
+            if response.status >= 400:
+                logger.error(f"Airba Pay API error: {content.decode('utf-8', errors='replace')}")
             
-            if response.status_code >= 400:
-                logger.error(f"Airba Pay API error: {response.text}")
+            try:
+                payload = json.loads(content) if content else {}
+            except ValueError:
+                payload = {'error': content.decode('utf-8', errors='replace')}
                 
             return {
-                'status_code': response.status_code,
-                'data': response.json() if response.content else {},
-                'success': 200 <= response.status_code < 300
+                'status_code': response.status,
+                'data': payload,
+                'success': 200 <= response.status < 300
             }
             
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Airba Pay API request failed: {str(e)}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Airba Pay API request failed: {e!r}")
             return {
                 'status_code': 500,
-                'data': {'error': str(e)},
+                'data': {'error': str(e) or type(e).__name__},
                 'success': False
             }
     
-    def authenticate(self, payment_id: Optional[str] = None, subscription_id: Optional[str] = None) -> bool:
-        """Аутентификация в AirbaPay API (синхронная)"""
+    async def _call(self, method: str, endpoint: str, data: Dict[str, Any] = None,
+                    kind: str = None, idempotent: bool = False) -> Dict[str, Any]:
+        """
+        Запрос через автомат отключения и бюджет повторов.
+        kind — вид запроса для таймаута из self.timeouts; idempotent — можно
+        ли повторить запрос после сетевой ошибки, 429 или 5xx.
+        """
+        if not self.breaker.allow():
+            metrics.inc("airba.circuit_rejected")
+            return {
+                'status_code': 503,
+                'data': {'error': 'AirbaPay временно недоступен'},
+                'success': False,
+                'circuit_open': True,
+            }
+        self.retry_budget.record_request()
+        timeout = self.timeouts.get(kind)
+        
+        async def attempt():
+            response = await self._make_request(method, endpoint, data, timeout=timeout)
+            if response['status_code'] >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            if idempotent and response['status_code'] in RETRYABLE_STATUSES:
+                raise _RetryableResponse(response)
+            return response
+        
+        def on_retry(attempt_number: int, error: _RetryableResponse):
+            # Исключение из on_retry прекращает повторы
+            if self.breaker.state != CLOSED:
+                raise error
+            if not self.retry_budget.try_acquire():
+                metrics.inc("airba.retry_budget_exhausted")
+                raise error
+            metrics.inc("airba.retry")
+        
+        try:
+            return await retry_async(
+                attempt,
+                max_attempts=self.retry_attempts,
+                delay=self.retry_delay,
+                exceptions=(_RetryableResponse,),
+                on_retry=on_retry,
+                jitter=0.5,
+            )
+        except _RetryableResponse as e:
+            return e.response
+    
+    def resilience_snapshot(self) -> Dict[str, Any]:
+        """Состояние автомата отключения и бюджета повторов (для /metrics)"""
+        return {'breaker': self.breaker.snapshot(), 'retry_budget': self.retry_budget.snapshot()}
+    
+    async def authenticate(self, payment_id: Optional[str] = None, subscription_id: Optional[str] = None) -> bool:
+        """Аутентификация в AirbaPay API"""
+        return (await self._sign_in(payment_id))['success']
+    
+    async def _sign_in(self, payment_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Вход в AirbaPay API.
+        Returns: ответ входа; при неудаче — как есть (с circuit_open, если
+        автомат разомкнут), чтобы вызывающий видел настоящую причину
+        """
         if not self.user or not self.password or not self.terminal_id:
             logger.error(f"Missing Airbapay credentials - user: {bool(self.user)}, password: {bool(self.password)}, terminal_id: {bool(self.terminal_id)}")
-            return False
+            return {'success': False, 'status_code': 401, 'error': 'AirbaPay credentials are not configured'}
             
         auth_data = {
             'user': self.user,
@@ -103,73 +232,134 @@ class AirbaPayClient:
         
         logger.info(f"Attempting authentication with user: {self.user}, terminal_id: {self.terminal_id}")
             
-        response = self._make_request('POST', '/api/v1/auth/sign-in', auth_data)
+        metrics.inc("airba.auth")
+        with metrics.timer("airba.auth"):
+            response = await self._call('POST', '/api/v1/auth/sign-in', auth_data, kind='auth', idempotent=True)
         
         if response['success'] and 'access_token' in response['data']:
-            self.access_token = response['data']['access_token']
-            logger.info("Authentication successful")
-            return True
+            token = response['data']['access_token']
+            expires_in = response['data'].get('expires_in')
+            if isinstance(expires_in, (int, float)) and expires_in > 0:
+                expires_at = time.time() + expires_in
+            else:
+                expires_at = _jwt_expiry(token) or time.time() + self.token_ttl
+            self.access_token = token
+            self.token_expires_at = expires_at
+            logger.info(f"Authentication successful, token valid for {expires_at - time.time():.0f}s")
+            return response
         
+        if response.get('circuit_open') or response['status_code'] >= 500:
+            # AirbaPay недоступен — учётные данные ни при чём
+            metrics.inc("airba.auth_unavailable")
+            logger.warning(f"Authentication skipped, AirbaPay unavailable: {response.get('data', {})}")
+            return response
+        
+        metrics.inc("airba.auth_failed")
         logger.error(f"Authentication failed: {response.get('data', {})}")
-        return False
+        if response['success']:
+            # 2xx без токена
+            return {**response, 'success': False, 'error': 'Authentication failed: no access_token in response'}
+        return response
+    
+    def _token_fresh(self) -> bool:
+        """Токен есть и не истекает в ближайшие refresh_margin секунд"""
+        return bool(self.access_token) and time.time() < self.token_expires_at - self.refresh_margin
+    
+    async def _ensure_token(self, stale_token: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Получить действующий токен. Вход выполняет только первый из
+        одновременных вызовов, остальные ждут его и используют новый токен.
+        stale_token — токен, отклонённый API (401): он обновляется, даже если
+        срок действия ещё не истёк.
+        Returns: None или ответ неудачного входа
+        """
+        if self._token_fresh() and self.access_token != stale_token:
+            return None
+        if self._auth_lock is None:
+            self._auth_lock = asyncio.Lock()
+        async with self._auth_lock:
+            if self._token_fresh() and self.access_token != stale_token:
+                metrics.inc("airba.auth_coalesced")
+                return None
+            response = await self._sign_in()
+            return None if response['success'] else response
+    
+    async def _authorized_request(self, method: str, endpoint: str, data: Dict[str, Any] = None,
+                                  kind: str = None, idempotent: bool = False) -> Dict[str, Any]:
+        """
+        Запрос с действующим токеном; при 401 — повторный вход и один повтор.
+        Если войти не удалось, возвращается ответ входа (503 с circuit_open
+        при разомкнутом автомате, 401 при неверных учётных данных).
+        """
+        auth_failure = await self._ensure_token()
+        if auth_failure:
+            return auth_failure
+        
+        token = self.access_token
+        metrics.inc("airba.api")
+        with metrics.timer("airba.api"):
+            response = await self._call(method, endpoint, data, kind, idempotent)
+        if response['status_code'] != 401:
+            return response
+        
+        logger.warning(f"Airba Pay API 401 for {method} {endpoint}, refreshing token")
+        metrics.inc("airba.unauthorized")
+        auth_failure = await self._ensure_token(stale_token=token)
+        if auth_failure:
+            return auth_failure
+        metrics.inc("airba.api")
+        with metrics.timer("airba.api"):
+            return await self._call(method, endpoint, data, kind, idempotent)
     
-    def add_card(self, card_data: Dict[str, Any]) -> Dict[str, Any]:
+    async def add_card(self, card_data: Dict[str, Any]) -> Dict[str, Any]:
         """Добавить новую карту"""
-        if not self.access_token:
-            if not self.authenticate():
-                return {'success': False, 'error': 'Authentication failed'}
-        return self._make_request('POST', '/api/v1/cards', card_data)
+        return await self._authorized_request('POST', '/api/v1/cards', card_data)
     
-    def get_saved_cards(self, account_id: str) -> Dict[str, Any]:
+    async def get_saved_cards(self, account_id: str) -> Dict[str, Any]:
         """Получить сохраненные карты"""
-        if not self.access_token:
-            if not self.authenticate():
-                return {'success': False, 'error': 'Authentication failed'}
-        return self._make_request('GET', f'/api/v1/cards/{account_id}')
+        return await self._authorized_request('GET', f'/api/v1/cards/{account_id}', idempotent=True)
     
-    def delete_saved_card(self, card_id: str) -> Dict[str, Any]:
+    async def delete_saved_card(self, card_id: str) -> Dict[str, Any]:
         """Удалить сохраненную карту"""
-        if not self.access_token:
-            if not self.authenticate():
-                return {'success': False, 'error': 'Authentication failed'}
-        return self._make_request('DELETE', f'/api/v1/cards/{card_id}')
+        return await self._authorized_request('DELETE', f'/api/v1/cards/{card_id}', idempotent=True)
     
-    def create_payment(self, payment_data: Dict[str, Any]) -> Dict[str, Any]:
+    async def create_payment(self, payment_data: Dict[str, Any]) -> Dict[str, Any]:
         """Создать новый платеж"""
-        if not self.access_token:
-            if not self.authenticate():
-                return {'success': False, 'error': 'Authentication failed'}
-        return self._make_request('POST', '/api/v2/payments/', payment_data)
+        return await self._authorized_request('POST', '/api/v2/payments/', payment_data, kind='payment')
     
-    def get_payment_status(self, payment_id: str) -> Dict[str, Any]:
+    async def get_payment_status(self, payment_id: str) -> Dict[str, Any]:
         """Получить статус платежа"""
-        if not self.access_token:
-            if not self.authenticate(payment_id=payment_id):
-                return {'success': False, 'error': 'Authentication failed'}
-        return self._make_request('GET', f'/api/v1/payments/{payment_id}')
+        return await self._authorized_request('GET', f'/api/v1/payments/{payment_id}', kind='status', idempotent=True)
     
-    def charge_payment(self, payment_id: str, charge_data: Dict[str, Any]) -> Dict[str, Any]:
+    async def charge_payment(self, payment_id: str, charge_data: Dict[str, Any]) -> Dict[str, Any]:
         """Подтвердить платеж (двухэтапная оплата)"""
-        if not self.access_token:
-            if not self.authenticate(payment_id=payment_id):
-                return {'success': False, 'error': 'Authentication failed'}
-        return self._make_request('PUT', '/api/v1/payments/charge', charge_data)
+        return await self._authorized_request('PUT', '/api/v1/payments/charge', charge_data, kind='payment')
     
-    def refund_payment(self, payment_id: str, refund_data: Dict[str, Any]) -> Dict[str, Any]:
+    async def refund_payment(self, payment_id: str, refund_data: Dict[str, Any]) -> Dict[str, Any]:
         """Возврат платежа"""
-        if not self.access_token:
-            if not self.authenticate(payment_id=payment_id):
-                return {'success': False, 'error': 'Authentication failed'}
-        return self._make_request('DELETE', '/api/v1/payments/return', refund_data)
+        return await self._authorized_request('DELETE', '/api/v1/payments/return', refund_data, kind='payment')
+
+
+# Статусы платежа, после которых он больше не меняется сам по себе
+FINAL_STATUSES = {"success", "failed", "error", "expired", "cancelled", "rejected", "refunded"}
 
 
 class PaymentService:
     """Сервис для обработки платежей через AirbaPay"""
     
-    def __init__(self, client: AirbaPayClient, db, webhook_url: str = None):
+    def __init__(self, client: AirbaPayClient, db, webhook_url: str = None,
+                 webhook_secret: str = AIRBA_PAY_WEBHOOK_SECRET):
         self.client = client
         self.db = db
         self.webhook_url = webhook_url or ""
+        self.webhook_secret = webhook_secret or ""
+    
+    def _callback_url(self, outcome: str) -> str:
+        """URL callback-а (success/failure) для services.payment_webhook"""
+        if not self.webhook_url:
+            return ""
+        url = f"{self.webhook_url}/webhook/payment/{outcome}"
+        return f"{url}?token={self.webhook_secret}" if self.webhook_secret else url
     
     async def create_payment(self, user_id: int, subscription_id: int, amount: float, 
                            currency: str = "KZT", description: str = "", 
@@ -192,8 +382,8 @@ class PaymentService:
             'language': language.upper(),
             'success_back_url': f"{self.webhook_url}/payment/success" if self.webhook_url else "",
             'failure_back_url': f"{self.webhook_url}/payment/failure" if self.webhook_url else "",
-            'success_callback': f"{self.webhook_url}/webhook/payment/success" if self.webhook_url else "",
-            'failure_callback': f"{self.webhook_url}/webhook/payment/failure" if self.webhook_url else "",
+            'success_callback': self._callback_url('success'),
+            'failure_callback': self._callback_url('failure'),
             'settlement': {
                 'payments': [
                     {
@@ -204,32 +394,30 @@ class PaymentService:
             }
         }
         
-        # Выполняем синхронный запрос в отдельном потоке
-        try:
-            loop = asyncio.get_running_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        
-        response = await loop.run_in_executor(None, self.client.create_payment, payment_data)
-        
-        if not response['success']:
-            return response
-            
-        airba_response = response['data']
-        
-        # Сохраняем платеж в базу данных
+        # Платеж сохраняется до запроса к AirbaPay: callback, пришедший раньше
+        # ответа на создание, находит его по invoice_id
         payment_id = await self.db.create_payment(
             user_id=user_id,
             subscription_id=subscription_id,
             amount=amount,
             currency=currency,
             invoice_id=invoice_id,
-            airba_payment_id=airba_response.get('id', ''),
-            redirect_url=airba_response.get('redirect_url', ''),
             status='pending'
         )
         
+        response = await self.client.create_payment(payment_data)
+        
+        if not response['success']:
+            await self.db.transition_payment_status(
+                payment_id, 'error', None, f"Не создан в AirbaPay: HTTP {response.get('status_code')}"
+            )
+            return response
+            
+        airba_response = response['data']
+        await self.db.set_payment_reference(
+            payment_id, airba_response.get('id', ''), airba_response.get('redirect_url', '')
+        )
+        
         return {
             'success': True,
             'payment_id': payment_id,
@@ -237,44 +425,24 @@ class PaymentService:
             'invoice_id': invoice_id
         }
     
-    async def get_payment_status(self, payment_id: int, user_id: int) -> Dict[str, Any]:
-        """Получить статус платежа"""
-        payment = await self.db.get_payment(payment_id, user_id)
-        
-        if not payment:
-            return {'success': False, 'error': 'Payment not found'}
-        
-        if not payment.get('airba_payment_id'):
-            return {'success': False, 'error': 'Airba payment ID not found'}
-        
-        # Выполняем синхронный запрос в отдельном потоке
-        try:
-            loop = asyncio.get_running_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        
-        response = await loop.run_in_executor(None, self.client.get_payment_status, payment['airba_payment_id'])
-        
-        if response['success']:
-            airba_data = response['data']
-            status = airba_data.get('status', 'pending')
-            
-            # Обновляем статус в базе данных
-            await self.db.update_payment_status(
-                payment_id=payment_id,
-                status=status,
-                transaction_id=airba_data.get('transaction_id', '')
-            )
-            
-            return {
-                'success': True,
-                'status': status,
-                'payment': payment,
-                'airba_data': airba_data
-            }
+    async def complete_payment(self, payment: Dict[str, Any], status: str, transaction_id: str = '',
+                               error_message: str = None) -> Optional[str]:
+        """
+        Записать итоговый статус платежа; при первом переходе в success
+        выдать QR-код абонемента (в той же транзакции, что и смена статуса).
+        Returns: текст QR-кода, если абонемент активировал именно этот вызов, иначе None
+        """
+        subscription_id = payment.get('subscription_id')
+        if status != 'success' or not subscription_id:
+            await self.db.transition_payment_status(payment['payment_id'], status, transaction_id, error_message)
+            return None
         
-        return response
+        from utils.qr_generator import create_subscription_qr
+        qr_id, qr_text = create_subscription_qr(payment['user_id'], subscription_id)
+        activated = await self.db.activate_paid_subscription(
+            payment['payment_id'], subscription_id, qr_id, transaction_id
+        )
+        return qr_text if activated else None
     
     async def refund_payment(self, payment_id: int, user_id: int, amount: float = None, reason: str = '') -> Dict[str, Any]:
         """Возврат платежа"""
@@ -302,14 +470,7 @@ class PaymentService:
             }
         }
         
-        # Выполняем синхронный запрос в отдельном потоке
-        try:
-            loop = asyncio.get_running_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        
-        response = await loop.run_in_executor(None, self.client.refund_payment, payment['airba_payment_id'], refund_data)
+        response = await self.client.refund_payment(payment['airba_payment_id'], refund_data)
         
         if response['success']:
             await self.db.create_payment_refund(
@@ -323,3 +484,19 @@ class PaymentService:
             
         return response
 
+
+# Общий клиент AirbaPay: один токен и один пул соединений на процесс
+airba_client = AirbaPayClient(
+    base_url=AIRBA_PAY_BASE_URL,
+    user=AIRBA_PAY_USER,
+    password=AIRBA_PAY_PASSWORD,
+    terminal_id=AIRBA_PAY_TERMINAL_ID,
+    company_id=AIRBA_PAY_COMPANY_ID,
+    token_ttl=AIRBA_PAY_TOKEN_TTL,
+    refresh_margin=AIRBA_PAY_TOKEN_REFRESH_MARGIN,
+    timeouts=AIRBA_PAY_TIMEOUTS,
+    retry_attempts=AIRBA_PAY_RETRY_ATTEMPTS,
+    retry_delay=AIRBA_PAY_RETRY_DELAY,
+    breaker=CircuitBreaker("airba", AIRBA_PAY_BREAKER_THRESHOLD, AIRBA_PAY_BREAKER_RECOVERY),
+    retry_budget=RetryBudget(AIRBA_PAY_RETRY_BUDGET),
+)
@@ -0,0 +1,187 @@
+"""
+Активация абонемента после оплаты: один раз на платёж
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from config import AIRBA_PAY_WEBHOOK_URL, PAYMENT_STATUS_CACHE_TTL
+from database import db
+from services.payment import FINAL_STATUSES, PaymentService, airba_client
+from utils.metrics import metrics
+from utils.qr_generator import subscription_qr_text
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentActivator:
+    """
+    Единая точка обработки статуса платежа для кнопки «Проверить платеж»,
+    PaymentChecker и callback-ов AirbaPay.
+
+    Обработка одного платежа идёт под его блокировкой в процессе, а смена
+    статуса на success и запись QR-кода — одной транзакцией с условием на
+    текущий статус (Database.activate_paid_subscription), поэтому абонемент
+    активируется ровно один раз и выданный QR-код не перезаписывается.
+
+    Результат запоминается: итоговый — насовсем (в пределах max_results
+    последних платежей), промежуточный — на status_ttl секунд. Пока идёт
+    проверка, остальные вызовы ждут её и получают тот же результат без
+    повторного запроса к AirbaPay.
+
+    Результат — словарь success/status/payment/qr_text/activated, где
+    activated=True только у вызова, который активировал абонемент (он и
+    отправляет QR-код пользователю).
+    """
+
+    def __init__(self, payment_service: PaymentService, status_ttl: float = PAYMENT_STATUS_CACHE_TTL,
+                 max_results: int = 10000):
+        self.payment_service = payment_service
+        self.db = payment_service.db
+        self.status_ttl = status_ttl
+        self.max_results = max_results
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._lock_users: Dict[int, int] = {}
+        # payment_id -> (истекает в (monotonic) или None для итогового, результат)
+        self._results: "OrderedDict[int, Tuple[Optional[float], Dict[str, Any]]]" = OrderedDict()
+
+    @asynccontextmanager
+    async def _payment_lock(self, payment_id: int):
+        """Блокировка платежа; удаляется, когда её больше никто не ждёт"""
+        lock = self._locks.setdefault(payment_id, asyncio.Lock())
+        self._lock_users[payment_id] = self._lock_users.get(payment_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._lock_users[payment_id] -= 1
+            if not self._lock_users[payment_id]:
+                del self._lock_users[payment_id]
+                del self._locks[payment_id]
+
+    def _cached(self, payment_id: int) -> Optional[Dict[str, Any]]:
+        entry = self._results.get(payment_id)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del self._results[payment_id]
+            return None
+        self._results.move_to_end(payment_id)
+        # Активировал абонемент только первый вызов
+        return dict(result, activated=False)
+
+    def _remember(self, payment_id: int, result: Dict[str, Any]):
+        final = result["status"] in FINAL_STATUSES
+        self._results[payment_id] = (None if final else time.monotonic() + self.status_ttl, result)
+        self._results.move_to_end(payment_id)
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    def forget(self, payment_id: int):
+        """Сбросить запомненный результат (платёж изменён в обход активатора, например сверкой)"""
+        self._results.pop(payment_id, None)
+
+    async def cancel(self, payment: Dict[str, Any], error_message: str = None) -> bool:
+        """
+        Отменить неоплаченный платёж и удалить его временный абонемент.
+        Оплаченный платёж не отменяется (условие transition_payment_status),
+        а абонемент удаляется под блокировкой платежа, поэтому одновременный
+        callback не активирует удаляемый абонемент.
+        Returns: True, если платёж отменил именно этот вызов
+        """
+        payment_id = payment["payment_id"]
+        async with self._payment_lock(payment_id):
+            cancelled = await self.db.transition_payment_status(payment_id, "cancelled", None, error_message)
+            if cancelled and payment.get("subscription_id"):
+                await self.db.delete_subscription(payment["subscription_id"])
+            self.forget(payment_id)
+        if cancelled:
+            metrics.inc("payment_activation.cancelled")
+        return cancelled
+
+    async def _current_qr_text(self, payment: Dict[str, Any]) -> Optional[str]:
+        """Текст уже выданного QR-кода абонемента платежа"""
+        subscription_id = payment.get("subscription_id")
+        subscription = await self.db.get_subscription(subscription_id) if subscription_id else None
+        if not subscription or not subscription.get("qr_code"):
+            return None
+        return subscription_qr_text(
+            subscription["qr_code"], subscription["user_id"], subscription_id, subscription.get("child_id")
+        )
+
+    async def _apply_locked(self, payment: Dict[str, Any], status: str, transaction_id: str = "",
+                            error_message: str = None) -> Dict[str, Any]:
+        qr_text = None
+        if status in FINAL_STATUSES and status != payment.get("status"):
+            qr_text = await self.payment_service.complete_payment(payment, status, transaction_id, error_message)
+        activated = qr_text is not None
+        if activated:
+            metrics.inc("payment_activation.activated")
+            logger.info(f"Платеж {payment['payment_id']}: абонемент {payment.get('subscription_id')} активирован")
+        elif status == "success":
+            # Уже активирован раньше — отдаём выданный QR-код
+            qr_text = await self._current_qr_text(payment)
+        result = {
+            "success": True,
+            "status": status,
+            "payment": payment,
+            "qr_text": qr_text,
+            "activated": activated,
+        }
+        self._remember(payment["payment_id"], result)
+        return result
+
+    async def apply(self, payment: Dict[str, Any], status: str, transaction_id: str = "",
+                    error_message: str = None) -> Dict[str, Any]:
+        """Применить уже известный статус (callback AirbaPay, PaymentChecker)"""
+        payment_id = payment["payment_id"]
+        async with self._payment_lock(payment_id):
+            cached = self._cached(payment_id)
+            if cached and cached["status"] in FINAL_STATUSES:
+                metrics.inc("payment_activation.cached")
+                return cached
+            return await self._apply_locked(payment, status, transaction_id, error_message)
+
+    async def check(self, payment_id: int, user_id: int = None) -> Dict[str, Any]:
+        """
+        Узнать статус платежа и активировать абонемент, если он оплачен.
+        Завершённый платёж и свежий результат не запрашиваются у AirbaPay повторно.
+        """
+        result = self._cached(payment_id)
+        if result is None:
+            async with self._payment_lock(payment_id):
+                result = self._cached(payment_id)
+                if result is None:
+                    return await self._check_locked(payment_id, user_id)
+        metrics.inc("payment_activation.cached")
+        if user_id and result["payment"].get("user_id") != user_id:
+            return {"success": False, "error": "Payment not found"}
+        return result
+
+    async def _check_locked(self, payment_id: int, user_id: int = None) -> Dict[str, Any]:
+        payment = await self.db.get_payment(payment_id, user_id)
+        if not payment:
+            return {"success": False, "error": "Payment not found"}
+
+        if payment.get("status") in FINAL_STATUSES:
+            # Статус уже записан (callback, PaymentChecker или прошлая проверка)
+            return await self._apply_locked(payment, payment["status"])
+
+        if not payment.get("airba_payment_id"):
+            return {"success": False, "error": "Airba payment ID not found"}
+
+        response = await self.payment_service.client.get_payment_status(payment["airba_payment_id"])
+        if not response.get("success"):
+            return response
+        data = response["data"]
+        return await self._apply_locked(
+            payment, data.get("status", "pending"), data.get("transaction_id", ""), data.get("error_message")
+        )
+
+
+# Общий для кнопки «Проверить платеж», PaymentChecker, callback-ов AirbaPay и сверки
+payment_activator = PaymentActivator(PaymentService(airba_client, db, AIRBA_PAY_WEBHOOK_URL))
@@ -0,0 +1,240 @@
+"""
+Сверка платежей с AirbaPay и абонементами
+"""
+import asyncio
+import logging
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import RECONCILE_BATCH, RECONCILE_CONCURRENCY
+from services.payment import FINAL_STATUSES
+from utils.metrics import metrics
+from utils.qr_generator import create_subscription_qr
+from utils.qr_token import is_qr_token
+from utils.timeutils import utc_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Виды расхождений: (описание, исправляется ли автоматически)
+KINDS = {
+    "activated": ("оплачен в AirbaPay, абонемент не активирован", True),
+    "missing_qr": ("успешный платёж без выданного QR-кода", True),
+    "status": ("статус платежа расходится с AirbaPay", True),
+    "orphan_subscription": ("остался абонемент неоплаченного платежа", True),
+    "paid_without_subscription": ("оплачен, но абонемент удалён — нужен ручной разбор", False),
+    "legacy_qr": ("успешный платёж со старым QR-кодом и посещениями — не меняется", False),
+}
+
+# Эти статусы в базе не перепроверяются у AirbaPay
+SETTLED_STATUSES = ("success", "refunded")
+# Статусы AirbaPay, при которых деньги не списаны и не заблокированы
+# (например, платёж отменён в боте до открытия страницы оплаты)
+UNPAID_STATUSES = ("new", "pending")
+
+
+class ReconciliationReport:
+    """Итог сверки: расхождения по видам, исправления и примеры платежей"""
+
+    SAMPLE_SIZE = 10
+
+    def __init__(self, since_ts: int, until_ts: int, apply: bool):
+        self.since_ts = since_ts
+        self.until_ts = until_ts
+        self.apply = apply
+        self.scanned = 0
+        self.provider_checked = 0
+        self.provider_errors = 0
+        self.notified = 0
+        self.elapsed = 0.0
+        self.found: Counter = Counter()
+        self.fixed: Counter = Counter()
+        self.samples: Dict[str, List[int]] = defaultdict(list)
+
+    def add(self, kind: str, payment_id: int):
+        self.found[kind] += 1
+        if len(self.samples[kind]) < self.SAMPLE_SIZE:
+            self.samples[kind].append(payment_id)
+
+    def format(self) -> str:
+        days = max(1, round((self.until_ts - self.since_ts) / 86400))
+        lines = [
+            f"🧾 Сверка платежей за {days} дн." + ("" if self.apply else " (без исправлений)"),
+            f"Платежей: {self.scanned}, проверено в AirbaPay: {self.provider_checked}, "
+            f"ошибок AirbaPay: {self.provider_errors}, {self.elapsed:.1f} сек",
+        ]
+        if not self.found:
+            lines.append("✅ Расхождений нет")
+        for kind, (label, _) in KINDS.items():
+            if self.found[kind]:
+                sample = ", ".join(str(payment_id) for payment_id in self.samples[kind])
+                lines.append(f"• {label}: {self.found[kind]} (платежи {sample})")
+        if self.apply and self.found:
+            lines.append(
+                f"Исправлено: платежей {self.fixed['payments']}, QR-кодов {self.fixed['qr_codes']}, "
+                f"удалено абонементов {self.fixed['orphans']}, QR-кодов отправлено {self.notified}"
+            )
+        return "\n".join(lines)
+
+
+class PaymentReconciler:
+    """
+    Пакетная сверка платежей за период.
+
+    Платежи окна читаются выборками по batch_size (keyset по payment_id).
+    Статус незавершённых и неуспешных платежей запрашивается у AirbaPay
+    одновременно, не больше concurrency запросов. Расхождения с базой и
+    абонементами исправляются одной транзакцией на выборку
+    (Database.apply_payment_reconciliation), с теми же условиями на текущее
+    состояние, что и при обычной активации, поэтому сверка безопасна при
+    работающих PaymentChecker и callback-ах.
+
+    Удаление абонемента и смена статуса выполняются только по ответу AirbaPay:
+    если статус узнать не удалось, платёж остаётся до следующей сверки.
+    """
+
+    def __init__(self, activator, batch_size: int = RECONCILE_BATCH, concurrency: int = RECONCILE_CONCURRENCY):
+        self.activator = activator
+        self.db = activator.db
+        self.client = activator.payment_service.client
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self._lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def run(self, since_ts: int, until_ts: int = None, apply: bool = True, bot=None) -> ReconciliationReport:
+        """
+        Сверить платежи, созданные в [since_ts, until_ts).
+        apply=False — только отчёт; bot — отправить пользователям выданные QR-коды.
+        """
+        until_ts = until_ts or utc_timestamp() + 1
+        report = ReconciliationReport(since_ts, until_ts, apply)
+        async with self._lock:
+            started = time.perf_counter()
+            try:
+                id_range = await self.db.get_payment_id_range(since_ts, until_ts)
+                if id_range:
+                    await self._run_range(id_range, report, bot)
+            finally:
+                report.elapsed = time.perf_counter() - started
+                metrics.observe("reconcile.run", report.elapsed * 1000)
+        logger.info(
+            f"Сверка платежей: {report.scanned} платежей, расхождений {sum(report.found.values())}, "
+            f"исправлено {dict(report.fixed)}, {report.elapsed:.1f} сек"
+        )
+        return report
+
+    async def _run_range(self, id_range: Tuple[int, int], report: ReconciliationReport, bot):
+        first_id, last_id = id_range
+        semaphore = asyncio.Semaphore(self.concurrency)
+        after_id = first_id - 1
+        while True:
+            rows = await self.db.get_reconciliation_chunk(
+                after_id, last_id, report.since_ts, report.until_ts, self.batch_size
+            )
+            if not rows:
+                break
+            after_id = rows[-1]["payment_id"]
+            report.scanned += len(rows)
+            metrics.inc("reconcile.scanned", len(rows))
+
+            statuses = await asyncio.gather(*(self._provider_status(row, semaphore, report) for row in rows))
+            fixes = self._diff(rows, statuses, report)
+            if report.apply and any(fixes[:3]):
+                await self._apply(fixes, report, bot)
+
+            if len(rows) < self.batch_size:
+                break
+
+    async def _provider_status(self, row: Dict[str, Any], semaphore: asyncio.Semaphore,
+                               report: ReconciliationReport) -> Optional[Dict[str, Any]]:
+        """Ответ AirbaPay по платежу или None (не нужен или не получен)"""
+        if row["status"] in SETTLED_STATUSES or not row.get("airba_payment_id"):
+            return None
+        async with semaphore:
+            response = await self.client.get_payment_status(row["airba_payment_id"])
+        report.provider_checked += 1
+        if not response.get("success"):
+            report.provider_errors += 1
+            metrics.inc("reconcile.provider_errors")
+            return None
+        return response["data"]
+
+    def _diff(self, rows: List[Dict[str, Any]], statuses: List[Optional[Dict[str, Any]]],
+              report: ReconciliationReport):
+        """Расхождения выборки и исправления для Database.apply_payment_reconciliation"""
+        payment_updates, qr_updates, orphans, issued = [], [], [], []
+
+        def issue_qr(row):
+            qr_id, qr_text = create_subscription_qr(row["user_id"], row["subscription_id"], row.get("child_id"))
+            qr_updates.append((row["subscription_id"], qr_id, row["qr_code"]))
+            issued.append((row, qr_id, qr_text))
+
+        for row, data in zip(rows, statuses):
+            payment_id, local = row["payment_id"], row["status"]
+            remote = data.get("status") if data else None
+            has_subscription = bool(row["has_subscription"])
+            qr_issued = has_subscription and bool(row["qr_code"]) and is_qr_token(row["qr_code"])
+
+            if local == "refunded":
+                continue
+
+            if local == "success" or remote == "success":
+                if not has_subscription:
+                    report.add("paid_without_subscription", payment_id)
+                    continue
+                if local != "success":
+                    payment_updates.append((payment_id, "success", data.get("transaction_id"), None))
+                    if qr_issued:
+                        report.add("status", payment_id)
+                    else:
+                        report.add("activated", payment_id)
+                        issue_qr(row)
+                elif not qr_issued:
+                    # Абонементы до подписанных токенов тоже хранят UUID: если по
+                    # коду уже были посещения, он выдан и продолжает работать
+                    if row["has_visits"]:
+                        report.add("legacy_qr", payment_id)
+                    else:
+                        report.add("missing_qr", payment_id)
+                        issue_qr(row)
+                continue
+
+            # Неоплаченный платёж: решение только по ответу AirbaPay (или если
+            # платёж до AirbaPay не дошёл и уже завершён в базе)
+            if row.get("airba_payment_id"):
+                confirmed = remote in FINAL_STATUSES or (local in FINAL_STATUSES and remote in UNPAID_STATUSES)
+            else:
+                confirmed = local in FINAL_STATUSES
+            if not confirmed:
+                continue
+            if remote in FINAL_STATUSES and remote != local:
+                report.add("status", payment_id)
+                payment_updates.append((payment_id, remote, data.get("transaction_id"), data.get("error_message")))
+            if has_subscription and not qr_issued and not row["has_visits"] and not row["has_live_payment"]:
+                report.add("orphan_subscription", payment_id)
+                orphans.append((row["subscription_id"], row["qr_code"]))
+
+        return payment_updates, qr_updates, orphans, issued
+
+    async def _apply(self, fixes, report: ReconciliationReport, bot):
+        payment_updates, qr_updates, orphans, issued = fixes
+        counts = await self.db.apply_payment_reconciliation(payment_updates, qr_updates, orphans)
+        report.fixed.update(counts)
+        for kind, value in counts.items():
+            metrics.inc(f"reconcile.fixed_{kind}", value)
+        for payment_id, *_ in payment_updates:
+            self.activator.forget(payment_id)
+
+        if not bot:
+            return
+        from services.payment_webhook import send_activation_qr
+        for row, qr_id, qr_text in issued:
+            # QR-код отправляется, только если записан именно он
+            subscription = await self.db.get_subscription(row["subscription_id"])
+            if subscription and subscription.get("qr_code") == qr_id:
+                await send_activation_qr(bot, row["user_id"], qr_text)
+                report.notified += 1
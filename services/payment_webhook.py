@@ -0,0 +1,181 @@
+"""
+Приём callback-ов AirbaPay об успешной и неуспешной оплате
+"""
+import asyncio
+import hmac
+import logging
+import time
+from typing import Any, Dict, Optional, Set
+
+from aiogram import Bot
+from aiohttp import web
+
+from config import (
+    AIRBA_PAY_WEBHOOK_CONFIRM, AIRBA_PAY_WEBHOOK_HOST, AIRBA_PAY_WEBHOOK_PORT, AIRBA_PAY_WEBHOOK_SECRET
+)
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Статус платежа, если callback его не передал
+DEFAULT_STATUSES = {"success": "success", "failure": "failed"}
+
+
+class PaymentWebhookServer:
+    """
+    Встроенный веб-сервер (aiohttp) для callback-ов, адреса которых
+    PaymentService.create_payment передаёт в AirbaPay:
+    POST /webhook/payment/success и POST /webhook/payment/failure.
+
+    Платёж ищется по invoice_id или id AirbaPay (индексы в payments), статус
+    перепроверяется запросом к API (confirm), затем применяется через
+    PaymentActivator: абонемент активируется один раз, даже если тот же успех
+    придёт повторно или его раньше увидит PaymentChecker. QR-код
+    отправляется пользователю сразу, не дожидаясь очередной проверки.
+    """
+
+    def __init__(self, bot: Bot, activator, host: str = "0.0.0.0", port: int = 8080,
+                 secret: str = "", confirm: bool = True):
+        self.bot = bot
+        self.activator = activator
+        self.host = host
+        self.port = port
+        self.secret = secret
+        self.confirm = confirm
+        self._runner: Optional[web.AppRunner] = None
+        self._notifications: Set[asyncio.Task] = set()
+
+    def build_app(self) -> web.Application:
+        """Приложение aiohttp с маршрутами callback-ов (используется и в тестах)"""
+        app = web.Application()
+        app.router.add_post("/webhook/payment/{outcome:success|failure}", self.handle_callback)
+        return app
+
+    async def start(self):
+        """Запустить веб-сервер"""
+        if self._runner:
+            return
+        if not self.secret and not self.confirm:
+            logger.warning(
+                "Callback-и AirbaPay принимаются без токена и без проверки статуса в API: "
+                "задайте AIRBA_PAY_WEBHOOK_SECRET или включите AIRBA_PAY_WEBHOOK_CONFIRM"
+            )
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Приём callback-ов AirbaPay запущен на {self.host}:{self.port}")
+
+    async def stop(self):
+        """Остановить веб-сервер и дождаться отправки уже начатых уведомлений"""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._notifications:
+            await asyncio.gather(*self._notifications, return_exceptions=True)
+        logger.info("Приём callback-ов AirbaPay остановлен")
+
+    async def _read_payload(self, request: web.Request) -> Dict[str, Any]:
+        """Тело callback-а: JSON или форма"""
+        if request.content_type == "application/json":
+            data = await request.json()
+            if not isinstance(data, dict):
+                raise ValueError("Тело callback-а не объект JSON")
+            return data
+        return dict(await request.post())
+
+    async def handle_callback(self, request: web.Request) -> web.Response:
+        """Обработать callback AirbaPay"""
+        outcome = request.match_info["outcome"]
+        metrics.inc("webhook.received")
+        started = time.perf_counter()
+        try:
+            return await self._handle_callback(request, outcome, started)
+        finally:
+            metrics.observe("webhook.handle", (time.perf_counter() - started) * 1000)
+
+    async def _handle_callback(self, request: web.Request, outcome: str, received: float) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.query.get("token", ""), self.secret):
+            metrics.inc("webhook.rejected")
+            logger.warning(f"Callback AirbaPay с неверным токеном от {request.remote}")
+            return web.json_response({"error": "forbidden"}, status=403)
+
+        try:
+            data = await self._read_payload(request)
+        except ValueError:
+            metrics.inc("webhook.rejected")
+            return web.json_response({"error": "bad payload"}, status=400)
+
+        invoice_id = data.get("invoice_id")
+        airba_payment_id = data.get("id") or data.get("payment_id")
+        payment = await self.activator.db.get_payment_by_reference(invoice_id, airba_payment_id)
+        if not payment:
+            metrics.inc("webhook.unknown")
+            logger.warning(f"Callback AirbaPay для неизвестного платежа: invoice_id={invoice_id}, id={airba_payment_id}")
+            return web.json_response({"error": "payment not found"}, status=404)
+
+        status = data.get("status") or DEFAULT_STATUSES[outcome]
+        transaction_id = data.get("transaction_id", "")
+        error_message = data.get("error_message") or data.get("error")
+
+        if self.confirm:
+            if not payment.get("airba_payment_id"):
+                # Callback пришёл раньше ответа на создание платежа — AirbaPay повторит его
+                metrics.inc("webhook.not_ready")
+                return web.json_response({"error": "payment is being created"}, status=503)
+            # Callback не подписан ключом, которому мы доверяем: статус берём у API
+            response = await self.activator.payment_service.client.get_payment_status(payment["airba_payment_id"])
+            if not response["success"]:
+                # Ошибка 5xx — AirbaPay повторит callback позже
+                metrics.inc("webhook.confirm_failed")
+                return web.json_response({"error": "status check failed"}, status=502)
+            # Как PaymentChecker: без статуса в ответе платёж считается незавершённым
+            status = response["data"].get("status", "pending")
+            transaction_id = response["data"].get("transaction_id", transaction_id)
+
+        result = await self.activator.apply(payment, status, transaction_id, error_message)
+        logger.info(f"Callback AirbaPay ({outcome}) для платежа {payment['payment_id']}: статус {status}")
+
+        if result["activated"]:
+            metrics.inc("webhook.activated")
+            # Ответ AirbaPay не ждёт отправки фото в Telegram
+            task = asyncio.create_task(self._notify_activated(payment, result["qr_text"], received))
+            self._notifications.add(task)
+            task.add_done_callback(self._notifications.discard)
+        return web.json_response({"status": "ok"})
+
+    async def _notify_activated(self, payment: Dict[str, Any], qr_text: str, received: float):
+        """Отправить QR-код; received — perf_counter() при получении callback-а"""
+        started = time.perf_counter()
+        await send_activation_qr(self.bot, payment["user_id"], qr_text)
+        finished = time.perf_counter()
+        metrics.observe("webhook.notify", (finished - started) * 1000)
+        # От получения callback-а до отправленного QR-кода
+        metrics.observe("webhook.time_to_qr", (finished - received) * 1000)
+
+
+async def send_activation_qr(bot: Bot, user_id: int, qr_text: str):
+    """Отправить пользователю QR-код оплаченного абонемента (ошибки только логируются)"""
+    from utils.qr_cache import qr_cache
+
+    try:
+        await bot.send_message(
+            user_id,
+            "✅ Платеж успешно выполнен!\n\n"
+            "🎉 Абонемент активирован!\n\n"
+            "Вот твой QR-код для посещений 👇"
+        )
+        await qr_cache.send_photo(bot, user_id, qr_text, caption="Твой QR-код для посещений")
+    except Exception as e:
+        logger.error(f"Не удалось отправить QR-код пользователю {user_id} после оплаты: {e}")
+
+
+def create_webhook_server(bot: Bot, activator) -> PaymentWebhookServer:
+    """Приёмник callback-ов с настройками из config"""
+    return PaymentWebhookServer(
+        bot,
+        activator,
+        host=AIRBA_PAY_WEBHOOK_HOST,
+        port=AIRBA_PAY_WEBHOOK_PORT,
+        secret=AIRBA_PAY_WEBHOOK_SECRET,
+        confirm=AIRBA_PAY_WEBHOOK_CONFIRM,
+    )
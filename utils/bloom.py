@@ -0,0 +1,42 @@
+"""
+Фильтр Блума для быстрой проверки «кода точно нет»
+"""
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    Вероятностное множество строк: `in` может ошибочно вернуть True
+    (с вероятностью около error_rate при заполнении до capacity), но никогда
+    не возвращает False для добавленного значения. Удаление не поддерживается —
+    фильтр перестраивается целиком.
+    """
+
+    def __init__(self, capacity: int = 1000000, error_rate: float = 0.01):
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, value: str):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self._bits)
@@ -0,0 +1,143 @@
+"""
+Пул соединений SQLite: одно соединение на запись и несколько на чтение
+"""
+import asyncio
+import logging
+import re
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+
+_PRAGMA_TOKEN = re.compile(r"^-?[A-Za-z0-9_]+$")
+
+
+class PoolTimeoutError(TimeoutError):
+    """Не удалось получить соединение из пула за отведённое время"""
+
+
+async def apply_pragmas(conn: aiosqlite.Connection, pragmas: Dict[str, Any]):
+    """Применить профиль PRAGMA к соединению"""
+    for name, value in pragmas.items():
+        if value is None or value == "":
+            continue
+        # PRAGMA не поддерживает параметры, поэтому проверяем значения вручную
+        if not _PRAGMA_TOKEN.match(name) or not _PRAGMA_TOKEN.match(str(value)):
+            raise ValueError(f"Недопустимое значение PRAGMA: {name}={value!r}")
+        await conn.execute(f"PRAGMA {name} = {value}")
+
+
+class ConnectionPool:
+    """
+    Ограниченный пул соединений aiosqlite.
+
+    SQLite допускает только одного писателя, поэтому все изменения идут через
+    единственное соединение на запись (под asyncio.Lock), а чтения
+    распределяются по `readers` постоянным соединениям. Соединения открываются
+    один раз и переиспользуются, вместо нового потока и открытия файла на
+    каждый запрос.
+    """
+
+    def __init__(self, db_path: str, readers: int = 4, acquire_timeout: float = 10.0,
+                 pragmas: Optional[Dict[str, Any]] = None):
+        self.db_path = db_path
+        self.readers = max(1, readers)
+        self.acquire_timeout = acquire_timeout
+        self.pragmas = pragmas or {}
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._writer_lock = asyncio.Lock()
+        self._idle_readers: asyncio.Queue = asyncio.Queue()
+        self._connections: List[aiosqlite.Connection] = []
+        self._open_lock = asyncio.Lock()
+        self._opened = False
+
+    async def _connect(self) -> aiosqlite.Connection:
+        """Открыть новое соединение с настройками пула"""
+        conn = await aiosqlite.connect(self.db_path)
+        conn.row_factory = aiosqlite.Row
+        try:
+            await apply_pragmas(conn, self.pragmas)
+        except Exception:
+            await conn.close()
+            raise
+        self._connections.append(conn)
+        return conn
+
+    async def open(self):
+        """Открыть соединения пула (повторный вызов ничего не делает)"""
+        if self._opened:
+            return
+        async with self._open_lock:
+            if self._opened:
+                return
+            self._writer = await self._connect()
+            for _ in range(self.readers):
+                self._idle_readers.put_nowait(await self._connect())
+            self._opened = True
+            logger.info(f"Пул соединений открыт: 1 на запись, {self.readers} на чтение ({self.db_path})")
+
+    async def close(self):
+        """Закрыть все соединения пула"""
+        async with self._open_lock:
+            if not self._opened:
+                return
+            for conn in self._connections:
+                try:
+                    await conn.close()
+                except Exception as e:
+                    logger.error(f"Ошибка при закрытии соединения: {e}")
+            self._connections.clear()
+            self._idle_readers = asyncio.Queue()
+            self._writer = None
+            self._opened = False
+            logger.info("Пул соединений закрыт")
+
+    @asynccontextmanager
+    async def read(self):
+        """Получить соединение для чтения"""
+        await self.open()
+        # asyncio.timeout, а не wait_for: в 3.11 wait_for может отменить уже
+        # полученное соединение, и оно не вернётся в пул
+        try:
+            async with asyncio.timeout(self.acquire_timeout):
+                conn = await self._idle_readers.get()
+        except TimeoutError:
+            raise PoolTimeoutError(
+                f"Нет свободного соединения на чтение за {self.acquire_timeout} сек"
+            ) from None
+        try:
+            yield conn
+        finally:
+            self._idle_readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self):
+        """
+        Получить соединение для записи.
+
+        При исключении незавершённая транзакция откатывается, при нормальном
+        выходе — фиксируется, чтобы соединение всегда возвращалось чистым.
+        """
+        await self.open()
+        try:
+            async with asyncio.timeout(self.acquire_timeout):
+                await self._writer_lock.acquire()
+        except TimeoutError:
+            raise PoolTimeoutError(
+                f"Соединение на запись занято дольше {self.acquire_timeout} сек"
+            ) from None
+        conn = self._writer
+        try:
+            yield conn
+        except BaseException:
+            if conn.in_transaction:
+                await conn.rollback()
+            raise
+        else:
+            if conn.in_transaction:
+                await conn.commit()
+        finally:
+            self._writer_lock.release()
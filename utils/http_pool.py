@@ -0,0 +1,46 @@
+"""
+Общий пул HTTP-соединений (aiohttp) для внешних API
+"""
+import logging
+from typing import Optional
+
+import aiohttp
+
+from config import HTTP_CONNECT_TIMEOUT, HTTP_KEEPALIVE_TIMEOUT, HTTP_POOL_LIMIT, HTTP_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class HttpPool:
+    """
+    Одна aiohttp.ClientSession на процесс: соединения (TCP + TLS) держатся
+    открытыми keepalive_timeout секунд и переиспользуются между запросами,
+    одновременно открыто не больше `limit` соединений. Сессия создаётся при
+    первом запросе внутри работающего цикла событий.
+    """
+
+    def __init__(self, limit: int = 20, keepalive_timeout: float = 60,
+                 timeout: float = 30, connect_timeout: float = 5):
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def session(self) -> aiohttp.ClientSession:
+        """Общая сессия (создаётся при первом обращении)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            logger.info(f"HTTP-пул создан: до {self.limit} соединений, keep-alive {self.keepalive_timeout} сек")
+        return self._session
+
+    async def close(self):
+        """Закрыть сессию и все соединения"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP-пул закрыт")
+        self._session = None
+
+
+# Глобальный пул HTTP-соединений
+http_pool = HttpPool(HTTP_POOL_LIMIT, HTTP_KEEPALIVE_TIMEOUT, HTTP_TIMEOUT, HTTP_CONNECT_TIMEOUT)
@@ -0,0 +1,96 @@
+"""
+Простые метрики процесса: счётчики и задержки с перцентилями
+"""
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Optional
+
+
+class LatencyStats:
+    """Задержки операции: общее количество и перцентили по последним `window` замерам"""
+
+    def __init__(self, window: int = 1000):
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float):
+        """Добавить замер (в миллисекундах)"""
+        self.samples.append(ms)
+        self.count += 1
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Перцентиль p (0-100) по окну замеров, None — замеров нет"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max_ms,
+        }
+
+
+class Metrics:
+    """Реестр счётчиков и задержек"""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.counters: Dict[str, int] = {}
+        self.latencies: Dict[str, LatencyStats] = {}
+
+    def inc(self, name: str, value: int = 1):
+        """Увеличить счётчик"""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, ms: float):
+        """Записать задержку операции (в миллисекундах)"""
+        stats = self.latencies.get(name)
+        if stats is None:
+            stats = self.latencies[name] = LatencyStats(self.window)
+        stats.observe(ms)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Замерить время выполнения блока"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - started) * 1000)
+
+    def latency(self, name: str) -> Optional[LatencyStats]:
+        return self.latencies.get(name)
+
+    def format_report(self) -> str:
+        """Текстовый отчёт для администратора"""
+        lines = []
+        if self.latencies:
+            lines.append("⏱ Задержки (мс):")
+            for name in sorted(self.latencies):
+                snap = self.latencies[name].snapshot()
+                lines.append(
+                    f"   {name}: p50={snap['p50']:.2f} p99={snap['p99']:.2f} "
+                    f"max={snap['max']:.2f} (n={snap['count']})"
+                )
+        if self.counters:
+            lines.append("🔢 Счётчики:")
+            for name in sorted(self.counters):
+                lines.append(f"   {name}: {self.counters[name]}")
+        return "\n".join(lines) if lines else "Метрик пока нет."
+
+    def reset(self):
+        self.counters.clear()
+        self.latencies.clear()
+
+
+# Глобальный реестр метрик
+metrics = Metrics()
@@ -1,106 +1,187 @@
 """
 Утилиты для пагинации
 """
+import re
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from typing import List, Any, Callable
+from typing import List, Any, Optional, Sequence, Tuple
+
+# Telegram ограничивает callback_data 64 байтами
+CALLBACK_DATA_LIMIT = 64
+
+# Столбец ключа сортировки: (выражение SQL, по убыванию)
+KeyColumn = Tuple[str, bool]
+
+
+# Keyset-пагинация
+#
+# Вместо OFFSET страница запрашивается «после» (или «до») ключа последней
+# показанной строки, например (rating, course_id). Запрос читает limit+1 строк
+# по индексу, лишняя строка говорит о наличии следующей страницы. Ключ
+# упаковывается в callback_data кнопок «Вперёд/Назад», поэтому состояние
+# страницы не нужно хранить на сервере. Столбцы ключа должны быть NOT NULL
+# (допускающие NULL — через COALESCE) и заканчиваться уникальным столбцом
+# (обычно первичным ключом).
+
+
+def keyset_order_by(columns: Sequence[KeyColumn], backward: bool = False) -> str:
+    """ORDER BY для ключа сортировки (при backward — в обратном порядке)"""
+    parts = []
+    for column, descending in columns:
+        if backward:
+            descending = not descending
+        parts.append(f"{column} {'DESC' if descending else 'ASC'}")
+    return ", ".join(parts)
+
+
+def keyset_condition(columns: Sequence[KeyColumn], cursor: Sequence[Any],
+                     backward: bool = False) -> Tuple[str, List[Any]]:
+    """
+    Условие WHERE «строка идёт после cursor» в порядке columns
+    (при backward — «до cursor»).
+
+    Первый столбец дополнительно ограничен нестрогим неравенством, чтобы
+    SQLite мог начать чтение индекса сразу с нужного места.
+    """
+    if len(columns) != len(cursor):
+        raise ValueError("Длина курсора не совпадает с ключом сортировки")
+
+    def operator(descending: bool, strict: bool) -> str:
+        forward = descending == backward
+        if strict:
+            return ">" if forward else "<"
+        return ">=" if forward else "<="
+
+    first_column, first_descending = columns[0]
+    alternatives = []
+    alternatives_params: List[Any] = []
+    for i, (column, descending) in enumerate(columns):
+        terms = [f"{prev_column} = ?" for prev_column, _ in columns[:i]]
+        terms.append(f"{column} {operator(descending, True)} ?")
+        alternatives.append("(" + " AND ".join(terms) + ")")
+        alternatives_params.extend(cursor[:i])
+        alternatives_params.append(cursor[i])
+
+    sql = (f"{first_column} {operator(first_descending, False)} ? AND "
+           f"({' OR '.join(alternatives)})")
+    return sql, [cursor[0]] + alternatives_params
 
 
-def create_pagination_keyboard(
-    items: List[Any],
-    page: int,
-    items_per_page: int,
+def _is_plain_column(column: str) -> bool:
+    return re.fullmatch(r"[\w.]+", column) is not None
+
+
+def _column_key(column: str) -> str:
+    """
+    Имя поля строки результата для выражения столбца
+    (c.rating -> rating, COALESCE(c.price_8, 0) -> key_coalesce_c_price_8_0)
+    """
+    if _is_plain_column(column):
+        return column.rsplit(".", 1)[-1]
+    return "key_" + "_".join(re.findall(r"\w+", column)).lower()
+
+
+def keyset_select(columns: Sequence[KeyColumn]) -> str:
+    """
+    Дополнение списка SELECT выражениями ключа, которые не являются
+    столбцами таблицы (", COALESCE(c.price_8, 0) AS key_..."), чтобы
+    KeysetPage мог взять ключ из строки результата
+    """
+    return "".join(
+        f", {column} AS {_column_key(column)}" for column, _ in columns if not _is_plain_column(column)
+    )
+
+
+class KeysetPage:
+    """
+    Страница keyset-пагинации, собранная из limit+1 строк запроса.
+
+    rows — строки в порядке запроса (при backward — в обратном), cursor —
+    ключ, от которого строилась страница (None — первая страница).
+    """
+
+    def __init__(self, rows: List[dict], limit: int, columns: Sequence[KeyColumn],
+                 cursor: Optional[Sequence[Any]] = None, backward: bool = False):
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows = list(reversed(rows))
+            self.has_prev = has_more
+            self.has_next = True
+        else:
+            self.has_prev = cursor is not None
+            self.has_next = has_more
+        self.items = rows
+        self.columns = list(columns)
+
+    def key(self, row: dict) -> Tuple[Any, ...]:
+        """Ключ сортировки строки"""
+        return tuple(row[_column_key(column)] for column, _ in self.columns)
+
+    @property
+    def first_key(self) -> Optional[Tuple[Any, ...]]:
+        return self.key(self.items[0]) if self.items else None
+
+    @property
+    def last_key(self) -> Optional[Tuple[Any, ...]]:
+        return self.key(self.items[-1]) if self.items else None
+
+
+def encode_keyset_callback(prefix: str, backward: bool, key: Sequence[Any]) -> str:
+    """
+    Упаковать ключ в callback_data: {prefix}:{n|p}:{значение}:{значение}...
+    Поддерживаются числовые ключи.
+    """
+    values = ":".join(repr(value) if isinstance(value, float) else str(int(value)) for value in key)
+    data = f"{prefix}:{'p' if backward else 'n'}:{values}"
+    if len(data.encode("utf-8")) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f"callback_data длиннее {CALLBACK_DATA_LIMIT} байт: {data}")
+    return data
+
+
+def decode_keyset_callback(data: str, prefix: str) -> Tuple[bool, Tuple[Any, ...]]:
+    """
+    Распаковать callback_data кнопки keyset-пагинации
+    Returns: (backward, ключ)
+    """
+    head, direction, *values = data.split(":")
+    if head != prefix or direction not in ("n", "p") or not values:
+        raise ValueError(f"Неверный формат callback_data: {data}")
+    key = tuple(float(value) if any(ch in value for ch in ".einf") else int(value) for value in values)
+    return direction == "p", key
+
+
+def create_keyset_keyboard(
+    page: KeysetPage,
     callback_prefix: str,
-    item_formatter: Callable[[Any], str] = None,
+    item_buttons: List[List[InlineKeyboardButton]] = None,
     additional_buttons: List[List[InlineKeyboardButton]] = None
-) -> tuple[List[Any], InlineKeyboardMarkup]:
+) -> InlineKeyboardMarkup:
     """
-    Создаёт пагинацию для списка элементов
-    
-    Args:
-        items: Список элементов для отображения
-        page: Текущая страница (начиная с 0)
-        items_per_page: Количество элементов на странице
-        callback_prefix: Префикс для callback data (например, "course_page")
-        item_formatter: Функция для форматирования элемента в текст
-        additional_buttons: Дополнительные кнопки для добавления
-    
-    Returns:
-        Tuple (items_on_page, keyboard)
+    Клавиатура страницы: кнопки элементов, «Назад/Вперёд» и дополнительные кнопки.
+    Обработчик callback_prefix должен редактировать исходное сообщение.
     """
-    total_pages = (len(items) + items_per_page - 1) // items_per_page if items else 1
-    page = max(0, min(page, total_pages - 1))
-    
-    start_idx = page * items_per_page
-    end_idx = start_idx + items_per_page
-    items_on_page = items[start_idx:end_idx]
-    
-    keyboard = []
-    
-    # Кнопки пагинации
+    keyboard = list(item_buttons or [])
+
     pagination_buttons = []
-    
-    if total_pages > 1:
-        if page > 0:
-            pagination_buttons.append(
-                InlineKeyboardButton(
-                    text="⬅️ Назад",
-                    callback_data=f"{callback_prefix}_page_{page - 1}"
-                )
-            )
-        
+    if page.items and page.has_prev:
         pagination_buttons.append(
             InlineKeyboardButton(
-                text=f"📄 {page + 1}/{total_pages}",
-                callback_data="page_info"
+                text="⬅️ Назад",
+                callback_data=encode_keyset_callback(callback_prefix, True, page.first_key)
             )
         )
-        
-        if page < total_pages - 1:
-            pagination_buttons.append(
-                InlineKeyboardButton(
-                    text="Вперёд ➡️",
-                    callback_data=f"{callback_prefix}_page_{page + 1}"
-                )
+    if page.items and page.has_next:
+        pagination_buttons.append(
+            InlineKeyboardButton(
+                text="Вперёд ➡️",
+                callback_data=encode_keyset_callback(callback_prefix, False, page.last_key)
             )
-    
+        )
     if pagination_buttons:
         keyboard.append(pagination_buttons)
-    
-    # Дополнительные кнопки
+
     if additional_buttons:
         keyboard.extend(additional_buttons)
-    
-    return items_on_page, InlineKeyboardMarkup(inline_keyboard=keyboard)
-
-
-def paginate_courses(courses: List[dict], page: int = 0, per_page: int = 5):
-    """
-    Пагинация курсов с форматированием
-    """
-    def format_course(course: dict) -> str:
-        center_name = course.get("center_name", "Не указано")
-        price_8 = course.get("price_8", 0)
-        rating = course.get("rating", 0)
-        address = course.get("address", "")
-        city = course.get("city", "")
-        
-        text = f"📘 Курс: {course['name']}\n"
-        text += f"🏫 {center_name}\n"
-        text += f"💰 Абонемент: 8 занятий — {price_8:,}₸\n"
-        text += f"⭐️ Рейтинг: {rating}\n"
-        text += f"📍 {city}, {address}\n"
-        return text
-    
-    items, keyboard = create_pagination_keyboard(
-        items=courses,
-        page=page,
-        items_per_page=per_page,
-        callback_prefix="courses",
-        item_formatter=format_course
-    )
-    
-    return items, keyboard
-
-
-
 
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -3,94 +3,145 @@
 """
 import asyncio
 import logging
-from typing import Optional
-from datetime import datetime, timedelta
+import random
+import time
+from typing import Any, Dict, Optional
+
+from config import (
+    PAYMENT_CHECK_BACKOFF_BASE, PAYMENT_CHECK_BACKOFF_MAX, PAYMENT_CHECK_BATCH, PAYMENT_CHECK_CONCURRENCY,
+    PAYMENT_CHECK_INTERVAL, PAYMENT_PENDING_TTL
+)
+from services.payment import FINAL_STATUSES
+from utils.metrics import metrics
+from utils.timeutils import utc_timestamp
 
 logger = logging.getLogger(__name__)
 
+# Максимум выборок за один проход (чтобы проход не растянулся бесконечно)
+MAX_BATCHES_PER_PASS = 20
+
+
+def backoff_delay(attempts: int, base: int = PAYMENT_CHECK_BACKOFF_BASE,
+                  max_delay: int = PAYMENT_CHECK_BACKOFF_MAX) -> int:
+    """Пауза после attempts-й проверки: base * 2^(attempts-1) (не больше max_delay) ±10%"""
+    delay = min(base * (2 ** min(max(attempts - 1, 0), 16)), max_delay)
+    return max(1, int(delay * random.uniform(0.9, 1.1)))
+
 
 class PaymentChecker:
-    """Автоматическая проверка статуса pending платежей"""
-    
-    def __init__(self, db, payment_service, check_interval: int = 60):
+    """
+    Автоматическая проверка статуса pending платежей.
+
+    Время следующей проверки и число попыток хранятся в payments
+    (next_check_at, check_attempts), поэтому расписание переживает
+    перезапуск. За проход выбираются платежи, чья проверка наступила,
+    в порядке next_check_at — старые не голодают при потоке новых. Они
+    проверяются одновременно (не больше concurrency запросов к AirbaPay),
+    интервал до следующей проверки растёт экспоненциально, а платежи
+    старше pending_ttl переводятся в expired. Итоговый статус применяется
+    через PaymentActivator (активация абонемента ровно один раз).
+    """
+
+    def __init__(self, db, activator, check_interval: float = PAYMENT_CHECK_INTERVAL,
+                 batch_size: int = PAYMENT_CHECK_BATCH, concurrency: int = PAYMENT_CHECK_CONCURRENCY,
+                 pending_ttl: int = PAYMENT_PENDING_TTL, bot=None):
         self.db = db
-        self.payment_service = payment_service
-        self.check_interval = check_interval  # Интервал проверки в секундах
+        self.activator = activator
+        self.check_interval = check_interval  # Интервал между проходами в секундах
+        self.batch_size = batch_size
+        self.concurrency = max(1, concurrency)
+        self.pending_ttl = pending_ttl
+        self.bot = bot  # Если задан, QR-код оплаченного абонемента отправляется пользователю
         self.running = False
         self._task: Optional[asyncio.Task] = None
-    
-    async def check_pending_payments(self):
-        """Проверка всех pending платежей"""
+
+    async def check_pending_payments(self) -> int:
+        """
+        Один проход: истечение старых платежей и проверка всех, чья очередь наступила.
+        Returns: сколько платежей проверено
+        """
+        started = time.perf_counter()
+        checked = 0
         try:
-            # Получаем все pending платежи старше 1 минуты
-            import aiosqlite
-            async with aiosqlite.connect(self.db.db_path) as db_conn:
-                db_conn.row_factory = aiosqlite.Row
-                async with db_conn.execute("""
-                    SELECT payment_id, user_id, subscription_id, airba_payment_id, created_at
-                    FROM payments
-                    WHERE status = 'pending'
-                    AND datetime(created_at) < datetime('now', '-1 minute')
-                    ORDER BY created_at DESC
-                    LIMIT 10
-                """) as cursor:
-                    payments = await cursor.fetchall()
-            
-            for payment_row in payments:
-                payment = dict(payment_row)
-                payment_id = payment['payment_id']
-                user_id = payment['user_id']
-                
-                try:
-                    result = await self.payment_service.get_payment_status(payment_id, user_id)
-                    
-                    if result.get("success"):
-                        status = result.get("status", "pending")
-                        
-                        if status == "success":
-                            # Платеж успешен - активируем абонемент
-                            subscription_id = payment.get("subscription_id")
-                            if subscription_id:
-                                await self._activate_subscription(user_id, subscription_id)
-                                logger.info(f"Платеж {payment_id} успешен, абонемент {subscription_id} активирован")
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка при проверке платежа {payment_id}: {e}")
-        
+            expired = await self.db.expire_pending_payments(utc_timestamp() - self.pending_ttl)
+            if expired:
+                metrics.inc("payment_checker.expired", expired)
+                logger.info(f"Истёк срок ожидания оплаты у {expired} платежей")
+
+            semaphore = asyncio.Semaphore(self.concurrency)
+            for _ in range(MAX_BATCHES_PER_PASS):
+                now_ts = utc_timestamp()
+                payments = await self.db.get_due_payments(now_ts, self.batch_size)
+                if not payments:
+                    break
+
+                for payment in payments:
+                    metrics.observe("payment_checker.lag", (now_ts - payment["next_check_at"]) * 1000)
+
+                results = await asyncio.gather(*(self._check_payment(payment, semaphore) for payment in payments))
+                # Незавершённые платежи — на следующую проверку одной транзакцией
+                await self.db.reschedule_payment_checks([item for item in results if item])
+                checked += len(payments)
+
+                if len(payments) < self.batch_size:
+                    break
         except Exception as e:
             logger.error(f"Ошибка при проверке pending платежей: {e}", exc_info=True)
-    
-    async def _activate_subscription(self, user_id: int, subscription_id: int):
-        """Активация абонемента после успешной оплаты"""
+        finally:
+            metrics.inc("payment_checker.checked", checked)
+            metrics.observe("payment_checker.pass", (time.perf_counter() - started) * 1000)
+        return checked
+
+    async def _check_payment(self, payment: Dict[str, Any], semaphore: asyncio.Semaphore):
+        """
+        Проверить один платёж.
+        Returns: (payment_id, next_check_at, check_attempts) или None, если платёж завершён
+        """
+        payment_id = payment["payment_id"]
+        attempts = (payment.get("check_attempts") or 0) + 1
+        reschedule = (payment_id, utc_timestamp() + backoff_delay(attempts), attempts)
+
+        if not payment.get("airba_payment_id"):
+            # Платёж не дошёл до AirbaPay — дождётся истечения срока
+            return reschedule
+
         try:
-            from utils.qr_generator import generate_subscription_qr
-            import aiosqlite
-            
-            # Генерируем QR-код
-            qr_id, qr_image = generate_subscription_qr(user_id, subscription_id)
-            
-            # Обновляем QR-код в базе данных
-            async with aiosqlite.connect(self.db.db_path) as db_conn:
-                await db_conn.execute(
-                    "UPDATE subscriptions SET qr_code = ? WHERE subscription_id = ?",
-                    (qr_id, subscription_id)
-                )
-                await db_conn.commit()
-            
-            logger.info(f"Абонемент {subscription_id} активирован с QR-кодом {qr_id}")
-            
+            async with semaphore:
+                response = await self.activator.payment_service.client.get_payment_status(payment["airba_payment_id"])
+            if not response.get("success"):
+                metrics.inc("payment_checker.errors")
+                return reschedule
+
+            data = response["data"]
+            status = data.get("status", "pending")
+            if status not in FINAL_STATUSES:
+                return reschedule
+
+            result = await self.activator.apply(
+                payment, status, data.get("transaction_id", ""), data.get("error_message")
+            )
+            if status == "success":
+                metrics.inc("payment_checker.succeeded")
+            else:
+                metrics.inc("payment_checker.failed")
+            if result["activated"] and self.bot:
+                from services.payment_webhook import send_activation_qr
+                await send_activation_qr(self.bot, payment["user_id"], result["qr_text"])
+            return None
         except Exception as e:
-            logger.error(f"Ошибка при активации абонемента {subscription_id}: {e}", exc_info=True)
-    
+            metrics.inc("payment_checker.errors")
+            logger.error(f"Ошибка при проверке платежа {payment_id}: {e}")
+            return reschedule
+
     async def start(self):
         """Запуск автоматической проверки"""
         if self.running:
             return
-        
+
         self.running = True
         self._task = asyncio.create_task(self._run())
         logger.info("Автоматическая проверка платежей запущена")
-    
+
     async def stop(self):
         """Остановка автоматической проверки"""
         self.running = False
@@ -101,7 +152,7 @@ class PaymentChecker:
             except asyncio.CancelledError:
                 pass
         logger.info("Автоматическая проверка платежей остановлена")
-    
+
     async def _run(self):
         """Основной цикл проверки"""
         while self.running:
@@ -113,4 +164,3 @@ class PaymentChecker:
             except Exception as e:
                 logger.error(f"Ошибка в цикле проверки платежей: {e}", exc_info=True)
                 await asyncio.sleep(self.check_interval)
-
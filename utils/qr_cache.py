@@ -0,0 +1,193 @@
+"""
+Кэш изображений QR-кодов и file_id загруженных в Telegram фото
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, Message
+
+from config import QR_CACHE_DIR, QR_CACHE_DISK_FILES, QR_CACHE_FILE_IDS, QR_CACHE_MAX_BYTES
+from utils.metrics import metrics
+from utils.qr_generator import render_qr_png, render_qr_png_async
+
+logger = logging.getLogger(__name__)
+
+
+class QrAssetCache:
+    """
+    Кэш QR-кодов по закодированному тексту.
+
+    PNG рендерится один раз и хранится в LRU с ограничением по суммарному
+    размеру; вытесненные изображения при заданном spill_dir сохраняются на
+    диск (не больше max_disk_files файлов). После первой отправки запоминается
+    file_id фото в Telegram, и повторные отправки ссылаются на него без
+    повторной загрузки.
+    """
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024, max_file_ids: int = 100000,
+                 spill_dir: Optional[str] = None, max_disk_files: int = 100000):
+        self.max_bytes = max_bytes
+        self.max_file_ids = max_file_ids
+        self.spill_dir = spill_dir
+        self.max_disk_files = max_disk_files
+        self._png: "OrderedDict[str, bytes]" = OrderedDict()
+        self._png_bytes = 0
+        self._file_ids: "OrderedDict[str, str]" = OrderedDict()
+        self._disk: "OrderedDict[str, str]" = OrderedDict()
+        self._rendering: Dict[str, asyncio.Future] = {}
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def _disk_path(self, text: str) -> str:
+        name = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return os.path.join(self.spill_dir, f"{name}.png")
+
+    def _remember_png(self, text: str, png: bytes):
+        if text in self._png:
+            self._png_bytes -= len(self._png.pop(text))
+        self._png[text] = png
+        self._png_bytes += len(png)
+        while self._png_bytes > self.max_bytes and len(self._png) > 1:
+            evicted_text, evicted_png = self._png.popitem(last=False)
+            self._png_bytes -= len(evicted_png)
+            self._spill(evicted_text, evicted_png)
+
+    def _spill(self, text: str, png: bytes):
+        """Сохранить вытесненное изображение на диск"""
+        if not self.spill_dir:
+            return
+        path = self._disk_path(text)
+        try:
+            with open(path, "wb") as f:
+                f.write(png)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить QR-код на диск: {e}")
+            return
+        self._disk[text] = path
+        while len(self._disk) > self.max_disk_files:
+            _, old_path = self._disk.popitem(last=False)
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+    def _load_spilled(self, text: str) -> Optional[bytes]:
+        path = self._disk.pop(text, None)
+        if not path:
+            return None
+        try:
+            with open(path, "rb") as f:
+                png = f.read()
+            os.remove(path)
+            return png
+        except OSError:
+            return None
+
+    def _cached_png(self, text: str) -> Optional[bytes]:
+        png = self._png.get(text)
+        if png is not None:
+            self._png.move_to_end(text)
+            metrics.inc("qr_cache.memory_hit")
+            return png
+
+        png = self._load_spilled(text)
+        if png is not None:
+            metrics.inc("qr_cache.disk_hit")
+            self._remember_png(text, png)
+        return png
+
+    def get_png(self, text: str) -> bytes:
+        """PNG QR-кода для текста (рендер только при промахе кэша, синхронно)"""
+        png = self._cached_png(text)
+        if png is None:
+            metrics.inc("qr_cache.render")
+            png = render_qr_png(text)
+            self._remember_png(text, png)
+        return png
+
+    async def get_png_async(self, text: str) -> bytes:
+        """
+        PNG QR-кода для текста; при промахе кэша рендер выполняется в пуле
+        исполнителей. Одновременные запросы одного текста ждут один рендер.
+        """
+        png = self._cached_png(text)
+        if png is not None:
+            return png
+
+        pending = self._rendering.get(text)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._rendering[text] = future
+        try:
+            metrics.inc("qr_cache.render")
+            png = await render_qr_png_async(text)
+            self._remember_png(text, png)
+            future.set_result(png)
+            return png
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим; помечаем его полученным
+            future.exception()
+            raise
+        finally:
+            self._rendering.pop(text, None)
+
+    def get_file_id(self, text: str) -> Optional[str]:
+        file_id = self._file_ids.get(text)
+        if file_id is not None:
+            self._file_ids.move_to_end(text)
+        return file_id
+
+    def remember_file_id(self, text: str, file_id: str):
+        self._file_ids[text] = file_id
+        self._file_ids.move_to_end(text)
+        while len(self._file_ids) > self.max_file_ids:
+            self._file_ids.popitem(last=False)
+
+    async def send_photo(self, bot: Bot, chat_id: int, text: str, caption: str = None, **kwargs) -> Message:
+        """Отправить QR-код фотографией: по file_id, если он уже есть, иначе загрузкой PNG"""
+        file_id = self.get_file_id(text)
+        if file_id:
+            try:
+                sent = await bot.send_photo(chat_id, photo=file_id, caption=caption, **kwargs)
+                metrics.inc("qr_cache.file_id_sent")
+                return sent
+            except TelegramBadRequest as e:
+                logger.warning(f"file_id QR-кода больше недействителен, загружаем заново: {e}")
+                self._file_ids.pop(text, None)
+
+        sent = await bot.send_photo(
+            chat_id,
+            photo=BufferedInputFile(await self.get_png_async(text), filename="qr_code.png"),
+            caption=caption,
+            **kwargs
+        )
+        metrics.inc("qr_cache.uploaded")
+        if sent.photo:
+            # Последний размер — оригинал, его и переиспользуем
+            self.remember_file_id(text, sent.photo[-1].file_id)
+        return sent
+
+    async def answer_photo(self, message: Message, text: str, caption: str = None, **kwargs) -> Message:
+        """Ответить на сообщение QR-кодом (см. send_photo)"""
+        return await self.send_photo(message.bot, message.chat.id, text, caption=caption, **kwargs)
+
+
+# Глобальный кэш QR-кодов
+qr_cache = QrAssetCache(
+    max_bytes=QR_CACHE_MAX_BYTES,
+    max_file_ids=QR_CACHE_FILE_IDS,
+    spill_dir=QR_CACHE_DIR or None,
+    max_disk_files=QR_CACHE_DISK_FILES,
+)
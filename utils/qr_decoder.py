@@ -0,0 +1,81 @@
+"""
+Распознавание QR-кодов на фотографиях
+"""
+import io
+import logging
+import time
+from typing import List
+
+from aiogram import Bot
+from aiogram.types import PhotoSize
+
+from config import QR_PHOTO_DECODE_SIDE, QR_PHOTO_MIN_SIDE
+from utils.metrics import metrics
+
+try:
+    import zxingcpp
+    from PIL import Image
+    QR_DECODE_AVAILABLE = True
+except ImportError:
+    QR_DECODE_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+def decode_qr_image(data: bytes, max_side: int = 800) -> List[str]:
+    """
+    Тексты всех QR-кодов на изображении (без повторов, пустой список — кодов нет).
+
+    Изображение переводится в оттенки серого и уменьшается до max_side по
+    большей стороне; если на уменьшенном коды не найдены, пробуется оригинал.
+    Функция модуля, чтобы её можно было выполнить в пуле процессов.
+    """
+    if not QR_DECODE_AVAILABLE:
+        raise RuntimeError("Для распознавания QR-кодов нужны библиотеки zxing-cpp и Pillow")
+
+    with Image.open(io.BytesIO(data)) as image:
+        gray = image.convert("L")
+    candidates = [gray]
+    if max(gray.size) > max_side:
+        scaled = gray.copy()
+        scaled.thumbnail((max_side, max_side))
+        candidates.insert(0, scaled)
+
+    for candidate in candidates:
+        barcodes = zxingcpp.read_barcodes(candidate, formats=zxingcpp.BarcodeFormat.QRCode)
+        texts = list(dict.fromkeys(barcode.text for barcode in barcodes if barcode.text))
+        if texts:
+            return texts
+    return []
+
+
+def pick_photo_size(sizes: List[PhotoSize], min_side: int = QR_PHOTO_MIN_SIDE) -> PhotoSize:
+    """Наименьший вариант фото, у которого меньшая сторона не меньше min_side (иначе самый большой)"""
+    ordered = sorted(sizes, key=lambda size: size.width * size.height)
+    for size in ordered:
+        if min(size.width, size.height) >= min_side:
+            return size
+    return ordered[-1]
+
+
+async def decode_qr_photo(bot: Bot, sizes: List[PhotoSize]) -> List[str]:
+    """
+    Скачать фото из Telegram и распознать QR-коды в пуле исполнителей.
+    Время скачивания и распознавания пишется в метрики qr_photo.download и qr_photo.decode.
+    """
+    from utils.render_pool import render_pool
+
+    photo = pick_photo_size(sizes)
+
+    started = time.perf_counter()
+    downloaded = await bot.download(photo.file_id)
+    data = downloaded.read()
+    metrics.observe("qr_photo.download", (time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    texts = await render_pool.run(decode_qr_image, data, QR_PHOTO_DECODE_SIDE)
+    metrics.observe("qr_photo.decode", (time.perf_counter() - started) * 1000)
+
+    metrics.inc("qr_photo.decoded" if texts else "qr_photo.not_found")
+    logger.debug(f"QR-кодов на фото {photo.width}x{photo.height}: {len(texts)}")
+    return texts
@@ -1,44 +1,71 @@
 import io
-import uuid
+import logging
 
-try:
-    import qrcode
-    from PIL import Image
-    QR_AVAILABLE = True
-except ImportError:
-    QR_AVAILABLE = False
+from config import QR_BORDER, QR_BOX_SIZE, QR_ERROR_CORRECTION, QR_MASK_PATTERN, QR_RENDER_BACKEND
+from utils.qr_render import QRCODE_AVAILABLE as QR_AVAILABLE, get_renderer
+from utils.qr_token import is_qr_token, qr_signer
+
+logger = logging.getLogger(__name__)
+
+_RENDER_OPTIONS = dict(
+    box_size=QR_BOX_SIZE,
+    border=QR_BORDER,
+    error_correction=QR_ERROR_CORRECTION,
+    mask_pattern=QR_MASK_PATTERN,
+)
+
+# Движок для изображений, отправляемых в Telegram (только PNG)
+png_renderer = get_renderer(QR_RENDER_BACKEND, **_RENDER_OPTIONS)
+if png_renderer.content_type != "image/png":
+    logger.warning(f"Движок {QR_RENDER_BACKEND} не рисует PNG, для фото используется движок png")
+    png_renderer = get_renderer("png", **_RENDER_OPTIONS)
 
 
 def generate_qr_code(text: str) -> io.BytesIO:
     """Генерирует QR-код и возвращает его как BytesIO объект"""
     if not QR_AVAILABLE:
-        # Возвращаем пустой BytesIO если Pillow не установлен
-        return io.BytesIO(b'QR code generation requires Pillow library')
+        # Возвращаем пустой BytesIO если qrcode не установлен
+        return io.BytesIO(b'QR code generation requires qrcode library')
     
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(text)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format='PNG')
-    img_bytes.seek(0)
-    return img_bytes
+    return io.BytesIO(png_renderer.render(text))
 
 
-def generate_subscription_qr(user_id: int, subscription_id: int, child_id: int = None) -> tuple[str, io.BytesIO]:
-    """Генерирует уникальный QR-код для абонемента"""
-    # Создаём уникальный идентификатор
-    qr_id = str(uuid.uuid4())
+def render_qr_png(text: str) -> bytes:
+    """PNG QR-кода в байтах (функция модуля, чтобы её можно было выполнить в пуле процессов)"""
+    return generate_qr_code(text).getvalue()
+
+
+async def render_qr_png_async(text: str) -> bytes:
+    """Рендер QR-кода в пуле исполнителей, не блокируя цикл событий"""
+    from utils.render_pool import render_pool
+    return await render_pool.run(render_qr_png, text)
+
+
+def subscription_qr_text(qr_id: str, user_id: int, subscription_id: int, child_id: int = None) -> str:
+    """Текст, кодируемый в QR-коде абонемента"""
+    # Подписанный токен сам является текстом QR-кода
+    if is_qr_token(qr_id):
+        return qr_id
+    # Старые абонементы с UUID-кодом
     qr_text = f"SUBSCRIPTION:{qr_id}:{user_id}:{subscription_id}"
     if child_id:
         qr_text += f":{child_id}"
-    
+    return qr_text
+
+
+def create_subscription_qr(user_id: int, subscription_id: int, child_id: int = None) -> tuple[str, str]:
+    """
+    Создаёт уникальный QR-код абонемента без рендера изображения: (qr_id, текст QR-кода).
+
+    qr_id — подписанный токен (см. utils.qr_token), он же сохраняется в
+    subscriptions.qr_code и кодируется в QR-код как есть.
+    """
+    qr_id = qr_signer.issue(subscription_id)
+    return qr_id, subscription_qr_text(qr_id, user_id, subscription_id, child_id)
+
+
+def generate_subscription_qr(user_id: int, subscription_id: int, child_id: int = None) -> tuple[str, io.BytesIO]:
+    """Генерирует уникальный QR-код для абонемента"""
+    qr_id, qr_text = create_subscription_qr(user_id, subscription_id, child_id)
     qr_image = generate_qr_code(qr_text)
     return qr_id, qr_image
-
@@ -0,0 +1,76 @@
+"""
+Индекс активных QR-кодов в памяти процесса
+"""
+import logging
+from collections import OrderedDict, namedtuple
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# Компактная запись активного абонемента для сканирования
+QrRecord = namedtuple("QrRecord", [
+    "qr_code", "subscription_id", "user_id", "child_id",
+    "owner_name", "child_name", "template_name", "tariff", "lessons_remaining",
+])
+
+
+class ActiveQrIndex:
+    """
+    Хэш-индекс qr_code -> QrRecord для активных абонементов.
+
+    Размер ограничен `capacity` записями (вытесняются давно не сканированные).
+    Пока ни одна запись не вытеснена, индекс полный (`complete`): отсутствие
+    кода в нём означает, что активного абонемента с таким кодом нет, и базу
+    можно не спрашивать. Индекс обновляет Database при каждом изменении
+    абонемента, поэтому он корректен только в пределах одного процесса.
+    """
+
+    def __init__(self, capacity: int = 200000):
+        self.capacity = max(1, capacity)
+        self._records: "OrderedDict[str, QrRecord]" = OrderedDict()
+        self._by_subscription: Dict[int, str] = {}
+        self.complete = False
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def get(self, qr_code: str) -> Optional[QrRecord]:
+        """Запись по QR-коду (None — нет в индексе)"""
+        record = self._records.get(qr_code)
+        if record is not None:
+            self._records.move_to_end(qr_code)
+        return record
+
+    def put(self, record: QrRecord):
+        """Добавить или заменить запись абонемента"""
+        self.discard_subscription(record.subscription_id)
+        self._records[record.qr_code] = record
+        self._by_subscription[record.subscription_id] = record.qr_code
+        while len(self._records) > self.capacity:
+            _, evicted = self._records.popitem(last=False)
+            self._by_subscription.pop(evicted.subscription_id, None)
+            if self.complete:
+                logger.info(f"Индекс QR-кодов заполнен ({self.capacity}), дальше промахи проверяются в БД")
+            self.complete = False
+
+    def discard_subscription(self, subscription_id: int):
+        """Убрать абонемент из индекса (удалён, истёк или сменил QR-код)"""
+        qr_code = self._by_subscription.pop(subscription_id, None)
+        if qr_code is not None:
+            self._records.pop(qr_code, None)
+
+    def update_after_visit(self, subscription_id: int, lessons_remaining: int, status: str):
+        """Обновить остаток занятий после посещения"""
+        qr_code = self._by_subscription.get(subscription_id)
+        if qr_code is None:
+            return
+        if status != "active":
+            self.discard_subscription(subscription_id)
+            return
+        self._records[qr_code] = self._records[qr_code]._replace(lessons_remaining=lessons_remaining)
+
+    def clear(self):
+        self._records.clear()
+        self._by_subscription.clear()
+        self.complete = False
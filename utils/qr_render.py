@@ -0,0 +1,203 @@
+"""
+Движки рендеринга QR-кодов
+
+Матрица модулей строится библиотекой qrcode, а дальше её рисует выбранный
+движок:
+- "png" — прямая запись 1-битного PNG (zlib + struct, без операций PIL);
+- "pil" — прежний рендер через изображение PIL;
+- "svg" и "text" — для отладки (SVG-файл и псевдографика в консоли).
+"""
+import io
+import struct
+import zlib
+from typing import Dict, List, Optional, Type
+
+try:
+    import qrcode
+    from qrcode.constants import ERROR_CORRECT_H, ERROR_CORRECT_L, ERROR_CORRECT_M, ERROR_CORRECT_Q
+    QRCODE_AVAILABLE = True
+except ImportError:
+    QRCODE_AVAILABLE = False
+
+if QRCODE_AVAILABLE:
+    ERROR_CORRECTION_LEVELS = {
+        "L": ERROR_CORRECT_L,
+        "M": ERROR_CORRECT_M,
+        "Q": ERROR_CORRECT_Q,
+        "H": ERROR_CORRECT_H,
+    }
+else:
+    ERROR_CORRECTION_LEVELS = {}
+
+
+def build_matrix(text: str, error_correction: str = "L", border: int = 4,
+                 mask_pattern: Optional[int] = None) -> List[List[bool]]:
+    """
+    Матрица модулей QR-кода вместе с рамкой (True — тёмный модуль).
+
+    mask_pattern=None — выбрать лучшую из 8 масок (так делает qrcode по
+    умолчанию, это большая часть времени рендера); фиксированная маска 0-7
+    даёт корректный по стандарту код в несколько раз быстрее.
+    """
+    if not QRCODE_AVAILABLE:
+        raise RuntimeError("Для генерации QR-кодов нужна библиотека qrcode")
+    if error_correction not in ERROR_CORRECTION_LEVELS:
+        raise ValueError(f"Неизвестный уровень коррекции ошибок: {error_correction}")
+
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=ERROR_CORRECTION_LEVELS[error_correction],
+        border=border,
+        mask_pattern=mask_pattern,
+    )
+    qr.add_data(text)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+class QrRenderer:
+    """Базовый движок: рендерит текст в байты заданного формата"""
+
+    name = ""
+    content_type = ""
+    extension = ""
+
+    def __init__(self, box_size: int = 10, border: int = 4, error_correction: str = "L",
+                 mask_pattern: Optional[int] = None):
+        if box_size < 1:
+            raise ValueError("box_size должен быть положительным")
+        self.box_size = box_size
+        self.border = max(0, border)
+        self.error_correction = error_correction
+        self.mask_pattern = mask_pattern
+
+    def render(self, text: str) -> bytes:
+        return self.render_matrix(build_matrix(text, self.error_correction, self.border, self.mask_pattern))
+
+    def render_matrix(self, matrix: List[List[bool]]) -> bytes:
+        raise NotImplementedError
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data))
+        + chunk_type
+        + data
+        + struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF)
+    )
+
+
+class PngRenderer(QrRenderer):
+    """1-битный PNG в оттенках серого, записанный напрямую"""
+
+    name = "png"
+    content_type = "image/png"
+    extension = "png"
+
+    def __init__(self, box_size: int = 10, border: int = 4, error_correction: str = "L",
+                 mask_pattern: Optional[int] = None, compress_level: int = 9):
+        super().__init__(box_size, border, error_correction, mask_pattern)
+        self.compress_level = compress_level
+
+    def render_matrix(self, matrix: List[List[bool]]) -> bytes:
+        box = self.box_size
+        modules = len(matrix)
+        size = modules * box
+        padding = -size % 8
+        dark = "0" * box
+        light = "1" * box
+
+        # Каждая строка матрицы — одна строка пикселей (байт фильтра 0 + биты),
+        # повторённая box раз; одинаковые строки матрицы кодируются один раз
+        encoded_rows: Dict[str, bytes] = {}
+        raw = bytearray()
+        for row in matrix:
+            bits = "".join(dark if module else light for module in row) + "1" * padding
+            line = encoded_rows.get(bits)
+            if line is None:
+                line = b"\x00" + int(bits, 2).to_bytes((size + padding) // 8, "big")
+                encoded_rows[bits] = line
+            raw += line * box
+
+        header = struct.pack(">IIBBBBB", size, size, 1, 0, 0, 0, 0)
+        return b"".join((
+            b"\x89PNG\r\n\x1a\n",
+            _png_chunk(b"IHDR", header),
+            _png_chunk(b"IDAT", zlib.compress(bytes(raw), self.compress_level)),
+            _png_chunk(b"IEND", b""),
+        ))
+
+
+class PilPngRenderer(QrRenderer):
+    """PNG через изображение PIL (прежний способ, требует Pillow)"""
+
+    name = "pil"
+    content_type = "image/png"
+    extension = "png"
+
+    def render(self, text: str) -> bytes:
+        if not QRCODE_AVAILABLE:
+            raise RuntimeError("Для генерации QR-кодов нужна библиотека qrcode")
+        qr = qrcode.QRCode(
+            version=None,
+            error_correction=ERROR_CORRECTION_LEVELS[self.error_correction],
+            box_size=self.box_size,
+            border=self.border,
+            mask_pattern=self.mask_pattern,
+        )
+        qr.add_data(text)
+        qr.make(fit=True)
+        img = qr.make_image(fill_color="black", back_color="white")
+        img_bytes = io.BytesIO()
+        img.save(img_bytes, format="PNG")
+        return img_bytes.getvalue()
+
+
+class SvgRenderer(QrRenderer):
+    """SVG: один path из квадратов тёмных модулей"""
+
+    name = "svg"
+    content_type = "image/svg+xml"
+    extension = "svg"
+
+    def render_matrix(self, matrix: List[List[bool]]) -> bytes:
+        modules = len(matrix)
+        size = modules * self.box_size
+        path = "".join(
+            f"M{x},{y}h1v1h-1z"
+            for y, row in enumerate(matrix)
+            for x, module in enumerate(row)
+            if module
+        )
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" '
+            f'viewBox="0 0 {modules} {modules}" shape-rendering="crispEdges">'
+            f'<rect width="100%" height="100%" fill="#fff"/>'
+            f'<path d="{path}" fill="#000"/></svg>'
+        ).encode("utf-8")
+
+
+class TextRenderer(QrRenderer):
+    """Псевдографика для консоли: два символа на модуль, box_size не учитывается"""
+
+    name = "text"
+    content_type = "text/plain; charset=utf-8"
+    extension = "txt"
+
+    def render_matrix(self, matrix: List[List[bool]]) -> bytes:
+        lines = ("".join("██" if module else "  " for module in row) for row in matrix)
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+RENDERERS: Dict[str, Type[QrRenderer]] = {
+    cls.name: cls for cls in (PngRenderer, PilPngRenderer, SvgRenderer, TextRenderer)
+}
+
+
+def get_renderer(name: str = "png", **options) -> QrRenderer:
+    """Движок по имени (options — box_size, border, error_correction, mask_pattern)"""
+    try:
+        renderer_cls = RENDERERS[name]
+    except KeyError:
+        raise ValueError(f"Неизвестный движок QR-кодов: {name} (доступны: {', '.join(RENDERERS)})")
+    return renderer_cls(**options)
@@ -0,0 +1,125 @@
+"""
+Подписанные компактные токены для QR-кодов абонементов
+"""
+import base64
+import hashlib
+import hmac
+import os
+from typing import Dict, Optional
+
+from config import BOT_TOKEN, QR_SIGNING_KEY_VERSION, QR_SIGNING_KEYS
+
+TOKEN_PREFIX = "SUB:"
+MAC_SIZE = 8
+NONCE_SIZE = 4
+
+
+def _encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _decode_varint(data: bytes, offset: int):
+    value = 0
+    shift = 0
+    while offset < len(data) and shift < 64:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+    raise ValueError("Повреждённое число в токене")
+
+
+class QrTokenSigner:
+    """
+    Токен QR-кода: "SUB:" + base32 от
+    [версия ключа (1 байт)][subscription_id (varint)][nonce (4 байта)][HMAC-SHA256, 8 байт].
+
+    Подпись проверяется без обращения к базе, поэтому поддельный или
+    повреждённый код отклоняется сразу, а настоящий сразу даёт
+    subscription_id для поиска по первичному ключу. Nonce делает токен
+    уникальным при перевыпуске QR-кода: старый токен остаётся подписанным,
+    но перестаёт совпадать с qr_code абонемента в базе. Base32 без
+    паддинга укладывается в алфавитно-цифровой режим QR, и код получается
+    менее плотным, чем прежний SUBSCRIPTION:uuid:user_id:subscription_id.
+    """
+
+    def __init__(self, keys: Dict[int, bytes], current_version: int):
+        if current_version not in keys:
+            raise ValueError(f"Нет ключа подписи QR-кодов версии {current_version}")
+        self.keys = keys
+        self.current_version = current_version
+
+    def _mac(self, key: bytes, payload: bytes) -> bytes:
+        return hmac.new(key, payload, hashlib.sha256).digest()[:MAC_SIZE]
+
+    def issue(self, subscription_id: int) -> str:
+        """Новый токен для абонемента"""
+        payload = (
+            bytes([self.current_version])
+            + _encode_varint(subscription_id)
+            + os.urandom(NONCE_SIZE)
+        )
+        raw = payload + self._mac(self.keys[self.current_version], payload)
+        return TOKEN_PREFIX + base64.b32encode(raw).decode("ascii").rstrip("=")
+
+    def verify(self, token: str) -> Optional[int]:
+        """subscription_id из токена или None, если токен повреждён или подделан"""
+        if not is_qr_token(token):
+            return None
+        body = token[len(TOKEN_PREFIX):].strip().upper()
+        try:
+            raw = base64.b32decode(body + "=" * (-len(body) % 8))
+        except ValueError:
+            return None
+        if len(raw) < 1 + 1 + NONCE_SIZE + MAC_SIZE:
+            return None
+
+        payload, mac = raw[:-MAC_SIZE], raw[-MAC_SIZE:]
+        key = self.keys.get(payload[0])
+        if key is None or not hmac.compare_digest(mac, self._mac(key, payload)):
+            return None
+        try:
+            subscription_id, offset = _decode_varint(payload, 1)
+        except ValueError:
+            return None
+        if len(payload) - offset != NONCE_SIZE:
+            return None
+        return subscription_id
+
+
+def is_qr_token(text: str) -> bool:
+    """Похож ли текст на подписанный токен (без проверки подписи)"""
+    return bool(text) and text[:len(TOKEN_PREFIX)].upper() == TOKEN_PREFIX
+
+
+def normalize_qr_token(text: str) -> str:
+    """Токен в том виде, в каком он хранится в базе (введённый вручную мог сменить регистр)"""
+    return TOKEN_PREFIX + text.strip()[len(TOKEN_PREFIX):].strip().upper()
+
+
+def _load_keys() -> Dict[int, bytes]:
+    keys = {}
+    for item in QR_SIGNING_KEYS.split(","):
+        version, sep, secret = item.strip().partition(":")
+        if sep and secret:
+            keys[int(version)] = secret.encode("utf-8")
+    if not keys:
+        # Ключи не заданы — выводим ключ версии 0 из токена бота
+        keys[0] = hmac.new((BOT_TOKEN or "").encode("utf-8"), b"qr-token", hashlib.sha256).digest()
+    return keys
+
+
+_keys = _load_keys()
+
+# Глобальный подписчик токенов QR-кодов (по умолчанию подписывает старшим ключом)
+qr_signer = QrTokenSigner(_keys, max(_keys) if QR_SIGNING_KEY_VERSION is None else QR_SIGNING_KEY_VERSION)
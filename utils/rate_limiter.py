@@ -0,0 +1,38 @@
+"""
+Ограничение частоты операций по ключу (token bucket)
+"""
+import time
+from typing import Dict, Hashable, Tuple
+
+
+class RateLimiter:
+    """
+    Token bucket на каждый ключ: не больше `burst` операций подряд и в
+    среднем `rate` операций в секунду. Неактивные ключи удаляются, чтобы
+    словарь не рос бесконечно.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: Dict[Hashable, Tuple[float, float]] = {}
+
+    def allow(self, key: Hashable) -> bool:
+        """Списать одну операцию для ключа; False — лимит исчерпан"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._cleanup(now)
+        return allowed
+
+    def _cleanup(self, now: float):
+        # Ключ, у которого корзина успела наполниться, эквивалентен новому
+        full_after = self.burst / self.rate if self.rate > 0 else float("inf")
+        for key in [k for k, (_, updated) in self._buckets.items() if now - updated >= full_after]:
+            del self._buckets[key]
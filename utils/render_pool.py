@@ -0,0 +1,70 @@
+"""
+Пул исполнителей для CPU-нагруженной работы (рендер QR-кодов и т.п.)
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from config import RENDER_POOL_MAX_PENDING, RENDER_POOL_MODE, RENDER_POOL_WORKERS
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RenderPool:
+    """
+    Выполняет синхронные функции вне цикла событий.
+
+    mode="thread" — пул потоков (подходит, если функция отпускает GIL или
+    важна только отзывчивость цикла), mode="process" — пул процессов
+    (настоящий параллелизм; функция и аргументы должны сериализоваться pickle).
+    Очередь ограничена: одновременно в пуле не больше max_pending задач,
+    остальные вызывающие ждут свободного места, а не копят задачи в памяти.
+    """
+
+    def __init__(self, workers: int = 2, mode: str = "thread", max_pending: int = 64):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Неизвестный режим пула: {mode}")
+        self.workers = max(1, workers)
+        self.mode = mode
+        self.max_pending = max(1, max_pending)
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.pending = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="render")
+            logger.info(f"Пул рендеринга запущен: {self.mode}, {self.workers} исполнителей")
+        return self._executor
+
+    async def run(self, fn: Callable, *args):
+        """Выполнить fn(*args) в пуле и дождаться результата"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+
+        started = time.perf_counter()
+        async with self._slots:
+            metrics.observe("render_pool.wait", (time.perf_counter() - started) * 1000)
+            self.pending += 1
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._get_executor(), fn, *args)
+            finally:
+                self.pending -= 1
+
+    def shutdown(self, wait: bool = True):
+        """Остановить исполнителей (при следующем вызове run пул создастся заново)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+            logger.info("Пул рендеринга остановлен")
+
+
+# Глобальный пул для рендеринга
+render_pool = RenderPool(RENDER_POOL_WORKERS, RENDER_POOL_MODE, RENDER_POOL_MAX_PENDING)
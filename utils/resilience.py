@@ -0,0 +1,123 @@
+"""
+Защита от сбоев внешних API: автомат отключения (circuit breaker) и бюджет повторов
+"""
+import logging
+import time
+from collections import deque
+from typing import Dict
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Автомат отключения: после failure_threshold сбоев подряд запросы сразу
+    отклоняются (open) в течение recovery_timeout секунд, затем пропускается
+    один пробный запрос (half_open). Успех пробного запроса замыкает автомат,
+    сбой — снова размыкает его.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_timeout = recovery_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+
+    def allow(self) -> bool:
+        """Можно ли выполнить запрос сейчас"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                return False
+            self._set_state(HALF_OPEN)
+        # Полуоткрытый автомат пропускает один пробный запрос (если пробный
+        # запрос отменили и он не вернул результат, через recovery_timeout — новый)
+        now = time.monotonic()
+        if self._probe_in_flight and now - self._probe_started < self.recovery_timeout:
+            return False
+        self._probe_in_flight = True
+        self._probe_started = now
+        return True
+
+    def record_success(self):
+        self._probe_in_flight = False
+        self.failures = 0
+        if self.state != CLOSED:
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        self._probe_in_flight = False
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def _set_state(self, state: str):
+        logger.warning(f"Автомат {self.name}: {self.state} -> {state} (сбоев подряд: {self.failures})")
+        metrics.inc(f"{self.name}.circuit_{state}")
+        self.state = state
+
+    def snapshot(self) -> Dict[str, object]:
+        """Состояние для операторов"""
+        retry_in = 0.0
+        if self.state == OPEN:
+            retry_in = max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at))
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "failure_threshold": self.failure_threshold,
+            "retry_in": round(retry_in, 1),
+        }
+
+
+class RetryBudget:
+    """
+    Бюджет повторов: за последние window секунд повторов может быть не больше
+    ratio от числа запросов (но не меньше min_retries). Когда провайдер
+    отвечает с ошибками, повторы не умножают нагрузку на него.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 3, window: float = 10):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._requests: deque = deque()
+        self._retries: deque = deque()
+
+    def _trim(self, now: float):
+        for events in (self._requests, self._retries):
+            while events and now - events[0] > self.window:
+                events.popleft()
+
+    def record_request(self):
+        now = time.monotonic()
+        self._trim(now)
+        self._requests.append(now)
+
+    def try_acquire(self) -> bool:
+        """Списать один повтор из бюджета; False — бюджет исчерпан"""
+        now = time.monotonic()
+        self._trim(now)
+        if len(self._retries) >= max(self.min_retries, self.ratio * len(self._requests)):
+            return False
+        self._retries.append(now)
+        return True
+
+    def snapshot(self) -> Dict[str, object]:
+        self._trim(time.monotonic())
+        return {
+            "requests": len(self._requests),
+            "retries": len(self._retries),
+            "allowed": int(max(self.min_retries, self.ratio * len(self._requests))),
+        }
@@ -3,6 +3,7 @@
 """
 import asyncio
 import logging
+import random
 from typing import Callable, Any, Optional
 from functools import wraps
 
@@ -15,7 +16,8 @@ async def retry_async(
     delay: float = 1.0,
     backoff: float = 2.0,
     exceptions: tuple = (Exception,),
-    on_retry: Optional[Callable] = None
+    on_retry: Optional[Callable] = None,
+    jitter: float = 0.0
 ) -> Any:
     """
     Повторная попытка выполнения асинхронной функции
@@ -27,6 +29,8 @@ async def retry_async(
         backoff: Множитель для увеличения задержки
         exceptions: Кортеж исключений, при которых нужно повторять
         on_retry: Функция, вызываемая при каждой повторной попытке
+            (исключение из неё прекращает повторы)
+        jitter: Случайное отклонение задержки (0.5 — от 50% до 150%)
     """
     last_exception = None
     current_delay = delay
@@ -39,11 +43,12 @@ async def retry_async(
             if attempt < max_attempts:
                 if on_retry:
                     on_retry(attempt, e)
+                sleep_for = current_delay * random.uniform(1 - jitter, 1 + jitter) if jitter else current_delay
                 logger.warning(
                     f"Попытка {attempt}/{max_attempts} не удалась: {e}. "
-                    f"Повтор через {current_delay:.1f} сек..."
+                    f"Повтор через {sleep_for:.1f} сек..."
                 )
-                await asyncio.sleep(current_delay)
+                await asyncio.sleep(sleep_for)
                 current_delay *= backoff
             else:
                 logger.error(f"Все {max_attempts} попыток не удались. Последняя ошибка: {e}")
@@ -0,0 +1,123 @@
+"""
+Журнал офлайн-сканирований: разбор выгрузки со стойки и отчёт по результатам
+"""
+import csv
+import io
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional, Tuple
+
+from config import SCAN_JOURNAL_MAX_AGE_DAYS, SCAN_JOURNAL_UTC_OFFSET
+from utils.timeutils import SECONDS_PER_DAY, utc_timestamp
+
+# Запись журнала: номер строки в файле, текст QR-кода, время сканирования (UTC, сек)
+ScanRecord = namedtuple("ScanRecord", ["line", "qr_text", "scanned_at"])
+
+# Допустимое опережение часов стойки относительно сервера (сек)
+CLOCK_SKEW = 5 * 60
+
+_DATETIME_FORMATS = (
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%d.%m.%Y %H:%M:%S",
+    "%d.%m.%Y %H:%M",
+)
+
+
+def parse_scanned_at(value: str, utc_offset_hours: float = SCAN_JOURNAL_UTC_OFFSET) -> Optional[int]:
+    """
+    Время сканирования в секундах UTC или None.
+    Принимает unix-время (секунды или миллисекунды), ISO 8601 и
+    «ДД.ММ.ГГГГ ЧЧ:ММ[:СС]»; время без часового пояса считается местным
+    со смещением utc_offset_hours.
+    """
+    value = value.strip()
+    if not value:
+        return None
+    if value.isdigit():
+        ts = int(value)
+        return ts // 1000 if ts > 10 ** 11 else ts
+
+    parsed = None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        for fmt in _DATETIME_FORMATS:
+            try:
+                parsed = datetime.strptime(value, fmt)
+                break
+            except ValueError:
+                continue
+    if parsed is None:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone(timedelta(hours=utc_offset_hours)))
+    return int(parsed.timestamp())
+
+
+def parse_scan_journal(text: str, now_ts: int = None,
+                       max_age_days: int = SCAN_JOURNAL_MAX_AGE_DAYS
+                       ) -> Tuple[List[ScanRecord], List[Tuple[int, str, str]]]:
+    """
+    Разобрать журнал: по строке «QR-код;время» (разделитель , ; или табуляция,
+    строка заголовка необязательна).
+
+    Returns: (записи, ошибки), ошибка — (номер строки, текст строки, причина)
+    """
+    if now_ts is None:
+        now_ts = utc_timestamp()
+    oldest_ts = now_ts - max_age_days * SECONDS_PER_DAY
+
+    sample = text[:4096]
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+
+    records = []
+    errors = []
+    for line_number, row in enumerate(csv.reader(io.StringIO(text), dialect), 1):
+        fields = [field.strip() for field in row]
+        if not any(fields):
+            continue
+        raw = dialect.delimiter.join(fields)
+        if len(fields) < 2:
+            errors.append((line_number, raw, "нет времени сканирования"))
+            continue
+
+        scanned_at = parse_scanned_at(fields[1])
+        if scanned_at is None:
+            if line_number == 1:
+                # Строка заголовка
+                continue
+            errors.append((line_number, raw, "неверный формат времени"))
+        elif scanned_at > now_ts + CLOCK_SKEW:
+            errors.append((line_number, raw, "время сканирования в будущем"))
+        elif scanned_at < oldest_ts:
+            errors.append((line_number, raw, f"запись старше {max_age_days} дн."))
+        else:
+            records.append(ScanRecord(line_number, fields[0], scanned_at))
+    return records, errors
+
+
+def format_journal_report(rows: Iterable[dict]) -> bytes:
+    """
+    Отчёт по журналу в CSV (UTF-8 с BOM, чтобы Excel открыл кириллицу).
+    rows — словари с ключами line, qr_code, scanned_at, result и
+    необязательными student_name, lessons_remaining, reason.
+    """
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=";")
+    writer.writerow(["line", "qr_code", "scanned_at_utc", "result", "student", "lessons_remaining", "reason"])
+    for row in sorted(rows, key=lambda r: r["line"]):
+        scanned_at = row.get("scanned_at")
+        writer.writerow([
+            row["line"],
+            row.get("qr_code") or "",
+            datetime.fromtimestamp(scanned_at, timezone.utc).strftime("%Y-%m-%d %H:%M:%S") if scanned_at else "",
+            row["result"],
+            row.get("student_name") or "",
+            "" if row.get("lessons_remaining") is None else row["lessons_remaining"],
+            row.get("reason") or "",
+        ])
+    return output.getvalue().encode("utf-8-sig")
@@ -0,0 +1,50 @@
+"""
+Работа с временем в базе данных
+
+Время посещений и платежей хранится как целое число секунд с начала эпохи
+(UTC) плюс номер суток UTC. По таким колонкам SQLite строит обычные
+диапазонные запросы по индексу, без вызова date()/strftime() для каждой строки.
+"""
+import time
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+SECONDS_PER_DAY = 86400
+
+
+def utc_timestamp() -> int:
+    """Текущее время UTC в секундах"""
+    return int(time.time())
+
+
+def day_bucket(ts: Optional[int] = None) -> int:
+    """Номер суток UTC для метки времени (по умолчанию — для текущего момента)"""
+    if ts is None:
+        ts = utc_timestamp()
+    return ts // SECONDS_PER_DAY
+
+
+def day_start(day: int) -> int:
+    """Начало суток UTC с номером day"""
+    return day * SECONDS_PER_DAY
+
+
+def local_day_start(utc_offset_hours: float, ts: Optional[int] = None) -> int:
+    """
+    Начало (UTC, в секундах) местных суток со смещением utc_offset_hours,
+    в которые попадает ts (по умолчанию — текущий момент)
+    """
+    if ts is None:
+        ts = utc_timestamp()
+    offset = int(utc_offset_hours * 3600)
+    return (ts + offset) // SECONDS_PER_DAY * SECONDS_PER_DAY - offset
+
+
+def month_bounds(year: int, month: int) -> Tuple[int, int]:
+    """Полуинтервал [начало, конец) календарного месяца UTC"""
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    if month == 12:
+        end = datetime(year + 1, 1, 1, tzinfo=timezone.utc)
+    else:
+        end = datetime(year, month + 1, 1, tzinfo=timezone.utc)
+    return int(start.timestamp()), int(end.timestamp())
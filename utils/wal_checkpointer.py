@@ -0,0 +1,62 @@
+"""
+Периодический checkpoint WAL-журнала SQLite
+"""
+import asyncio
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WalCheckpointer:
+    """Периодически переносит WAL-журнал в основной файл, чтобы он не рос бесконечно"""
+
+    def __init__(self, db, interval: int = 300, mode: str = "TRUNCATE"):
+        self.db = db
+        self.interval = interval  # Интервал в секундах
+        self.mode = mode
+        self.running = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def checkpoint(self):
+        """Выполнить один checkpoint"""
+        try:
+            busy, log_frames, checkpointed = await self.db.wal_checkpoint(self.mode)
+            if busy:
+                logger.warning(
+                    f"WAL checkpoint ({self.mode}) не завершён: база занята, "
+                    f"перенесено {checkpointed}/{log_frames} страниц"
+                )
+            else:
+                logger.debug(f"WAL checkpoint ({self.mode}): перенесено {checkpointed}/{log_frames} страниц")
+        except Exception as e:
+            logger.error(f"Ошибка при WAL checkpoint: {e}", exc_info=True)
+
+    async def start(self):
+        """Запуск периодического checkpoint"""
+        if self.running or self.interval <= 0:
+            return
+
+        self.running = True
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"WAL checkpoint запущен (каждые {self.interval} сек, режим {self.mode})")
+
+    async def stop(self):
+        """Остановка периодического checkpoint"""
+        self.running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        logger.info("WAL checkpoint остановлен")
+
+    async def _run(self):
+        """Основной цикл"""
+        while self.running:
+            try:
+                await asyncio.sleep(self.interval)
+                await self.checkpoint()
+            except asyncio.CancelledError:
+                break